@@ -0,0 +1,214 @@
+import os
+import time
+import shutil
+import subprocess
+
+class AutoMount:
+    """
+    A class to unlock and mount the storage partition of a Secure USB device on the host, as soon as it is plugged in.
+
+    The host gets its own keyfile, enrolled in a separate key slot of the storage partition with the cheap key
+    derivation of keyfile slots (see Luks.keyfile_options), so it can be revoked on its own ('cryptsetup
+    luksKillSlot'). Unlocking names that slot ('--key-slot'): cryptsetup does not try the expensive passphrase
+    slot first, and opening takes milliseconds instead of the seconds of a passphrase.
+
+    Installed on the host ('install'):
+
+        /etc/secure-usb/luks_<uuid>.keyfile              the host keyfile (mode 400)
+        /etc/udev/rules.d/99-secure-usb-<uuid>.rules     on the 'add' uevent of the partition (ID_FS_UUID is
+                                                         the LUKS UUID), starts the service
+        /etc/systemd/system/secure-usb-<uuid>.service    unlocks and mounts; bound to the device, so unplugging
+                                                         unmounts and closes it
+
+    The service runs 'cryptsetup open' and 'mount' directly (no script, no 'udevadm settle'), so plug-in to
+    mounted takes about the unlock time plus the btrfs mount. Mounting is not done in the udev rule itself:
+    udev runs RUN programs in a private mount namespace and kills them after a timeout.
+
+    'handle' runs the same commands for a uevent given as a dict, without udev and systemd, e.g. for a test
+    with a loop device and a synthetic uevent.
+
+    Usage:
+        automount = AutoMount(uuid, options='noatime,compress=zstd:3,subvol=@snapshots')
+        automount.install('/run/secure-usb/luks_host.keyfile') and automount.reload()
+        automount.handle({'ACTION': 'add', 'SUBSYSTEM': 'block', 'ID_FS_UUID': uuid, 'DEVNAME': '/dev/loop0'})
+    """
+
+    KEY_SLOT = 2    # Key slot of the host keyfile (0: keyfile of the device's own Linux, 1: passphrase)
+
+    def __init__(self, uuid, mount_point='/storage', options='defaults', fstype='btrfs', key_slot=KEY_SLOT, root='/'):
+        """
+        Initializes the AutoMount.
+
+        Args:
+            uuid (str): The LUKS UUID of the storage partition (e.g. {PART4_UUID}), also the name of the mapping.
+            mount_point (str, optional): Where the storage partition is mounted on the host. Defaults to '/storage'.
+            options (str, optional): Mount options (e.g. {PART4_MOUNT_OPTS}). Defaults to 'defaults'.
+            fstype (str, optional): File system of the storage partition. Defaults to 'btrfs'.
+            key_slot (int, optional): Key slot of the host keyfile. Defaults to KEY_SLOT.
+            root (str, optional): Root directory the files are installed under. Defaults to '/'.
+        """
+        self.uuid = uuid
+        self.mount_point = mount_point
+        self.options = options or 'defaults'
+        self.fstype = fstype
+        self.key_slot = key_slot
+        self.root = root
+        self.name = f'secure-usb-{uuid}'
+        self.keyfile = f'/etc/secure-usb/luks_{uuid}.keyfile'
+        self.rule_file = f'/etc/udev/rules.d/99-secure-usb-{uuid}.rules'
+        self.unit_file = f'/etc/systemd/system/{self.name}.service'
+        self.result = None
+
+    @staticmethod
+    def _escape(path):
+        """Returns the systemd unit name of a path (as 'systemd-escape --path')."""
+        escaped = []
+        for index, character in enumerate(path.strip('/')):
+            if character == '/':
+                escaped.append('-')
+            elif character.isascii() and (character.isalnum() or character in ':_' or (character == '.' and index > 0)):
+                escaped.append(character)
+            else:
+                escaped.append(''.join(f'\\x{byte:02x}' for byte in character.encode()))
+        return ''.join(escaped)
+
+    @staticmethod
+    def _program(name):
+        """Returns the absolute path of a program (systemd wants absolute paths), or the name if not found."""
+        return shutil.which(name, path='/usr/sbin:/usr/bin:/sbin:/bin') or name
+
+    def start_commands(self, device=None, keyfile=None):
+        """
+        Returns the commands unlocking and mounting the storage partition.
+
+        Args:
+            device (str, optional): The LUKS partition. Defaults to None ('/dev/disk/by-uuid/<uuid>').
+            keyfile (str, optional): The host keyfile. Defaults to None (the installed one).
+
+        Returns:
+            list: The commands, as argument lists.
+        """
+        device = device or f'/dev/disk/by-uuid/{self.uuid}'
+        return [
+            [AutoMount._program('cryptsetup'), 'open', '--key-file', keyfile or self.keyfile, '--key-slot', str(self.key_slot), device, self.uuid],
+            [AutoMount._program('mkdir'), '-p', self.mount_point],
+            [AutoMount._program('mount'), '-t', self.fstype, '-o', self.options, f'/dev/mapper/{self.uuid}', self.mount_point],
+        ]
+
+    def stop_commands(self):
+        """
+        Returns:
+            list: The commands unmounting and closing the storage partition, as argument lists.
+        """
+        return [
+            [AutoMount._program('umount'), self.mount_point],
+            [AutoMount._program('cryptsetup'), 'close', self.uuid],
+        ]
+
+    def rule(self):
+        """
+        Returns:
+            str: The udev rule starting the service when the storage partition appears.
+        """
+        return (f'# Secure USB: unlock and mount the storage partition {self.uuid} (see {self.unit_file})\n'
+                f'ACTION=="add", SUBSYSTEM=="block", ENV{{ID_FS_UUID}}=="{self.uuid}", '
+                f'TAG+="systemd", ENV{{SYSTEMD_WANTS}}+="{self.name}.service"\n')
+
+    def unit(self):
+        """
+        Returns:
+            str: The systemd service unlocking and mounting the storage partition.
+        """
+        device = AutoMount._escape(f'/dev/disk/by-uuid/{self.uuid}') + '.device'
+        command = lambda arguments: ' '.join(argument.replace('%', '%%') for argument in arguments)
+        lines = [
+            '[Unit]',
+            f'Description=Secure USB storage partition {self.uuid}',
+            f'BindsTo={device}',
+            f'After={device}',
+            '',
+            '[Service]',
+            'Type=oneshot',
+            'RemainAfterExit=yes',
+            *(f'ExecStart={command(arguments)}' for arguments in self.start_commands()),
+            # '-': closing continues when unmounting failed (e.g. the device is already gone)
+            *(f'ExecStop=-{command(arguments)}' for arguments in self.stop_commands()),
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def _path(self, path):
+        """Returns a path below the root directory."""
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def install(self, keyfile):
+        """
+        Installs the host keyfile, the udev rule and the systemd service.
+
+        Args:
+            keyfile (str): The host keyfile, enrolled in 'key_slot' of the storage partition.
+
+        Returns:
+            bool: True if every file was installed.
+        """
+        try:
+            os.makedirs(os.path.dirname(self._path(self.keyfile)), mode=0o700, exist_ok=True)
+            shutil.copyfile(keyfile, self._path(self.keyfile))
+            os.chmod(self._path(self.keyfile), 0o400)
+            for path, content in ((self.rule_file, self.rule()), (self.unit_file, self.unit())):
+                os.makedirs(os.path.dirname(self._path(path)), exist_ok=True)
+                with open(self._path(path), 'w') as f:
+                    f.write(content)
+        except OSError:
+            return False
+        return True
+
+    def reload(self):
+        """
+        Makes udev and systemd read the installed files.
+
+        Returns:
+            bool: True if both reloaded.
+        """
+        commands = [['udevadm', 'control', '--reload'], ['systemctl', 'daemon-reload']]
+        try:
+            return all(subprocess.run(arguments, capture_output=True).returncode == 0 for arguments in commands)
+        except FileNotFoundError:
+            return False
+
+    def matches(self, uevent):
+        """
+        Args:
+            uevent (dict): The properties of a uevent (e.g. ACTION, SUBSYSTEM, ID_FS_UUID, DEVNAME).
+
+        Returns:
+            bool: True if the uevent is about the storage partition (as the udev rule, for any action).
+        """
+        return uevent.get('SUBSYSTEM') == 'block' and uevent.get('ID_FS_UUID') == self.uuid
+
+    def handle(self, uevent):
+        """
+        Unlocks and mounts ('add') or unmounts and closes ('remove') the storage partition for a uevent, as the
+        service does. The result is stored in 'result': 'action', 'device', 'seconds' and 'error'.
+
+        Args:
+            uevent (dict): The properties of a uevent (see 'matches'); DEVNAME is the partition.
+
+        Returns:
+            bool: True if the uevent was handled, False if it failed or is not about the storage partition.
+        """
+        action = uevent.get('ACTION')
+        if not self.matches(uevent) or action not in ('add', 'remove'):
+            return False
+        started = time.monotonic()
+        self.result = {'action': action, 'device': uevent.get('DEVNAME'), 'seconds': 0.0, 'error': None}
+        commands = self.start_commands(uevent.get('DEVNAME'), self._path(self.keyfile)) if action == 'add' else self.stop_commands()
+        for arguments in commands:
+            try:
+                process = subprocess.run(arguments, capture_output=True, text=True)
+            except FileNotFoundError as e:
+                process = subprocess.CompletedProcess(arguments, 127, '', str(e))
+            if process.returncode != 0 and action == 'add':
+                self.result['error'] = process.stderr.strip() or f'{arguments[0]} failed'
+                break
+        self.result['seconds'] = time.monotonic() - started
+        return self.result['error'] is None
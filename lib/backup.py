@@ -0,0 +1,277 @@
+import os
+import time
+import errno
+import subprocess
+from rich.table import Table
+from rich.text import Text
+
+class Backup:
+    """
+    A class to back up a btrfs subvolume of the host onto the storage partition with btrfs send/receive.
+
+    Every run takes a read-only snapshot of the source on the host and streams it into the snapshots
+    subvolume of the storage partition ('btrfs send | btrfs receive'). When an earlier snapshot exists
+    on both sides, it is the parent of the send ('btrfs send -p'), and only the extents changed since
+    then are transferred, instead of walking and copying the whole tree.
+
+    The stream is moved from 'btrfs send' to 'btrfs receive' with splice(2): the data moves between the
+    two pipes inside the kernel, without being copied through this process.
+
+    Snapshots are named '<prefix>.<UTC time>' (e.g. 'home.20240131T220000Z'), so they sort by age:
+
+        host     <snapshots>/home.20240130T220000Z   only the newest is kept, as the next parent
+        storage  <target>/home.20240130T220000Z      the newest 'keep' are kept
+
+    Usage:
+        backup = Backup('/home', '/storage')
+        if backup.run(): print(backup.result['bytes'], backup.result['rate'])
+    """
+
+    CHUNK = 1024 * 1024     # Bytes moved per splice call
+
+    def __init__(self, source, target, snapshots=None, keep=14, prefix=None):
+        """
+        Initializes the Backup.
+
+        Args:
+            source (str): The btrfs subvolume to back up (e.g. '/home').
+            target (str): The directory on the storage partition receiving the snapshots (e.g. '/storage').
+            snapshots (str, optional): Directory for the snapshots on the host, on the file system of the source.
+                                       Defaults to None ('<source>/.snapshots').
+            keep (int, optional): Number of snapshots kept on the storage partition. Defaults to 14.
+            prefix (str, optional): Name prefix of the snapshots. Defaults to None (the name of the source, 'root' for '/').
+        """
+        self.source = os.path.abspath(source)
+        self.target = os.path.abspath(target)
+        self.snapshots = snapshots or os.path.join(self.source, '.snapshots')
+        self.keep = max(1, keep)
+        self.prefix = prefix or os.path.basename(self.source.rstrip('/')) or 'root'
+        self.result = None
+
+    @staticmethod
+    def _btrfs(*arguments):
+        """Runs a btrfs command, returns the CompletedProcess (returncode 127 when btrfs is missing)."""
+        try:
+            return subprocess.run(['btrfs', *arguments], capture_output=True, text=True)
+        except FileNotFoundError as e:
+            return subprocess.CompletedProcess(['btrfs', *arguments], 127, '', str(e))
+
+    @staticmethod
+    def show(path):
+        """
+        Returns:
+            dict: The fields of 'btrfs subvolume show' (e.g. 'UUID', 'Received UUID'), empty if not a subvolume.
+        """
+        result = Backup._btrfs('subvolume', 'show', path)
+        if result.returncode != 0:
+            return {}
+        fields = {}
+        for line in result.stdout.splitlines()[1:]:
+            key, separator, value = line.strip().partition(':')
+            if separator:
+                fields[key.strip()] = value.strip()
+        return fields
+
+    def _names(self, directory):
+        """Returns the snapshots of this source in a directory, oldest first."""
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        return sorted(name for name in names if name.startswith(self.prefix + '.'))
+
+    def local(self):
+        """
+        Returns:
+            list: The names of the snapshots on the host, oldest first.
+        """
+        return self._names(self.snapshots)
+
+    def remote(self):
+        """
+        Returns:
+            dict: The snapshots on the storage partition as {name: received UUID}, oldest first. The received
+                  UUID is None for an incomplete snapshot (an interrupted receive).
+        """
+        remote = {}
+        for name in self._names(self.target):
+            received = Backup.show(os.path.join(self.target, name)).get('Received UUID', '-')
+            remote[name] = received if received != '-' else None
+        return remote
+
+    def parent(self, remote=None):
+        """
+        Finds the parent of an incremental send: the newest snapshot on the host that was completely received
+        on the storage partition (its UUID is the received UUID of the copy).
+
+        Args:
+            remote (dict, optional): The snapshots on the storage partition (see 'remote'). Defaults to None (read).
+
+        Returns:
+            str: The name of the parent, or None (a full send).
+        """
+        remote = self.remote() if remote is None else remote
+        for name in reversed(self.local()):
+            if remote.get(name) and remote[name] == Backup.show(os.path.join(self.snapshots, name)).get('UUID'):
+                return name
+        return None
+
+    @staticmethod
+    def _pump(source, target, progress=None, chunk=CHUNK):
+        """
+        Moves a stream between two file descriptors until the end of the source, with splice(2) where possible.
+
+        Args:
+            source (int): File descriptor to read (a pipe).
+            target (int): File descriptor to write (a pipe).
+            progress (callable, optional): Called with (bytes moved, None). Defaults to None.
+            chunk (int, optional): Bytes per call. Defaults to CHUNK.
+
+        Returns:
+            int: The number of bytes moved.
+        """
+        moved = 0
+        splice = hasattr(os, 'splice')
+        while True:
+            if splice:
+                try:
+                    count = os.splice(source, target, chunk)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+                    splice = False      # Not supported for these descriptors: copy instead
+                    continue
+            else:
+                data = os.read(source, chunk)
+                count = len(data)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(target, view):]
+            if count == 0:
+                return moved
+            moved += count
+            if progress is not None:
+                progress(moved, None)
+
+    def send(self, name, parent=None, progress=None):
+        """
+        Streams a snapshot of the host into the storage partition.
+
+        Args:
+            name (str): The snapshot.
+            parent (str, optional): The parent snapshot, present on both sides. Defaults to None (a full send).
+            progress (callable, optional): Called with (bytes sent, None). Defaults to None.
+
+        Returns:
+            tuple: (success, bytes sent, error message).
+        """
+        command = ['btrfs', 'send', *(['-p', os.path.join(self.snapshots, parent)] if parent else []), os.path.join(self.snapshots, name)]
+        try:
+            sender = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as e:
+            return False, 0, str(e)
+        receiver = subprocess.Popen(['btrfs', 'receive', self.target], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        moved, error = 0, ''
+        try:
+            moved = Backup._pump(sender.stdout.fileno(), receiver.stdin.fileno(), progress)
+        except OSError as e:
+            error = str(e)      # e.g. the receiver failed (EPIPE)
+            sender.kill()
+        finally:
+            receiver.stdin.close()
+            sender.stdout.close()
+        sent, received = sender.wait(), receiver.wait()
+        errors = [error, sender.stderr.read().decode(errors='replace').strip(), receiver.stderr.read().decode(errors='replace').strip()]
+        sender.stderr.close()
+        receiver.stderr.close()
+        return sent == 0 and received == 0 and not error, moved, '\n'.join(text for text in errors if text)
+
+    def prune(self):
+        """
+        Deletes old snapshots: on the storage partition all but the newest 'keep' complete ones (and incomplete
+        ones), on the host all but the parent of the next run.
+
+        Returns:
+            list: The paths of the deleted snapshots.
+        """
+        deleted = []
+        remote = self.remote()
+        complete = [name for name, received in remote.items() if received]
+        for name in [name for name, received in remote.items() if not received] + complete[:-self.keep]:
+            path = os.path.join(self.target, name)
+            if Backup._btrfs('subvolume', 'delete', path).returncode == 0:
+                deleted.append(path)
+
+        parent = self.parent(remote)
+        for name in self.local():
+            if name != parent:
+                path = os.path.join(self.snapshots, name)
+                if Backup._btrfs('subvolume', 'delete', path).returncode == 0:
+                    deleted.append(path)
+        return deleted
+
+    def run(self, progress=None):
+        """
+        Backs up the source: snapshot, incremental send, prune. The result is stored in 'result': 'source',
+        'snapshot', 'parent', 'bytes', 'seconds', 'rate' (bytes per second), 'pruned' and 'error'.
+
+        Args:
+            progress (callable, optional): Called with (bytes sent, None). Defaults to None.
+
+        Returns:
+            bool: True if the snapshot was received on the storage partition.
+        """
+        self.result = {'source': self.source, 'snapshot': None, 'parent': None, 'bytes': 0, 'seconds': 0.0, 'rate': None, 'pruned': [], 'error': None}
+        if not os.path.isdir(self.target):
+            self.result['error'] = f'{self.target} does not exist (storage partition not mounted?)'
+            return False
+
+        # Remove incomplete snapshots of an interrupted run first: a receive does not overwrite them
+        self.prune()
+        parent = self.parent()
+
+        name = f"{self.prefix}.{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}"
+        os.makedirs(self.snapshots, exist_ok=True)
+        snapshot = Backup._btrfs('subvolume', 'snapshot', '-r', self.source, os.path.join(self.snapshots, name))
+        if snapshot.returncode != 0:
+            self.result['error'] = snapshot.stderr.strip()
+            return False
+
+        started = time.monotonic()
+        success, moved, error = self.send(name, parent, progress)
+        seconds = time.monotonic() - started
+        self.result.update(snapshot=name, parent=parent, bytes=moved, seconds=seconds, rate=moved / seconds if seconds > 0 else None,
+                           error=None if success else error or 'btrfs send/receive failed')
+
+        if not success:
+            # Keep the previous parent: drop the new snapshot on both sides
+            Backup._btrfs('subvolume', 'delete', os.path.join(self.target, name))
+            Backup._btrfs('subvolume', 'delete', os.path.join(self.snapshots, name))
+            return False
+
+        self.result['pruned'] = self.prune()
+        return True
+
+    @staticmethod
+    def report(console, results):
+        """
+        Prints the results of backups (see 'run') on the rich console.
+
+        Args:
+            console (Console): The rich console object.
+            results (list): The 'result' of every backup.
+        """
+        table = Table(title='Backups')
+        table.add_column('Source')
+        table.add_column('Snapshot')
+        table.add_column('Parent')
+        table.add_column('Sent', justify='right')
+        table.add_column('Time', justify='right')
+        table.add_column('Rate', justify='right')
+        table.add_column('Pruned', justify='right')
+        for result in results:
+            rate = f"{result['rate'] / 1e6:.1f} MB/s" if result['rate'] else '-'
+            table.add_row(Text(result['source']), Text(result['snapshot'] or result['error'] or '-'), Text(result['parent'] or 'full'),
+                          f"{result['bytes'] / 1e6:.1f} MB", f"{result['seconds']:.1f}s", rate, str(len(result['pruned'])))
+        console.print(table)
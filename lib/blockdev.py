@@ -0,0 +1,191 @@
+import os
+import time
+import select
+import socket
+import threading
+
+class BlockDevices:
+    """
+    A class to discover block devices and their partitions from /sys/class/block, without subprocesses.
+
+    Results are cached until the kernel reports a change of a block device: a NETLINK uevent socket
+    (the same events udev receives) is drained before every lookup, and any 'block' event invalidates
+    the cache. Without the socket (e.g. no permission) nothing is cached.
+
+    Usage:
+        devices = BlockDevices()
+        for drive in devices.drives(): print(drive['path'], drive['size'], drive['model'])
+        part3 = devices.wait_partition('/dev/sdb', 3)
+    """
+
+    NETLINK_KOBJECT_UEVENT = 15
+
+    # Devices that are never installation targets
+    VIRTUAL_PREFIXES = ('loop', 'ram', 'zram', 'dm-', 'md', 'sr', 'fd', 'nbd')
+
+    def __init__(self, sysfs='/sys/class/block', dev='/dev'):
+        """
+        Initializes the BlockDevices and subscribes to the kernel uevents.
+
+        Args:
+            sysfs (str, optional): The sysfs block class directory. Defaults to '/sys/class/block'.
+            dev (str, optional): The device node directory. Defaults to '/dev'.
+        """
+        self.sysfs = sysfs
+        self.dev = dev
+        self.cache = {}
+        self.lock = threading.Lock()
+        try:
+            self.uevents = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, BlockDevices.NETLINK_KOBJECT_UEVENT)
+            self.uevents.bind((0, 1))   # Multicast group 1: kernel events
+            self.uevents.setblocking(False)
+        except (OSError, AttributeError):
+            self.uevents = None
+
+    def close(self):
+        """Closes the uevent socket."""
+        if self.uevents is not None:
+            self.uevents.close()
+            self.uevents = None
+
+    def _drain(self):
+        """
+        Reads all pending uevents, and clears the cache if a block device changed.
+
+        Returns:
+            bool: True if a block device event was received.
+        """
+        if self.uevents is None:
+            self.cache.clear()
+            return False
+        changed = False
+        while True:
+            try:
+                message = self.uevents.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                changed = True      # Events lost (receive buffer overrun): assume a change
+                break
+            # A uevent is 'action@devpath' followed by NUL separated KEY=VALUE fields
+            if b'\0SUBSYSTEM=block\0' in message + b'\0':
+                changed = True
+        if changed:
+            self.cache.clear()
+        return changed
+
+    def _cached(self, key, function):
+        """Returns a cached result, computing it if needed."""
+        with self.lock:
+            self._drain()
+            if key not in self.cache:
+                self.cache[key] = function()
+            return self.cache[key]
+
+    def _read(self, name, attribute, default=None):
+        """Reads an attribute of a block device from sysfs as a stripped string, or returns the default."""
+        try:
+            with open(os.path.join(self.sysfs, name, attribute), 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return default
+
+    def _transport(self, name):
+        """Determines how a drive is connected ('usb', 'nvme', 'sata', 'mmc', 'virtio', 'scsi' or 'unknown')."""
+        path = os.path.realpath(os.path.join(self.sysfs, name))
+        for marker, transport in (('/usb', 'usb'), ('/nvme', 'nvme'), ('/ata', 'sata'), ('/mmc', 'mmc'), ('/virtio', 'virtio'), ('/host', 'scsi')):
+            if marker in path:
+                return transport
+        return 'unknown'
+
+    def _scan(self):
+        """Reads all drives (whole disks) with their partitions from sysfs."""
+        drives = {}
+        try:
+            names = sorted(os.listdir(self.sysfs))
+        except OSError:
+            return drives
+
+        for name in names:
+            partition = self._read(name, 'partition')
+            if partition is None:
+                drives.setdefault(name, {'partitions': {}})
+                drives[name].update({
+                    'name': name,
+                    'path': os.path.join(self.dev, name),
+                    'size': int(self._read(name, 'size', '0')) * 512,
+                    'model': self._read(name, 'device/model', ''),
+                    'vendor': self._read(name, 'device/vendor', ''),
+                    'removable': self._read(name, 'removable') == '1',
+                    'transport': self._transport(name),
+                })
+            else:
+                # The parent of a partition is the directory above it in the device tree
+                parent = os.path.basename(os.path.dirname(os.path.realpath(os.path.join(self.sysfs, name))))
+                drives.setdefault(parent, {'partitions': {}})['partitions'][int(partition)] = os.path.join(self.dev, name)
+        return {name: drive for name, drive in drives.items() if 'path' in drive}
+
+    def drives(self, virtual=False):
+        """
+        Returns the drives (whole disks).
+
+        Args:
+            virtual (bool, optional): Include loop, RAM, device mapper and optical devices. Defaults to False.
+
+        Returns:
+            list: Per drive a dict with 'name', 'path', 'size' (bytes), 'model', 'vendor', 'removable',
+                  'transport' and 'partitions' ({number: path}).
+        """
+        drives = self._cached('drives', self._scan).values()
+        return [drive for drive in drives if virtual or not drive['name'].startswith(BlockDevices.VIRTUAL_PREFIXES)]
+
+    def drive(self, device):
+        """
+        Returns:
+            dict: The drive of a device path (e.g. '/dev/sdb', see 'drives'), or None if not found.
+        """
+        return self._cached('drives', self._scan).get(os.path.basename(device))
+
+    def partitions(self, device):
+        """
+        Returns:
+            dict: The partitions of a drive as {number: path}, empty if the drive is not found.
+        """
+        drive = self.drive(device)
+        return dict(drive['partitions']) if drive else {}
+
+    def partition(self, device, number):
+        """
+        Returns:
+            str: The path of a partition by number (e.g. '/dev/nvme0n1p3'), or None if not found.
+        """
+        return self.partitions(device).get(number)
+
+    def wait_partition(self, device, number, timeout=10):
+        """
+        Waits until a partition is known to the kernel and its device node was created by udev
+        (e.g. after sgdisk wrote a new partition table).
+
+        Args:
+            device (str): The drive (e.g. '/dev/sdb').
+            number (int): The partition number.
+            timeout (float, optional): Seconds to wait. Defaults to 10.
+
+        Returns:
+            str: The path of the partition, or None when it did not appear in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            path = self.partition(device, number)
+            if path is not None and os.path.exists(path):
+                return path
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Sleep until the next uevent (or poll, without the uevent socket)
+            if self.uevents is not None:
+                select.select([self.uevents], [], [], min(remaining, 0.5))
+            else:
+                time.sleep(min(remaining, 0.05))
+            with self.lock:
+                self.cache.clear()     # The device node may appear without a new kernel event
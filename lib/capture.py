@@ -0,0 +1,68 @@
+from collections import deque
+
+class Capture:
+    """
+    A class to capture command output lines with bounded memory.
+
+    The first 'head' lines and the last 'tail' lines are kept; the lines in between are counted
+    but dropped, and shown as a single elision marker by 'text'. Blank lines are not kept.
+
+    With 'keep' every line is also kept as it was (blank lines too), for the value of the output ('value').
+    """
+
+    def __init__(self, head=None, tail=None, keep=False):
+        """
+        Initializes the Capture.
+
+        Args:
+            head (int, optional): Number of leading lines kept. Defaults to None (keep all lines).
+            tail (int, optional): Number of trailing lines kept once the head is full. Defaults to None (keep all lines).
+            keep (bool, optional): Also keep every line unbounded (see 'value'). Defaults to False.
+        """
+        self.head_size = head
+        self.head = []
+        self.tail = deque(maxlen=tail) if head is not None and tail is not None else None
+        self.lines = 0      # Total number of (non-blank) lines captured
+        self.all = [] if keep else None
+
+    def append(self, line):
+        """
+        Adds a line.
+
+        Args:
+            line (str): The line (without line ending).
+        """
+        if self.all is not None:
+            self.all.append(line)
+        line = line.rstrip()
+        if not line:
+            return
+        self.lines += 1
+        if self.tail is None or len(self.head) < self.head_size:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+
+    @property
+    def elided(self):
+        """Number of lines dropped between the head and the tail."""
+        return self.lines - len(self.head) - (len(self.tail) if self.tail is not None else 0)
+
+    def text(self):
+        """
+        Returns:
+            str: The captured lines, with a marker where lines were dropped.
+        """
+        lines = list(self.head)
+        if self.elided:
+            lines.append(f'... [{self.elided} lines elided] ...')
+        if self.tail:
+            lines.extend(self.tail)
+        return '\n'.join(lines).strip()
+
+    def value(self):
+        """
+        Returns:
+            str: Every line (with 'keep'), stripped only at the start and the end, or None without 'keep'.
+        """
+        return '\n'.join(self.all).strip() if self.all is not None else None
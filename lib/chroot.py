@@ -0,0 +1,82 @@
+import shlex
+from lib.session import BashSession
+
+class Chroot:
+    """
+    A class to execute shell commands inside a target root (chroot) through one login shell.
+
+    The chroot is entered once, with the environment applied once, instead of starting a new
+    'chroot <root> bash --login -c "..."' (which sources the full profile) for every command.
+    Every command is still executed and logged individually through Shell.execute.
+
+    Usage:
+        with Chroot(shell, '/mnt', env='{LINUX_ENV}') as chroot:
+            chroot.execute('Generate locale', 'locale-gen')
+    """
+
+    def __init__(self, shell, root='/mnt', env=None):
+        """
+        Initializes the Chroot. The chroot is entered on first use.
+
+        Args:
+            shell (Shell): The shell used to execute and log the commands.
+            root (str, optional): The target root directory. Defaults to '/mnt'.
+            env (str, optional): Environment assignments for the chroot (e.g. '{LINUX_ENV}'). Defaults to None.
+        """
+        self.shell = shell
+        self.root = root
+        self.env = env
+        self.session = None
+
+    def open(self):
+        """
+        Enters the chroot by starting a login shell inside the target root.
+        """
+        self.close()
+        root = self.shell._substitute_globals(self.root)
+        env = shlex.split(self.shell._substitute_globals(self.env)) if self.env else []
+        self.session = BashSession(['chroot', root, '/usr/bin/env'] + env + ['/bin/bash', '--login'])
+        self.session.start()
+        self.shell.log.info(f"Chroot entered: {root}")
+
+    def execute(self, description, command, **kwargs):
+        """
+        Executes a shell command inside the chroot.
+
+        Args:
+            description (str): Description of the command.
+            command (str): The shell command to execute inside the chroot.
+            **kwargs: Other arguments for Shell.execute (input, output_var, check_returncode, strict, stream).
+
+        Returns:
+            bool: True if the command was successful, False otherwise.
+        """
+        # Dry-run: record the command as running inside the chroot
+        if self.shell.plan is not None:
+            self.shell.plan.root = self.root
+            try:
+                return self.shell.execute(description, command, **kwargs)
+            finally:
+                self.shell.plan.root = None
+
+        if self.session is None:
+            self.open()
+        return self.shell.execute(description, command, session=self.session, **kwargs)
+
+    def close(self):
+        """
+        Leaves the chroot, so the target root is no longer busy and can be unmounted.
+        """
+        if self.session is None:
+            return
+        self.session.close()
+        self.session = None
+        self.shell.log.info(f"Chroot left: {self.shell._substitute_globals(self.root)}")
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,280 @@
+import os
+import re
+import time
+import threading
+from rich.live import Live
+from rich.console import Group
+from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
+
+class Dashboard:
+    """
+    A class to show a live progress dashboard for long-running installation steps.
+
+    The dashboard shows an overall bar over the phases of the installation (see Shell.phase), and a bar
+    for every step that reports progress:
+
+        'bytes'    - bytes written to the device, MB/s and ETA, from 'dd status=progress' output or
+                     otherwise from the sectors written in /sys/class/block/<dev>/stat
+        'packages' - packages fetched / unpacked / set up, from apt-get and debootstrap output
+
+    Output lines only update counters; rendering happens in a background thread at most
+    'refresh_per_second' times, so the dashboard never slows down the steps themselves.
+    """
+
+    # Output of 'dd status=progress': '1048576000 bytes (1.0 GB, 1000 MiB) copied, 5 s, 210 MB/s'
+    DD_BYTES = re.compile(r'^(\d+) bytes')
+
+    # Package events of apt-get and debootstrap
+    PACKAGE_EVENTS = (
+        ('fetched',  re.compile(r'^(Get:\d+ |I: Retrieving )')),
+        ('unpacked', re.compile(r'^(Unpacking |I: Unpacking |I: Extracting )')),
+        ('set up',   re.compile(r'^(Setting up |I: Configuring )')),
+    )
+
+    # apt-get summary: '12 upgraded, 345 newly installed, 0 to remove and 0 not upgraded.'
+    APT_SUMMARY = re.compile(r'^(\d+) upgraded, (\d+) newly installed')
+
+    class Task:
+        """The progress of a single step on the dashboard."""
+
+        def __init__(self, task_id, kind, device=None):
+            """
+            Initializes the Task.
+
+            Args:
+                task_id (int): Id of the task in the step progress.
+                kind (str): 'bytes' or 'packages'.
+                device (str, optional): Block device written by a 'bytes' step. Defaults to None.
+            """
+            self.task_id = task_id
+            self.kind = kind
+            self.device = device
+            self.started = time.monotonic()
+            self.total = Dashboard.device_size(device) if kind == 'bytes' else None
+            self.sectors = Dashboard.sectors_written(device) if kind == 'bytes' else None
+            self.bytes = 0
+            self.reported = False   # The command reports its own byte count (dd status=progress)
+            self.rate = None        # Bytes per second (smoothed)
+            self.sample = (self.started, 0)
+            self.packages = {name: 0 for name, _ in Dashboard.PACKAGE_EVENTS}
+
+        def line(self, text):
+            """
+            Updates the counters from an output line of the step.
+
+            Args:
+                text (str): The output line.
+            """
+            if self.kind == 'bytes':
+                match = Dashboard.DD_BYTES.match(text)
+                if match:
+                    self.reported = True
+                    self.bytes = int(match.group(1))
+                return
+
+            match = Dashboard.APT_SUMMARY.match(text)
+            if match:
+                self.total = int(match.group(1)) + int(match.group(2))
+                return
+            for name, pattern in Dashboard.PACKAGE_EVENTS:
+                if pattern.match(text):
+                    self.packages[name] += 1
+                    return
+
+        def advance(self, done, total=None):
+            """
+            Sets the progress of a step that reports it directly (a Python step, see Shell.execute).
+
+            Args:
+                done (int): Amount of work done (bytes for a 'bytes' step).
+                total (int, optional): Total amount of work. Defaults to None (unchanged).
+            """
+            self.reported = True
+            self.bytes = done
+            if total is not None:
+                self.total = total
+
+        def poll(self, now):
+            """
+            Samples the progress of the step (called by the refresh thread).
+
+            Args:
+                now (float): time.monotonic() of the sample.
+            """
+            if self.kind != 'bytes':
+                return
+            if not self.reported and self.sectors is not None:
+                sectors = Dashboard.sectors_written(self.device)
+                if sectors is not None:
+                    self.bytes = (sectors - self.sectors) * 512
+
+            # Exponentially smoothed rate, so the ETA does not jump with every sample
+            last_time, last_bytes = self.sample
+            if now - last_time >= 1.0:
+                rate = (self.bytes - last_bytes) / (now - last_time)
+                self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+                self.sample = (now, self.bytes)
+
+        def detail(self):
+            """
+            Returns:
+                str: The progress of the step as text.
+            """
+            if self.kind == 'bytes':
+                text = f'{Dashboard.size(self.bytes)}'
+                if self.total:
+                    text += f' / {Dashboard.size(self.total)}'
+                if self.rate:
+                    text += f'  {self.rate / 1e6:.1f} MB/s'
+                    if self.total and self.total > self.bytes:
+                        eta = int((self.total - self.bytes) / self.rate)
+                        text += f'  ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}'
+                return text
+            text = '  '.join(f'{name} {count}' for name, count in self.packages.items())
+            if self.total:
+                text += f'  (of {self.total})'
+            return text
+
+        def completed(self):
+            """
+            Returns:
+                int: Amount of work completed (bytes, or packages set up).
+            """
+            return self.bytes if self.kind == 'bytes' else self.packages['set up']
+
+    def __init__(self, console, phases=None, refresh_per_second=4):
+        """
+        Initializes the Dashboard. The dashboard is shown by 'start'.
+
+        Args:
+            console (Console): The rich console object.
+            phases (int, optional): Number of phases of the installation, for the overall bar. Defaults to None (unknown).
+            refresh_per_second (int, optional): Maximum number of redraws per second. Defaults to 4.
+        """
+        self.console = console
+        self.interval = 1 / refresh_per_second
+        self.phases = 0     # Number of phases started
+        counts = '{task.completed:.0f}/{task.total:.0f} phases  ' if phases else ''
+        self.overall = Progress(
+            TextColumn('[bold]{task.description}'),
+            BarColumn(),
+            TextColumn(counts + '{task.fields[steps]} steps done'),
+            console=console,
+        )
+        self.overall_id = self.overall.add_task('Installation', total=phases, completed=0, steps=0)
+        self.steps = Progress(
+            SpinnerColumn(),
+            TextColumn('{task.description}', markup=False),
+            BarColumn(),
+            TextColumn('{task.fields[detail]}', markup=False),
+            console=console,
+        )
+        self.live = Live(Group(self.overall, self.steps), console=console, auto_refresh=False, transient=True)
+        self.tasks = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def device_size(device):
+        """Returns the size in bytes of a block device from sysfs, or None if unknown."""
+        try:
+            with open(f'/sys/class/block/{os.path.basename(device)}/size', 'r') as f:
+                return int(f.read()) * 512
+        except (OSError, ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def sectors_written(device):
+        """Returns the number of sectors written to a block device from sysfs, or None if unknown."""
+        try:
+            with open(f'/sys/class/block/{os.path.basename(device)}/stat', 'r') as f:
+                return int(f.read().split()[6])
+        except (OSError, ValueError, IndexError, TypeError):
+            return None
+
+    @staticmethod
+    def size(count):
+        """Returns a byte count as human readable text (e.g. '1.5 GB')."""
+        for unit in ('B', 'kB', 'MB', 'GB'):
+            if count < 1000:
+                return f'{count:.1f} {unit}' if unit != 'B' else f'{count} B'
+            count /= 1000
+        return f'{count:.1f} TB'
+
+    def start(self):
+        """
+        Shows the dashboard and starts the refresh thread.
+        """
+        if self.thread is not None:
+            return
+        self.live.start()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._refresh, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the refresh thread and removes the dashboard from the console. The last phase has ended,
+        so the overall bar is drawn once more with every started phase completed.
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            self.overall.update(self.overall_id, completed=self.phases)
+        self.live.refresh()
+        self.live.stop()
+
+    def _refresh(self):
+        """Updates and redraws the dashboard every 'interval' seconds (runs in its own thread)."""
+        while not self.stopped.wait(self.interval):
+            now = time.monotonic()
+            with self.lock:
+                for task in self.tasks:
+                    task.poll(now)
+                    self.steps.update(task.task_id, total=task.total, completed=task.completed(), detail=task.detail())
+            self.live.refresh()
+
+    def phase(self, title):
+        """
+        Starts a new phase on the overall bar.
+
+        Args:
+            title (str): Title of the phase.
+        """
+        with self.lock:
+            self.phases += 1
+            self.overall.update(self.overall_id, description=title, completed=self.phases - 1)
+
+    def begin(self, description, kind=None, device=None):
+        """
+        Adds a step to the dashboard.
+
+        Args:
+            description (str): Description of the step.
+            kind (str, optional): 'bytes' or 'packages' (see the class description). Defaults to None (only a spinner).
+            device (str, optional): Block device written by a 'bytes' step. Defaults to None.
+
+        Returns:
+            Dashboard.Task: The task, which receives the output lines of the step.
+        """
+        with self.lock:
+            task_id = self.steps.add_task(description, total=None, detail='')
+            task = Dashboard.Task(task_id, kind, device)
+            self.tasks.append(task)
+        return task
+
+    def end(self, task):
+        """
+        Removes a finished step from the dashboard.
+
+        Args:
+            task (Dashboard.Task): The task returned by 'begin'.
+        """
+        with self.lock:
+            self.tasks.remove(task)
+            self.steps.remove_task(task.task_id)
+            self.overall.update(self.overall_id, steps=self.overall.tasks[0].fields['steps'] + 1)
@@ -0,0 +1,449 @@
+import os
+import json
+import time
+import random
+import contextlib
+import tempfile
+import subprocess
+import threading
+
+KiB = 1024
+MiB = 1024 * KiB
+
+class FsBench:
+    """
+    A class to choose file system options by benchmark.
+
+    Every candidate is formatted and mounted on a dm-crypt mapping on a loop device, with the cipher
+    profile of the real volume (see Luks.mapping), and runs a representative workload. The loop device
+    is on the host disk, which is faster than a USB device: the score of a candidate is its elapsed
+    time plus the time the USB device needs for the bytes the candidate really wrote (from the sector
+    counter of the loop device), so compression and metadata overhead are weighed as on the device.
+
+    Partition 4 (storage, btrfs) is tuned with a staged search: first the compression, then the
+    options of the winner, so only about ten of the possible combinations are measured:
+
+        compression  zstd levels 1-5, lzo, none
+        force        compress vs compress-force (btrfs gives up on files that start incompressible)
+        metadata     dup vs single
+        nodesize     16 KiB vs 32 KiB
+
+    A candidate replaces the current choice only if it is faster by more than 'margin', so measurement
+    noise does not trade away defaults (e.g. duplicated metadata) for nothing.
+
+    Partition 3 (Linux) gets one of the ROOT_PROFILES, compared on what a USB root does most: reading
+    many small files cold (boot) and an apt upgrade (files unpacked, synced and renamed over the old
+    ones, as dpkg does).
+
+    Usage:
+        bench = FsBench(luks, crypto)
+        os.environ['PART4_MKFS_OPTS'] = bench.tune_btrfs()['mkfs']
+        bench.save('install.btrfs.json')
+    """
+
+    # Backup workload of the storage partition: (number of files, size, content)
+    BACKUP_WORKLOAD = (
+        (2000, 4 * KiB, 'text'),        # Notes, configuration, source code
+        (200, 128 * KiB, 'text'),       # Documents, mail
+        (100, 256 * KiB, 'binary'),     # Databases, office files: partly compressible
+        (8, 8 * MiB, 'random'),         # Photos, videos, archives: incompressible
+    )
+
+    # Candidates of the staged btrfs search, the first of every stage is the default
+    BTRFS_STAGES = (
+        ('compression', ('zstd:3', 'zstd:1', 'zstd:2', 'zstd:4', 'zstd:5', 'lzo', None)),
+        ('force', (False, True)),
+        ('metadata', ('dup', 'single')),
+        ('nodesize', (16384, 32768)),
+    )
+
+    # Boot workload: libraries, modules and configuration read with a cold cache
+    BOOT_WORKLOAD = (
+        (1000, 2 * KiB, 'text'),
+        (3000, 8 * KiB, 'binary'),
+        (500, 64 * KiB, 'binary'),
+    )
+
+    # Upgrade workload: the files of about 40 packages
+    UPGRADE_WORKLOAD = (
+        (1500, 16 * KiB, 'binary'),
+        (200, 256 * KiB, 'binary'),
+        (20, 2 * MiB, 'random'),
+    )
+    UPGRADE_PACKAGE = 50    # Files per package: dpkg syncs the unpacked files of a package before renaming them
+
+    # Root file system profiles of partition 3, the first is the default:
+    #   ext4-flash  the allocator aligns to the erase block (stride, stripe_width), the inode tables and journal are
+    #               written by mkfs instead of in the background after the first boot, no access time updates, and
+    #               the journal is committed every 60s instead of 5s (fewer small writes, up to 60s lost on power loss)
+    #   ext4        the mkfs.ext4 defaults
+    #   f2fs        log-structured, for flash; GRUB reads /boot from it (GRUB 2.04 or later)
+    ROOT_PROFILES = ('ext4-flash', 'ext4', 'f2fs')
+
+    def __init__(self, luks, profile, directory='/var/tmp', device_rate=20e6, margin=0.05, seed=0):
+        """
+        Initializes the FsBench.
+
+        Args:
+            luks (Luks): Creates the dm-crypt mappings of the benchmark.
+            profile (dict): The cipher profile of the volume (see Luks.cipher_profile).
+            directory (str, optional): Directory of the loop device image. Defaults to '/var/tmp'.
+            device_rate (float, optional): Sustained write rate of the USB device in bytes per second. Defaults to 20 MB/s.
+            margin (float, optional): Fraction by which a candidate must beat the current choice. Defaults to 0.05.
+            seed (int, optional): Seed of the generated workload, so all candidates write the same files. Defaults to 0.
+        """
+        self.luks = luks
+        self.profile = profile
+        self.directory = directory
+        self.device_rate = device_rate
+        self.margin = margin
+        self.seed = seed
+        self.results = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _text(rng, size):
+        """Returns text-like bytes: words of a vocabulary with a natural (Zipf) frequency (compresses about 3:1)."""
+        words = [bytes(rng.choices(b'etaoinshrdlucmfwypvbgk', k=rng.randint(2, 9))) for _ in range(2000)]
+        weights = [1 / rank for rank in range(1, len(words) + 1)]
+        data = bytearray()
+        while len(data) < size:
+            data += b' '.join(rng.choices(words, weights, k=512)) + b'\n'
+        return bytes(data[:size])
+
+    @staticmethod
+    def _binary(rng, size):
+        """Returns record-like bytes: counters, flags, names and random fields (compresses about 2:1)."""
+        names = [rng.randbytes(4).hex().encode() + bytes(4) for _ in range(16)]
+        data = bytearray()
+        index = 0
+        while len(data) < size:
+            data += index.to_bytes(8, 'little') + bytes(4) + rng.randbytes(8) + rng.choice(names)
+            index += 1
+        return bytes(data[:size])
+
+    def workload(self, spec):
+        """
+        Generates the files of a workload.
+
+        Args:
+            spec (tuple): (number of files, size, content) tuples, e.g. BACKUP_WORKLOAD.
+
+        Returns:
+            list: (relative path, bytes) per file.
+        """
+        rng = random.Random(self.seed)
+        files = []
+        for number, (count, size, kind) in enumerate(spec):
+            # Only a few distinct contents per class, files of a class differ in their first bytes
+            contents = []
+            for _ in range(min(count, 8)):
+                if kind == 'text':
+                    contents.append(FsBench._text(rng, size))
+                elif kind == 'binary':
+                    contents.append(FsBench._binary(rng, size))
+                else:
+                    contents.append(rng.randbytes(size))
+            for index in range(count):
+                content = contents[index % len(contents)]
+                if kind != 'random':
+                    content = index.to_bytes(8, 'little') + content[8:]
+                files.append((f'{kind}{number}/{index // 100:03d}/{index:05d}', content))
+        return files
+
+    @staticmethod
+    def _write(root, files):
+        """Writes files below a directory and flushes them to the device. Returns the elapsed seconds."""
+        started = time.perf_counter()
+        for path, content in files:
+            path = os.path.join(root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        os.sync()
+        return time.perf_counter() - started
+
+    @staticmethod
+    def _read(root, files):
+        """Reads files below a directory with a cold page cache. Returns the elapsed seconds."""
+        FsBench.drop_caches()
+        started = time.perf_counter()
+        for path, _ in files:
+            with open(os.path.join(root, path), 'rb') as f:
+                while f.read(MiB):
+                    pass
+        return time.perf_counter() - started
+
+    @staticmethod
+    def drop_caches():
+        """Flushes and drops the page cache, dentries and inodes (needs root; ignored otherwise)."""
+        os.sync()
+        try:
+            with open('/proc/sys/vm/drop_caches', 'w') as f:
+                f.write('3')
+        except OSError:
+            pass
+
+    @staticmethod
+    def sectors_written(device):
+        """Returns the number of sectors written to a block device from sysfs, or 0 if unknown."""
+        try:
+            with open(f'/sys/class/block/{os.path.basename(device)}/stat', 'r') as f:
+                return int(f.read().split()[6])
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    @contextlib.contextmanager
+    def _mounted(self, device, mkfs, mount_options):
+        """
+        Formats a mapping and mounts it on a temporary directory.
+
+        Args:
+            device (str): The dm-crypt mapping.
+            mkfs (list): The mkfs command without the device (e.g. ['mkfs.btrfs', '-f', '--nodesize', '16384']).
+            mount_options (str): The mount options.
+
+        Yields:
+            str: The mount point.
+        """
+        subprocess.run([*mkfs, device], capture_output=True, check=True)
+        with tempfile.TemporaryDirectory(dir=self.directory) as mountpoint:
+            subprocess.run(['mount', '-o', mount_options, device, mountpoint], capture_output=True, check=True)
+            try:
+                yield mountpoint
+            finally:
+                subprocess.run(['umount', mountpoint], capture_output=True)
+
+    def _run(self, device, loop, mkfs, mount_options, files):
+        """
+        Formats a mapping, mounts it and runs a workload.
+
+        Args:
+            device (str): The dm-crypt mapping.
+            loop (str): The loop device below the mapping, to count the bytes written.
+            mkfs (list): The mkfs command without the device (e.g. ['mkfs.btrfs', '-f', '--nodesize', '16384']).
+            mount_options (str): The mount options.
+            files (list): The workload (see 'workload').
+
+        Returns:
+            dict: 'write' and 'read' (seconds), 'written' (bytes written to the device, metadata included),
+                  'payload' (bytes of the files) and 'score' (seconds on the USB device).
+        """
+        with self._mounted(device, mkfs, mount_options) as mountpoint:
+            FsBench.drop_caches()
+            before = FsBench.sectors_written(loop)
+            write = FsBench._write(mountpoint, files)
+            written = (FsBench.sectors_written(loop) - before) * 512
+            read = FsBench._read(mountpoint, files)
+        return {
+            'write': write,
+            'read': read,
+            'written': written,
+            'payload': sum(len(content) for _, content in files),
+            'score': write + read + written / self.device_rate,
+        }
+
+    @staticmethod
+    def btrfs_options(candidate):
+        """
+        Returns:
+            tuple: (mkfs options, mount options) of a btrfs candidate, e.g. ('--metadata dup --nodesize 16384',
+                   'noatime,compress=zstd:3,space_cache=v2').
+        """
+        mkfs = f"--metadata {candidate['metadata']} --nodesize {candidate['nodesize']}"
+        mount = ['noatime']
+        if candidate['compression']:
+            mount.append(f"{'compress-force' if candidate['force'] else 'compress'}={candidate['compression']}")
+        mount.append('space_cache=v2')
+        return mkfs, ','.join(mount)
+
+    def btrfs(self):
+        """
+        Returns:
+            dict: The btrfs options chosen by 'tune_btrfs', or the defaults ('mkfs', 'mount' and 'candidate').
+        """
+        with self.lock:
+            if 'btrfs' in self.results:
+                return self.results['btrfs']
+        best = {name: values[0] for name, values in FsBench.BTRFS_STAGES}
+        mkfs, mount = FsBench.btrfs_options(best)
+        return {'mkfs': mkfs, 'mount': mount, 'candidate': best}
+
+    def tune_btrfs(self, progress=None, size=1024 * MiB, measure=True):
+        """
+        Chooses the btrfs mkfs and mount options of the storage partition (see the class description).
+        Without a working benchmark (e.g. no loop devices) the defaults are chosen.
+
+        Args:
+            progress (callable, optional): Called with (bytes written, total bytes) of the benchmark. Defaults to None.
+            size (int, optional): Size of the loop device in bytes. Defaults to 1 GiB.
+            measure (bool, optional): Run the benchmark; if False the defaults are chosen. Defaults to True.
+
+        Returns:
+            dict: 'mkfs' and 'mount' options (e.g. {PART4_MKFS_OPTS} and {PART4_MOUNT_OPTS}), 'candidate' and 'measured'
+                  (the results of every candidate).
+        """
+        if not measure:
+            return self.btrfs()
+
+        files = self.workload(FsBench.BACKUP_WORKLOAD)
+        payload = sum(len(content) for _, content in files)
+        best = {name: values[0] for name, values in FsBench.BTRFS_STAGES}
+        runs = 1 + sum(len(values) - 1 for _, values in FsBench.BTRFS_STAGES)
+        measured = []
+        error = None
+
+        try:
+            with self.luks.mapping(self.profile, self.directory, size) as (device, loop):
+                def run(candidate):
+                    mkfs, mount = FsBench.btrfs_options(candidate)
+                    result = self._run(device, loop, ['mkfs.btrfs', '-f', *mkfs.split()], mount, files)
+                    measured.append(dict(result, mkfs=mkfs, mount=mount))
+                    if progress is not None:
+                        progress(len(measured) * payload, runs * payload)
+                    return result['score']
+
+                score = None
+                for name, values in FsBench.BTRFS_STAGES:
+                    if name == 'force' and best['compression'] is None:
+                        continue
+                    for value in values:
+                        if score is not None and value == best[name]:
+                            continue    # Measured in an earlier stage
+                        candidate = dict(best, **{name: value})
+                        candidate_score = run(candidate)
+                        if score is None or candidate_score < score * (1 - self.margin):
+                            best, score = candidate, candidate_score
+        except (OSError, subprocess.CalledProcessError) as e:
+            error = str(e)
+            best = {name: values[0] for name, values in FsBench.BTRFS_STAGES}
+
+        mkfs, mount = FsBench.btrfs_options(best)
+        result = {'mkfs': mkfs, 'mount': mount, 'candidate': best, 'measured': measured, 'device_rate': self.device_rate}
+        if error is not None:
+            result['error'] = error
+        with self.lock:
+            self.results['btrfs'] = result
+        return result
+
+    @staticmethod
+    def root_options(name, label='LINUX', erase_block=4 * MiB, block_size=4096):
+        """
+        Returns the commands and options of a root file system profile (see ROOT_PROFILES).
+
+        Args:
+            name (str): The profile, unknown names give the default profile.
+            label (str, optional): The file system label. Defaults to 'LINUX'.
+            erase_block (int, optional): Erase block size of the flash memory in bytes (see Layout). Defaults to 4 MiB.
+            block_size (int, optional): Block size of the file system in bytes. Defaults to 4096.
+
+        Returns:
+            tuple: (mkfs command without the device, mount options, file system type), e.g. {PART3_MKFS},
+                   {PART3_MOUNT_OPTS} and {PART3_FSTYPE}.
+        """
+        if name == 'ext4':
+            return f'mkfs.ext4 -F -L {label}', 'defaults', 'ext4'
+        if name == 'f2fs':
+            return f'mkfs.f2fs -f -l {label}', 'noatime', 'f2fs'
+        stride = max(1, erase_block // block_size)
+        return (f'mkfs.ext4 -F -L {label} -b {block_size} -E stride={stride},stripe_width={stride},lazy_itable_init=0,lazy_journal_init=0',
+                'noatime,commit=60', 'ext4')
+
+    @staticmethod
+    def _upgrade(root, files, package=UPGRADE_PACKAGE):
+        """
+        Replaces installed files like dpkg: per package the new files are written next to the old ones,
+        synced, and renamed over them. Returns the elapsed seconds.
+        """
+        started = time.perf_counter()
+        for first in range(0, len(files), package):
+            batch = [(os.path.join(root, path), content) for path, content in files[first:first + package]]
+            for path, content in batch:
+                with open(path + '.dpkg-new', 'wb') as f:
+                    f.write(content[::-1])
+                    os.fsync(f.fileno())
+            for path, _ in batch:
+                os.rename(path + '.dpkg-new', path)
+        os.sync()
+        return time.perf_counter() - started
+
+    def _run_root(self, device, loop, name, erase_block, boot, upgrade):
+        """
+        Runs the boot and upgrade workloads on a root file system profile.
+
+        Returns:
+            dict: 'latency' (seconds per boot file read), 'boot' and 'upgrade' (seconds), 'written' (bytes written
+                  by the upgrade) and 'score' (seconds of a boot and an upgrade on the USB device).
+        """
+        mkfs, mount, _ = FsBench.root_options(name, 'bench', erase_block)
+        with self._mounted(device, mkfs.split(), mount) as mountpoint:
+            FsBench._write(mountpoint, boot + upgrade)
+
+            # Boot: the files are read in a different order than written, as programs load them
+            order = list(boot)
+            random.Random(self.seed).shuffle(order)
+            reading = FsBench._read(mountpoint, order)
+
+            before = FsBench.sectors_written(loop)
+            updating = FsBench._upgrade(mountpoint, upgrade)
+            written = (FsBench.sectors_written(loop) - before) * 512
+        return {
+            'latency': reading / len(boot),
+            'boot': reading,
+            'upgrade': updating,
+            'written': written,
+            'score': reading + updating + written / self.device_rate,
+        }
+
+    def compare_root(self, erase_block=4 * MiB, progress=None, size=1024 * MiB, profiles=ROOT_PROFILES):
+        """
+        Chooses the root file system profile of the Linux partition by benchmark (see the class description).
+        Profiles that can not be measured (e.g. no mkfs.f2fs on the host) are left out; without any measurement
+        the default profile is chosen.
+
+        Args:
+            erase_block (int, optional): Erase block size of the flash memory in bytes (see Layout). Defaults to 4 MiB.
+            progress (callable, optional): Called with (profiles measured, profiles). Defaults to None.
+            size (int, optional): Size of the loop device in bytes. Defaults to 1 GiB.
+            profiles (tuple, optional): The candidate profiles. Defaults to ROOT_PROFILES.
+
+        Returns:
+            dict: 'profile' (the chosen profile, e.g. {PART3_FS}) and 'measured' (the results per profile).
+        """
+        boot, upgrade = self.workload(FsBench.BOOT_WORKLOAD), self.workload(FsBench.UPGRADE_WORKLOAD)
+        upgrade = [('upgrade/' + path, content) for path, content in upgrade]
+        measured, errors = {}, {}
+        best, score = profiles[0], None
+
+        try:
+            with self.luks.mapping(self.profile, self.directory, size) as (device, loop):
+                for number, name in enumerate(profiles, 1):
+                    try:
+                        measured[name] = self._run_root(device, loop, name, erase_block, boot, upgrade)
+                    except (OSError, subprocess.CalledProcessError) as e:
+                        errors[name] = str(e)
+                    else:
+                        if score is None or measured[name]['score'] < score * (1 - self.margin):
+                            best, score = name, measured[name]['score']
+                    if progress is not None:
+                        progress(number, len(profiles))
+        except (OSError, subprocess.CalledProcessError) as e:
+            errors['mapping'] = str(e)
+
+        result = {'profile': best, 'measured': measured, 'erase_block': erase_block, 'device_rate': self.device_rate}
+        if errors:
+            result['errors'] = errors
+        with self.lock:
+            self.results['root'] = result
+        return result
+
+    def save(self, report_file):
+        """
+        Records the benchmark results as JSON.
+
+        Args:
+            report_file (str): Path to the JSON file (e.g. 'install.btrfs.json', next to install.log).
+        """
+        with self.lock:
+            with open(report_file, 'w') as f:
+                json.dump(self.results, f, indent=2)
@@ -0,0 +1,115 @@
+import os
+import glob
+import json
+import time
+import hashlib
+
+class Golden:
+    """
+    A class to keep the device independent part of the Linux install (a 'golden' root) as an archive, so it
+    is built once per configuration instead of once per device.
+
+    The golden root is what debootstrap, the repositories and the package install produce: nothing in it
+    depends on the device, its keys or its UUIDs. It is archived as a zstd compressed tar (with extended
+    attributes and ACLs, numeric owners) named after a hash of the configuration, e.g. the mirror, the
+    release and the packages:
+
+        /var/cache/secure-usb/golden/root-<hash>.tar.zst        the archive
+        /var/cache/secure-usb/golden/root-<hash>.tar.zst.json   its configuration and creation time
+
+    A device with the same configuration unpacks the archive onto its freshly encrypted Linux partition,
+    and only runs the steps depending on the device: keyfiles, crypttab, fstab, grub, the user,
+    update-initramfs and grub-install. An archive older than 'max_age' is rebuilt, so the packages do
+    not fall behind the security updates; only the newest 'keep' archives are kept.
+
+    Usage:
+        golden = Golden()
+        config = {'mirror': MIRROR, 'packages': LINUX_PKGS}
+        if golden.available(config): unpack(golden.path(config))
+        else: install(); archive(golden.path(config)); golden.save(config)
+    """
+
+    # Paths of the root not archived: mount points of the install (their directories are kept) and
+    # what must differ per device (a new machine-id is generated at the first boot)
+    EXCLUDE = ('./proc/*', './sys/*', './dev/*', './run/*', './tmp/*', './boot/efi/*', './var/cache/apt/archives/*', './etc/machine-id')
+
+    def __init__(self, directory='/var/cache/secure-usb/golden', max_age=7 * 24 * 3600, keep=2):
+        """
+        Initializes the Golden.
+
+        Args:
+            directory (str, optional): Directory of the archives. Defaults to '/var/cache/secure-usb/golden'.
+            max_age (int, optional): Seconds an archive is used, before it is rebuilt. Defaults to 7 days.
+            keep (int, optional): Number of archives kept. Defaults to 2.
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.keep = keep
+
+    @staticmethod
+    def key(config):
+        """
+        Returns:
+            str: A hash of a configuration (a dict of strings), naming its archive.
+        """
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+    def path(self, config):
+        """
+        Returns:
+            str: The path of the archive of a configuration.
+        """
+        return os.path.join(self.directory, f'root-{Golden.key(config)}.tar.zst')
+
+    def available(self, config):
+        """
+        Returns:
+            bool: True if the archive of a configuration is complete (saved) and not older than 'max_age'.
+        """
+        try:
+            with open(self.path(config) + '.json', 'r') as f:
+                created = json.load(f)['created']
+        except (OSError, ValueError, KeyError):
+            return False
+        return os.path.exists(self.path(config)) and time.time() - created < self.max_age
+
+    @staticmethod
+    def archive_options():
+        """
+        Returns:
+            str: tar options archiving a root (e.g. {GOLDEN_TAR}), relative to it ('tar -C <root> ... .').
+        """
+        excludes = ' '.join(f"--exclude='{pattern}'" for pattern in Golden.EXCLUDE)
+        return f"--xattrs --xattrs-include='*' --acls --numeric-owner --use-compress-program='zstd -T0' {excludes}"
+
+    @staticmethod
+    def extract_options():
+        """
+        Returns:
+            str: tar options unpacking an archive (e.g. {GOLDEN_UNTAR}), with owners, modes and attributes.
+        """
+        return "--xattrs --xattrs-include='*' --acls --numeric-owner --same-permissions --zstd"
+
+    def save(self, config):
+        """
+        Records that the archive of a configuration is complete, and removes the oldest archives beyond 'keep'.
+
+        Args:
+            config (dict): The configuration.
+
+        Returns:
+            bool: True if the archive exists and was recorded.
+        """
+        path = self.path(config)
+        if not os.path.exists(path):
+            return False
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump({'config': config, 'created': time.time(), 'size': os.path.getsize(path)}, f, indent=4)
+        os.replace(path + '.json.tmp', path + '.json')
+
+        archives = sorted(glob.glob(os.path.join(self.directory, 'root-*.tar.zst')), key=os.path.getmtime, reverse=True)
+        for old in archives[self.keep:]:
+            for file in (old, old + '.json'):
+                if os.path.exists(file):
+                    os.remove(file)
+        return True
@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import threading
+
+class Journal:
+    """
+    A class to record the completed steps of an installation on disk, so a failed installation can be resumed.
+
+    The journal is keyed by the device and the configuration of the installation. For every completed
+    step it stores the values of its 'output_var' (e.g. PART3_UUID), so they can be restored when the
+    step is skipped on resume. Secrets (USER_PASS) are never stored.
+
+    Steps are identified by their unsubstituted description and command templates, and the number of
+    times the same step occurred before in the run.
+    """
+
+    # Variables defining the configuration of an installation (stored, and restored on resume)
+    CONFIG_VARS = (
+        'DEVICE', 'DEVICE_NAME', 'DEVICE_WIPE', 'DEVICE_WIPE_STRATEGY', 'USER_NAME', 'SYSTEM_LOCALE', 'SYSTEM_KEYB', 'SYSTEM_TIMEZONE',
+        'PART1_LABEL', 'PART2_LABEL', 'PART3_LABEL', 'PART4_LABEL', 'PART4_FORMAT', 'LINUX_ENV', 'LINUX_PKGS',
+    )
+
+    def __init__(self, journal_file='install.journal.json'):
+        """
+        Initializes the Journal and loads an earlier journal if present.
+
+        Args:
+            journal_file (str, optional): Path to the journal file. Defaults to 'install.journal.json'.
+        """
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.resuming = False
+        try:
+            with open(self.journal_file, 'r') as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.data = {}
+
+    @staticmethod
+    def _device_size(device):
+        """Returns the size in sectors of a block device from sysfs (empty string if unknown)."""
+        try:
+            with open(f'/sys/class/block/{os.path.basename(device)}/size', 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    @staticmethod
+    def config_key(config):
+        """
+        Returns the key identifying an installation: a hash of the configuration and the device size
+        (so a journal is never resumed on another device at the same path).
+        """
+        text = json.dumps(config, sort_keys=True) + Journal._device_size(config.get('DEVICE', ''))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def config(self):
+        """
+        Returns:
+            dict: The configuration of an unfinished installation in the journal, or None.
+        """
+        if self.data and not self.data.get('finished'):
+            return self.data.get('config')
+        return None
+
+    def outputs(self):
+        """
+        Returns:
+            dict: All output variables recorded by completed steps.
+        """
+        outputs = {}
+        for entry in self.data.get('steps', {}).values():
+            outputs.update(entry.get('outputs', {}))
+        return outputs
+
+    def start(self, resume=False):
+        """
+        Starts journaling the installation with the current configuration (from os.environ).
+
+        Args:
+            resume (bool, optional): Continue the journal of an earlier run with the same configuration,
+                                     instead of starting a new one. Defaults to False.
+
+        Returns:
+            bool: True if an earlier journal is resumed, False if a new journal was started.
+        """
+        config = {name: os.environ.get(name, '') for name in Journal.CONFIG_VARS}
+        key = Journal.config_key(config)
+        self.seen = {}
+        self.resuming = resume and self.data.get('key') == key and not self.data.get('finished')
+        if not self.resuming:
+            self.data = {'key': key, 'config': config, 'steps': {}, 'finished': False}
+            self._save()
+        return self.resuming
+
+    def key(self, description, command):
+        """
+        Returns the key of the next occurrence of a step in this run.
+
+        Args:
+            description (str): The unsubstituted description of the step.
+            command (str): The unsubstituted command of the step.
+        """
+        with self.lock:
+            base = f'{description}\n{command}'
+            self.seen[base] = self.seen.get(base, 0) + 1
+            return f'{base}\n#{self.seen[base]}'
+
+    def completed(self, key):
+        """
+        Returns:
+            dict: The recorded outputs of the step if it was completed in the resumed run, otherwise None.
+        """
+        if not self.resuming:
+            return None
+        entry = self.data['steps'].get(key)
+        return entry.get('outputs', {}) if entry is not None else None
+
+    def complete(self, key, outputs=None):
+        """
+        Records a step as completed.
+
+        Args:
+            key (str): The key of the step (see 'key').
+            outputs (dict, optional): The output variables set by the step. Defaults to None.
+        """
+        with self.lock:
+            self.data['steps'][key] = {'outputs': outputs or {}}
+            self._save()
+
+    def invalidate(self):
+        """
+        Stops resuming: the state of the device no longer matches the journal, so every following
+        step is executed again (and journaled anew).
+        """
+        with self.lock:
+            self.resuming = False
+
+    def finish(self):
+        """Marks the installation as finished, it can no longer be resumed."""
+        with self.lock:
+            self.data['finished'] = True
+            self._save()
+
+    def _save(self):
+        """Writes the journal atomically (a crash never leaves a partial journal)."""
+        temporary = self.journal_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.journal_file)
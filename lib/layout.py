@@ -0,0 +1,181 @@
+import os
+import json
+import math
+import hashlib
+import threading
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+
+class Layout:
+    """
+    A class to compute the partition layout of the USB device.
+
+    Every partition starts on an erase block of the flash memory: the alignment is the least common
+    multiple of the erase block (4 MiB by default, as the erase block size of USB flash is not
+    exposed), the optimal and minimum I/O size of the device from sysfs, and is shifted by the
+    alignment offset. A partition straddling erase blocks makes every write cost two erase cycles.
+
+    Partition 3 (Linux) is sized from the footprint of the installed packages, measured in an
+    earlier run (see 'record'), otherwise estimated from LINUX_PKGS, plus the swapfile and headroom
+    for updates. Partition 4 (storage) takes the rest of the device.
+
+    Usage:
+        layout = Layout('/dev/sdb', os.environ['LINUX_PKGS'])
+        shell.execute('Create partition table', f'sgdisk --clear {{DEVICE}} {layout.sgdisk()}')
+    """
+
+    # Fixed partition sizes (README and EFI)
+    PART1_SIZE = 64 * MiB
+    PART2_SIZE = 128 * MiB
+
+    # Approximate installed size of a package including the dependencies it pulls into a minimal Debian
+    BASE_FOOTPRINT = 400 * MiB                  # debootstrap
+    PACKAGE_FOOTPRINT = 30 * MiB                # Any package not listed below
+    PACKAGE_FOOTPRINTS = {
+        'linux-image-amd64': 450 * MiB,
+        'firmware-linux': 700 * MiB,
+        'firmware-iwlwifi': 80 * MiB,
+        'xserver-xorg': 150 * MiB,
+        'xfce4': 350 * MiB,
+        'lightdm': 60 * MiB,
+        'firefox-esr': 300 * MiB,
+        'keepassxc': 120 * MiB,
+        'network-manager': 60 * MiB,
+        'network-manager-gnome': 150 * MiB,
+        'grub-efi': 40 * MiB,
+        'cryptsetup-initramfs': 40 * MiB,
+    }
+
+    def __init__(self, device, packages='', swap_size=1 * GiB, headroom=0.5, erase_block=4 * MiB, size=None,
+                 footprint_file='install.footprint.json'):
+        """
+        Initializes the Layout and reads the geometry of the device from sysfs.
+
+        Args:
+            device (str): The block device (e.g. '/dev/sdb').
+            packages (str, optional): The packages installed on partition 3 (LINUX_PKGS). Defaults to ''.
+            swap_size (int, optional): Size of the swapfile on partition 3 in bytes. Defaults to 1 GiB.
+            headroom (float, optional): Extra space on partition 3 as a fraction of the footprint (updates, logs). Defaults to 0.5.
+            erase_block (int, optional): Erase block size of the flash memory in bytes. Defaults to 4 MiB.
+            size (int, optional): Size of the device in bytes. Defaults to None (read from sysfs).
+            footprint_file (str, optional): Path to the measured footprints of earlier runs. Defaults to 'install.footprint.json'.
+        """
+        self.device = device
+        self.packages = packages.split()
+        self.swap_size = swap_size
+        self.headroom = headroom
+        self.footprint_file = footprint_file
+        self.lock = threading.Lock()
+
+        self.logical_block_size = self._read('queue/logical_block_size', 512)
+        self.optimal_io_size = self._read('queue/optimal_io_size', 0)
+        self.minimum_io_size = self._read('queue/minimum_io_size', 0)
+        self.alignment_offset = self._read('alignment_offset', 0)
+        self.size = size if size is not None else self._read('size', 0) * 512
+
+        # Every non zero I/O size must divide the alignment
+        self.alignment = erase_block
+        for io_size in (self.optimal_io_size, self.minimum_io_size, self.logical_block_size):
+            if io_size:
+                self.alignment = math.lcm(self.alignment, io_size)
+
+        try:
+            with open(self.footprint_file, 'r') as f:
+                self.footprints = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.footprints = {}
+
+    def _read(self, attribute, default):
+        """Reads an integer attribute of the device from /sys/class/block/<dev>/, or returns the default."""
+        try:
+            with open(f'/sys/class/block/{os.path.basename(self.device)}/{attribute}', 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return default
+
+    def key(self):
+        """Returns the key of the package selection in the footprint file."""
+        return hashlib.sha256(' '.join(sorted(self.packages)).encode()).hexdigest()
+
+    def footprint(self):
+        """
+        Returns:
+            int: The size of the installed root in bytes: measured in an earlier run, otherwise estimated.
+        """
+        measured = self.footprints.get(self.key())
+        if measured:
+            return measured
+        return Layout.BASE_FOOTPRINT + sum(Layout.PACKAGE_FOOTPRINTS.get(package, Layout.PACKAGE_FOOTPRINT) for package in self.packages)
+
+    def record(self, root='/mnt'):
+        """
+        Measures the footprint of an installed root (the used space of its file system) for the layout of later runs.
+
+        Args:
+            root (str, optional): Mount point of the installed root. Defaults to '/mnt'.
+
+        Returns:
+            bool: True if the footprint was recorded.
+        """
+        try:
+            stat = os.statvfs(root)
+        except OSError:
+            return False
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        if os.path.exists(os.path.join(root, 'swapfile')):
+            used -= os.stat(os.path.join(root, 'swapfile')).st_blocks * 512
+        with self.lock:
+            self.footprints[self.key()] = used
+            with open(self.footprint_file, 'w') as f:
+                json.dump(self.footprints, f, indent=2)
+        return True
+
+    def align(self, offset):
+        """Returns the first aligned offset at or after an offset."""
+        offset -= self.alignment_offset
+        return math.ceil(offset / self.alignment) * self.alignment + self.alignment_offset
+
+    def partitions(self):
+        """
+        Computes the partitions.
+
+        Returns:
+            list: (start, end) of partitions 1 to 4 in bytes (end exclusive). The end of partition 4 is None
+                  (the end of the device, before the backup GPT).
+        """
+        root = int((self.footprint() + self.swap_size) * (1 + self.headroom))
+        sizes = [Layout.PART1_SIZE, Layout.PART2_SIZE, root]
+
+        partitions = []
+        start = self.align(1 * MiB)     # Room for the GPT
+        for size in sizes:
+            end = self.align(start + size)
+            partitions.append((start, end))
+            start = end
+        partitions.append((start, None))
+        return partitions
+
+    def fits(self):
+        """
+        Returns:
+            bool: True if the device is large enough, leaving at least 1 GiB for partition 4 (or its size is unknown).
+                  The installation is refused otherwise, before the device is wiped or partitioned.
+        """
+        return self.size == 0 or self.partitions()[3][0] + GiB <= self.size
+
+    def sgdisk(self):
+        """
+        Returns the sgdisk arguments creating the partitions, in logical sectors:
+        '--set-alignment=8192 --new 1:2048:133119 ... --typecode 2:ef00'.
+
+        Returns:
+            str: The sgdisk arguments.
+        """
+        sector = self.logical_block_size
+        arguments = [f'--set-alignment={self.alignment // sector}']
+        for number, (start, end) in enumerate(self.partitions(), 1):
+            last = end // sector - 1 if end is not None else 0      # 0: the last usable sector
+            arguments.append(f'--new {number}:{start // sector}:{last}')
+        arguments.append('--typecode 2:ef00')
+        return ' '.join(arguments)
@@ -0,0 +1,483 @@
+import os
+import re
+import json
+import shlex
+import contextlib
+import mmap
+import time
+import hashlib
+import tempfile
+import subprocess
+import threading
+from rich.table import Table
+from rich.text import Text
+
+class Luks:
+    """
+    A class to choose the key derivation (PBKDF) parameters of the LUKS volumes, and measure unlock times.
+
+    cryptsetup calibrates the PBKDF iterations to about a second on the provisioning host. The LUKS1
+    volume holding /boot is however unlocked by GRUB (GRUB_ENABLE_CRYPTODISK), whose PBKDF2 is many
+    times slower than the OpenSSL implementation of cryptsetup, on whatever machine the USB device is
+    booted. The passphrase slot therefore gets a fixed number of PBKDF2 iterations, derived from a
+    target GRUB unlock time:
+
+        iterations = max(floor, latency * host rate / GRUB slowdown)
+
+    The floor keeps a minimum cost against brute forcing the passphrase. Keyfile slots contain 2048
+    random bytes, which can not be brute forced, and get the minimal number of iterations. This also
+    keeps GRUB fast when it tries a keyfile slot with the passphrase before the passphrase slot.
+
+    The storage volume is not unlocked by GRUB, and gets a LUKS2 cipher profile chosen by benchmark
+    (see 'cipher_profile' and 'verify_profile').
+
+    Opening names the key slot ('open'), so a single key is derived; the key derivations of a run are
+    counted and timed per slot by 'derivations'.
+    """
+
+    GRUB_SLOWDOWN = 8.0         # GRUB's PBKDF2-SHA256 compared to OpenSSL on the same CPU
+    MIN_ITERATIONS = 1000       # Minimum PBKDF2 iterations of a LUKS1 key slot
+
+    # Candidate ciphers of the storage volume (all with 256 bit security): (cipher, key size, 'cryptsetup benchmark' name)
+    CIPHERS = (
+        ('aes-xts-plain64', 512, 'aes-xts'),
+        ('xchacha12,aes-adiantum-plain64', 256, 'xchacha12,aes-adiantum'),
+        ('serpent-xts-plain64', 512, 'serpent-xts'),
+        ('twofish-xts-plain64', 512, 'twofish-xts'),
+    )
+
+    # A line of 'cryptsetup benchmark': '        aes-xts        512b      2101.3 MiB/s      2099.5 MiB/s'
+    BENCHMARK_LINE = re.compile(r'^\s*(\S+)\s+(\d+)b\s+([\d.]+) MiB/s\s+([\d.]+) MiB/s')
+
+    KEYFILE_SLOT = 0        # Key slot of the keyfile of a volume (created by luksFormat)
+    PASSPHRASE_SLOT = 1     # Key slot of the passphrase (the first slot added)
+    ITER_TIME = 2.0         # Seconds cryptsetup calibrates a key slot to, without forced iterations (default --iter-time)
+
+    # cryptsetup commands creating a key slot (opens are recorded by 'open'), and their options taking a value
+    KEY_SLOT_ACTIONS = ('luksFormat', 'luksAddKey', 'luksChangeKey')
+    VALUE_OPTIONS = ('--key-file', '--key-slot', '--pbkdf', '--hash', '--pbkdf-force-iterations', '--iter-time', '--pbkdf-memory',
+                     '--pbkdf-parallel', '--label', '--type', '--cipher', '--key-size', '--sector-size', '--keyfile-size', '--new-keyfile')
+
+    def __init__(self, grub_latency=3.0, floor=200000, slowdown=GRUB_SLOWDOWN, hash='sha256'):
+        """
+        Initializes the Luks.
+
+        Args:
+            grub_latency (float, optional): Target time in seconds for GRUB to unlock the passphrase slot. Defaults to 3.0.
+            floor (int, optional): Minimum PBKDF2 iterations of a passphrase slot (security floor). Defaults to 200000.
+            slowdown (float, optional): How many times slower GRUB derives a key than this host. Defaults to GRUB_SLOWDOWN.
+            hash (str, optional): Hash of PBKDF2. Defaults to 'sha256'.
+        """
+        self.grub_latency = grub_latency
+        self.floor = floor
+        self.slowdown = slowdown
+        self.hash = hash
+        self.host_rate = None   # PBKDF2 iterations per second on this host
+        self.results = []       # [{'description', 'seconds', 'grub'}] of 'benchmark'
+        self.opened = []        # [(description, device, key slot)] of 'open'
+        self.lock = threading.Lock()
+
+    def rate(self):
+        """
+        Measures the PBKDF2 speed of this host in process (hashlib uses OpenSSL, like cryptsetup).
+
+        Returns:
+            float: PBKDF2 iterations per second.
+        """
+        if self.host_rate is None:
+            iterations, elapsed = 10000, 0.0
+            while elapsed < 0.2:    # Measure for at least 0.2 seconds
+                iterations *= 2
+                started = time.perf_counter()
+                hashlib.pbkdf2_hmac(self.hash, b'passphrase', os.urandom(32), iterations, 32)
+                elapsed = time.perf_counter() - started
+            self.host_rate = iterations / elapsed
+        return self.host_rate
+
+    def grub_iterations(self):
+        """
+        Returns:
+            int: PBKDF2 iterations of the passphrase slot of a volume unlocked by GRUB.
+        """
+        return max(self.floor, Luks.MIN_ITERATIONS, int(self.grub_latency * self.rate() / self.slowdown))
+
+    def grub_options(self):
+        """
+        Returns:
+            str: cryptsetup options for the passphrase slot of a volume unlocked by GRUB (e.g. {PART3_PBKDF}).
+        """
+        return f'--pbkdf pbkdf2 --hash {self.hash} --pbkdf-force-iterations {self.grub_iterations()}'
+
+    def keyfile_options(self):
+        """
+        Returns:
+            str: cryptsetup options for a keyfile slot (e.g. {KEYFILE_PBKDF}).
+        """
+        return f'--pbkdf pbkdf2 --hash {self.hash} --pbkdf-force-iterations {Luks.MIN_ITERATIONS}'
+
+    def benchmark(self, description, device, passphrase=None, key_file=None, key_slot=None, runs=3):
+        """
+        Measures how long unlocking a key slot takes ('cryptsetup open --test-passphrase'), and predicts the GRUB unlock time.
+
+        Args:
+            description (str): Description of the measurement (e.g. 'LINUX passphrase').
+            device (str): The LUKS device.
+            passphrase (str, optional): The passphrase to unlock with. Defaults to None.
+            key_file (str, optional): The keyfile to unlock with (instead of a passphrase). Defaults to None.
+            key_slot (int, optional): Only try this key slot. Defaults to None (all slots, in order, as GRUB does).
+            runs (int, optional): Number of measurements, the fastest counts. Defaults to 3.
+
+        Returns:
+            float: The unlock time in seconds, or None if unlocking failed.
+        """
+        command = ['cryptsetup', 'open', '--test-passphrase', device]
+        if key_file:
+            command += ['--key-file', key_file]
+        if key_slot is not None:
+            command += ['--key-slot', str(key_slot)]
+
+        fastest = None
+        for _ in range(runs):
+            started = time.perf_counter()
+            try:
+                result = subprocess.run(command, input=passphrase if not key_file else None, capture_output=True, text=True)
+            except FileNotFoundError:
+                return None     # cryptsetup not installed
+            elapsed = time.perf_counter() - started
+            if result.returncode != 0:
+                return None
+            fastest = elapsed if fastest is None else min(fastest, elapsed)
+
+        with self.lock:
+            self.results.append({'description': description, 'seconds': fastest, 'grub': fastest * self.slowdown})
+        return fastest
+
+    def open(self, description, device, name, key_file=None, passphrase=None, options=''):
+        """
+        Opens a LUKS volume with its keyfile, or with the passphrase when the keyfile is missing (after a reboot
+        /run is empty). The key slot is named, so only that slot's key is derived (see 'derivations').
+
+        Args:
+            description (str): Description of the volume (e.g. 'LINUX').
+            device (str): The LUKS device.
+            name (str): Name of the mapping.
+            key_file (str, optional): The keyfile (in KEYFILE_SLOT). Defaults to None.
+            passphrase (str, optional): The passphrase (in PASSPHRASE_SLOT). Defaults to None.
+            options (str, optional): More cryptsetup open options (e.g. {PART4_OPEN}). Defaults to ''.
+
+        Returns:
+            bool: True if the volume was opened.
+        """
+        if key_file and os.path.exists(key_file):
+            slot, arguments, input = Luks.KEYFILE_SLOT, ['--key-file', key_file], None
+        else:
+            slot, arguments, input = Luks.PASSPHRASE_SLOT, [], passphrase
+        command = ['cryptsetup', 'open', *options.split(), *arguments, '--key-slot', str(slot), device, name]
+        try:
+            result = subprocess.run(command, input=input, capture_output=True, text=True)
+        except FileNotFoundError:
+            return False    # cryptsetup not installed
+        if result.returncode != 0:
+            return False
+        with self.lock:
+            self.opened.append((description, device, slot))
+        return True
+
+    @staticmethod
+    def _commands(command):
+        """Returns (action, options, positional arguments) of every cryptsetup command creating a key slot in a command line."""
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            return []
+        segments = [[]]
+        for word in words:
+            if word in ('&&', '||', ';', '|'):
+                segments.append([])
+            else:
+                segments[-1].append(word)
+
+        commands = []
+        for segment in segments:
+            if not segment or os.path.basename(segment[0]) != 'cryptsetup':
+                continue
+            options, arguments = {}, []
+            words = iter(segment[1:])
+            for word in words:
+                if word.startswith('-'):
+                    option, separator, value = word.partition('=')
+                    options[option] = value if separator else (next(words, '') if option in Luks.VALUE_OPTIONS else True)
+                else:
+                    arguments.append(word)
+            if arguments and arguments[0] in Luks.KEY_SLOT_ACTIONS:
+                commands.append((arguments[0], options, arguments[1:]))
+        return commands
+
+    def _slot_seconds(self, options):
+        """Returns the time of a key derivation of a slot created with the options (see 'derivations')."""
+        if options.get('--pbkdf') == 'pbkdf2' and options.get('--pbkdf-force-iterations'):
+            return int(options['--pbkdf-force-iterations']) / self.rate()
+        if options.get('--iter-time'):
+            return int(options['--iter-time']) / 1000
+        return Luks.ITER_TIME
+
+    def derivations(self, profiler):
+        """
+        Returns the key derivations (PBKDF invocations) of a run, with the time each takes on this host.
+
+        The steps of the profile are counted by their cryptsetup command: luksFormat derives the key of its
+        slot (1), luksAddKey and luksChangeKey unlock a slot (the keyfile slot, or with a passphrase every
+        slot up to the passphrase slot) and derive the new one. Opens are recorded by 'open' (1). The time of
+        a derivation is that of its slot: forced PBKDF2 iterations at the rate of this host, otherwise the
+        time cryptsetup calibrates a slot to. Header writes and device setup are not included; failed steps
+        and the unlock benchmarks (see 'benchmark') are not counted.
+
+        Args:
+            profiler (Profiler): The profiler of the run.
+
+        Returns:
+            list: {'description', 'device', 'slot', 'seconds'} of every derivation.
+        """
+        slots = {}          # (device, slot): seconds of a derivation
+        derivations = []
+
+        def derive(description, device, slot):
+            derivations.append({'description': description, 'device': device, 'slot': slot,
+                                'seconds': slots.get((device, slot), Luks.ITER_TIME)})
+
+        for step in profiler.steps:
+            if step['returncode'] != 0 or '--test-passphrase' in step['command']:
+                continue
+            for action, options, arguments in Luks._commands(step['command']):
+                if not arguments:
+                    continue
+                device = arguments[0]
+                if action == 'luksFormat':
+                    slot = int(options.get('--key-slot', Luks.KEYFILE_SLOT))
+                    slots = {key: value for key, value in slots.items() if key[0] != device}
+                else:
+                    unlock = [Luks.KEYFILE_SLOT] if options.get('--key-file') else range(Luks.PASSPHRASE_SLOT + 1)
+                    for tried in unlock:
+                        derive(step['description'], device, tried)
+                    used = [number for key, number in slots if key == device]
+                    slot = int(options.get('--key-slot', min(set(range(len(used) + 1)) - set(used))))
+                slots[(device, slot)] = self._slot_seconds(options)
+                derive(step['description'], device, slot)
+
+        for description, device, slot in self.opened:
+            derive(description, device, slot)
+        return derivations
+
+    def report(self, console, profiler=None):
+        """
+        Prints the key derivations of the run and the unlock times measured by 'benchmark' on the rich console.
+
+        Args:
+            console (Console): The rich console object.
+            profiler (Profiler, optional): The profiler of the run, to count the key derivations. Defaults to None.
+        """
+        if profiler is not None:
+            derivations = self.derivations(profiler)
+            console.print(f"PBKDF invocations: {len(derivations)}, {sum(derivation['seconds'] for derivation in derivations):.1f}s", style='info')
+        if not self.results:
+            return
+        table = Table(title=f'LUKS unlock times ({self.grub_iterations()} PBKDF2 iterations for GRUB)')
+        table.add_column('Key slot')
+        table.add_column('Host', justify='right')
+        table.add_column('GRUB (predicted)', justify='right')
+        for result in self.results:
+            table.add_row(Text(result['description']), f"{result['seconds']:.2f}s", f"{result['grub']:.1f}s")
+        console.print(table)
+
+    @staticmethod
+    def aes_ni(cpuinfo='/proc/cpuinfo'):
+        """
+        Returns:
+            bool: True if the CPU has AES instructions (the 'aes' flag: AES-NI on x86, the crypto extension on ARM).
+        """
+        try:
+            with open(cpuinfo, 'r') as f:
+                for line in f:
+                    if line.startswith(('flags', 'Features')):
+                        return 'aes' in line.split(':', 1)[1].split()
+        except OSError:
+            pass
+        return False
+
+    @staticmethod
+    def cipher_benchmark():
+        """
+        Runs 'cryptsetup benchmark' (in memory, no device needed).
+
+        Returns:
+            dict: (name, key size) -> (encryption, decryption) in MiB/s, empty if cryptsetup is not available.
+        """
+        try:
+            result = subprocess.run(['cryptsetup', 'benchmark'], capture_output=True, text=True, timeout=120)
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            return {}
+        results = {}
+        for line in result.stdout.splitlines():
+            match = Luks.BENCHMARK_LINE.match(line)
+            if match:
+                results[(match.group(1), int(match.group(2)))] = (float(match.group(3)), float(match.group(4)))
+        return results
+
+    def cipher_profile(self, cpu_brand='Unknown'):
+        """
+        Chooses the cipher of the storage volume: the fastest candidate (see CIPHERS) in 'cryptsetup benchmark'.
+        Without benchmark results, AES-XTS is chosen on CPUs with AES instructions, otherwise Adiantum (which
+        is fast in software). The volume is used on machines like this one, so the host CPU is representative.
+
+        Args:
+            cpu_brand (str, optional): The CPU brand (see System.get_cpu_brand), recorded with the profile. Defaults to 'Unknown'.
+
+        Returns:
+            dict: The profile: 'cipher', 'key_size', 'sector_size', 'no_workqueue' (bypass the dm-crypt work queues),
+                  'aes_ni', 'cpu' and 'benchmark' (MiB/s of the chosen cipher, None if not measured).
+        """
+        aes_ni = Luks.aes_ni()
+        results = Luks.cipher_benchmark()
+        candidates = [(min(results[(name, key_size)]), cipher, key_size) for cipher, key_size, name in Luks.CIPHERS if (name, key_size) in results]
+        if candidates:
+            speed, cipher, key_size = max(candidates)
+        else:
+            speed = None
+            cipher, key_size, _ = Luks.CIPHERS[0] if aes_ni else Luks.CIPHERS[1]
+
+        return {
+            'cipher': cipher,
+            'key_size': key_size,
+            'sector_size': 4096,        # Fewer, larger crypto operations; matches the flash pages
+            'no_workqueue': aes_ni,     # Encrypt inline when the CPU is fast, instead of queuing to kernel threads
+            'aes_ni': aes_ni,
+            'cpu': cpu_brand,
+            'benchmark': speed,
+        }
+
+    @staticmethod
+    def format_options(profile):
+        """
+        Returns:
+            str: cryptsetup luksFormat options of a cipher profile (e.g. {PART4_CRYPT}).
+        """
+        return f"--type luks2 --cipher {profile['cipher']} --key-size {profile['key_size']} --sector-size {profile['sector_size']}"
+
+    @staticmethod
+    def open_options(profile):
+        """
+        Returns:
+            str: cryptsetup open options of a cipher profile (e.g. {PART4_OPEN}); stored in the LUKS2 header (--persistent).
+        """
+        if profile['no_workqueue']:
+            return '--perf-no_read_workqueue --perf-no_write_workqueue --persistent'
+        return ''
+
+    @contextlib.contextmanager
+    def mapping(self, profile, directory='/var/tmp', size=256 * 1024 * 1024):
+        """
+        Creates a dm-crypt mapping with a cipher profile on a loop device, for benchmarks. The loop device
+        uses direct I/O, so the host page cache does not hide the cost of the mapping.
+
+        Args:
+            profile (dict): The profile (see 'cipher_profile').
+            directory (str, optional): Directory of the loop device image. Defaults to '/var/tmp'.
+            size (int, optional): Size of the loop device in bytes. Defaults to 256 MiB.
+
+        Yields:
+            tuple: (mapping, loop): the path of the mapping ('/dev/mapper/...') and of the loop device.
+
+        Raises:
+            OSError, subprocess.CalledProcessError: When the mapping can not be created.
+        """
+        name = f'secure-usb-bench-{os.getpid()}'
+        with tempfile.TemporaryDirectory(dir=directory) as work:
+            image, key_file = os.path.join(work, 'image'), os.path.join(work, 'keyfile')
+            with open(image, 'wb') as f:
+                f.truncate(size)
+            with open(os.open(key_file, os.O_WRONLY | os.O_CREAT, 0o600), 'wb') as f:
+                f.write(os.urandom(64))
+
+            loop = subprocess.run(['losetup', '--find', '--show', '--direct-io=on', image], capture_output=True, text=True, check=True).stdout.strip()
+            try:
+                subprocess.run(['cryptsetup', 'luksFormat', '-q', *Luks.format_options(profile).split(), *self.keyfile_options().split(),
+                                loop, key_file], capture_output=True, check=True)
+                subprocess.run(['cryptsetup', 'open', *Luks.open_options(profile).replace('--persistent', '').split(),
+                                '--key-file', key_file, loop, name], capture_output=True, check=True)
+                try:
+                    yield f'/dev/mapper/{name}', loop
+                finally:
+                    subprocess.run(['cryptsetup', 'close', name], capture_output=True)
+            finally:
+                subprocess.run(['losetup', '--detach', loop], capture_output=True)
+
+    def _measure(self, profile, directory, size):
+        """
+        Measures the write and read throughput of a cipher profile through a dm-crypt mapping on a loop device.
+
+        Returns:
+            tuple: (write, read) in MiB/s.
+        """
+        with self.mapping(profile, directory, size) as (device, _):
+            return Luks._throughput(device)
+
+    @staticmethod
+    def _throughput(device, block_size=4 * 1024 * 1024):
+        """Writes and reads a whole device with O_DIRECT, returns (write, read) in MiB/s."""
+        buffer = mmap.mmap(-1, block_size)
+        buffer.write(os.urandom(block_size))
+        results = []
+        for flags in (os.O_WRONLY, os.O_RDONLY):
+            fd = os.open(device, flags | os.O_DIRECT)
+            try:
+                size = os.lseek(fd, 0, os.SEEK_END)
+                size -= size % block_size
+                started = time.perf_counter()
+                for offset in range(0, size, block_size):
+                    if flags == os.O_WRONLY:
+                        os.pwritev(fd, [buffer], offset)
+                    else:
+                        os.preadv(fd, [buffer], offset)
+                if flags == os.O_WRONLY:
+                    os.fsync(fd)
+                results.append(size / (1024 * 1024) / (time.perf_counter() - started))
+            finally:
+                os.close(fd)
+        buffer.close()
+        return tuple(results)
+
+    def verify_profile(self, profile, directory='/var/tmp', size=256 * 1024 * 1024):
+        """
+        Verifies a cipher profile with a read/write benchmark of a dm-crypt mapping on a loop device, with and
+        without the work queues, and keeps the faster setting. The measurements are added to the profile.
+
+        Args:
+            profile (dict): The profile (see 'cipher_profile').
+            directory (str, optional): Directory of the loop device image. Defaults to '/var/tmp'.
+            size (int, optional): Size of the loop device in bytes. Defaults to 256 MiB.
+
+        Returns:
+            bool: True if the profile works (both measurements succeeded).
+        """
+        measurements = {}
+        try:
+            for no_workqueue in (True, False):
+                measurements[no_workqueue] = self._measure(dict(profile, no_workqueue=no_workqueue), directory, size)
+        except (OSError, subprocess.CalledProcessError):
+            return False
+
+        profile['measured'] = {('no workqueue' if key else 'workqueue'): {'write': value[0], 'read': value[1]} for key, value in measurements.items()}
+        profile['no_workqueue'] = min(measurements[True]) >= min(measurements[False])   # The slowest direction decides
+        return True
+
+    @staticmethod
+    def save_profile(profile, profile_file):
+        """
+        Records a cipher profile as JSON.
+
+        Args:
+            profile (dict): The profile (see 'cipher_profile').
+            profile_file (str): Path to the JSON file (e.g. 'install.crypto.json').
+        """
+        with open(profile_file, 'w') as f:
+            json.dump(profile, f, indent=2)
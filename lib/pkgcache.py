@@ -0,0 +1,216 @@
+import os
+import glob
+import gzip
+import json
+import time
+import hashlib
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+
+class PackageCache:
+    """
+    A class to keep the downloaded Debian packages (.deb) on the provisioning host between installations,
+    so only the first installation downloads the base system and the packages.
+
+    The cache directory is used by both downloaders:
+
+        debootstrap   --cache-dir <directory>
+        apt-get       <directory> bind mounted on /var/cache/apt/archives of the new install
+
+    Reuse is signature checked: a cached package is only used when its size and SHA256 match the package
+    index of the new install, which debootstrap and apt verified against the signed Release file of the
+    mirror ('verify' removes the others before they are offered). Packages not in the index are left to
+    apt, which checks every archive against the index before installing it.
+
+    The cache is bounded: after an installation ('update') the packages installed are marked as used, and
+    the least recently used packages are removed until the cache fits in 'max_size'. The use times and the
+    verified hashes are kept in 'index.json'.
+
+    Usage:
+        cache = PackageCache('/var/cache/secure-usb/debs')
+        cache.verify('/mnt/var/lib/apt/lists')              # After debootstrap, before apt-get
+        cache.update('/mnt/var/lib/dpkg/status')            # After apt-get
+        print(cache.result['reused'], cache.result['downloaded'])
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory='/var/cache/secure-usb/debs', max_size=4 * GiB):
+        """
+        Initializes the PackageCache.
+
+        Args:
+            directory (str, optional): The cache directory (absolute, on a persistent file system). Defaults to
+                                       '/var/cache/secure-usb/debs'.
+            max_size (int, optional): Bytes kept after an installation. Defaults to 4 GiB.
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.before = self.debs()   # The packages in the cache before this installation: file name: size
+        self.result = None
+
+    def debs(self):
+        """
+        Returns:
+            dict: The packages in the cache, as {file name: size}.
+        """
+        debs = {}
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return debs
+        with entries:
+            for entry in entries:
+                if entry.name.endswith('.deb') and entry.is_file(follow_symlinks=False):
+                    debs[entry.name] = entry.stat().st_size
+        return debs
+
+    def _load(self):
+        """Returns the index ({file name: {'used', 'size', 'mtime', 'sha256'}}), empty if missing or damaged."""
+        try:
+            with open(os.path.join(self.directory, PackageCache.INDEX), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, index):
+        """Writes the index (atomically)."""
+        path = os.path.join(self.directory, PackageCache.INDEX)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def packages(lists):
+        """
+        Reads the package indexes of an apt lists directory (e.g. '/mnt/var/lib/apt/lists').
+
+        Args:
+            lists (str): The directory with the '*_Packages' indexes (plain or gzip).
+
+        Returns:
+            dict: {file name: (size, SHA256)} of every package in the indexes.
+        """
+        packages = {}
+        for path in glob.glob(os.path.join(lists, '*_Packages')) + glob.glob(os.path.join(lists, '*_Packages.gz')):
+            try:
+                with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')) as f:
+                    text = f.read()
+            except (OSError, EOFError):
+                continue
+            for paragraph in text.split('\n\n'):
+                fields = {}
+                for line in paragraph.splitlines():
+                    key, separator, value = line.partition(':')
+                    if separator and not line.startswith(' '):
+                        fields[key] = value.strip()
+                if 'Filename' in fields and 'Size' in fields and 'SHA256' in fields:
+                    packages[os.path.basename(fields['Filename'])] = (int(fields['Size']), fields['SHA256'])
+        return packages
+
+    @staticmethod
+    def _sha256(path):
+        """Returns the SHA256 of a file."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(MiB):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def verify(self, lists):
+        """
+        Removes the cached packages that do not match the package index of the new install (a different
+        build of the same version, a damaged or partial download). Hashes are only computed for files that
+        changed since they were last verified.
+
+        Args:
+            lists (str): The apt lists directory of the new install (see 'packages').
+
+        Returns:
+            dict: 'verified', 'removed' and 'unknown' (not in the index) numbers of packages.
+        """
+        os.makedirs(os.path.join(self.directory, 'partial'), exist_ok=True)
+        packages = PackageCache.packages(lists)
+        index = self._load()
+        counts = {'verified': 0, 'removed': 0, 'unknown': 0}
+        for name, size in self.debs().items():
+            expected = packages.get(name)
+            if expected is None:
+                counts['unknown'] += 1
+                continue
+            path = os.path.join(self.directory, name)
+            entry = index.setdefault(name, {'used': os.stat(path).st_mtime})
+            mtime = os.stat(path).st_mtime_ns
+            if size == expected[0] and (entry.get('mtime') == mtime and entry.get('sha256') or PackageCache._sha256(path)) == expected[1]:
+                entry.update(size=size, mtime=mtime, sha256=expected[1])
+                counts['verified'] += 1
+                continue
+            os.remove(path)
+            index.pop(name, None)
+            self.before.pop(name, None)
+            counts['removed'] += 1
+        self._save(index)
+        return counts
+
+    @staticmethod
+    def installed(status):
+        """
+        Reads the installed packages of a dpkg status file (e.g. '/mnt/var/lib/dpkg/status').
+
+        Returns:
+            set: The archive file names of the installed packages, as apt ('1%3a2.0', with the epoch) and the
+                 mirror (without the epoch, as debootstrap) name them.
+        """
+        names = set()
+        try:
+            with open(status, 'r') as f:
+                text = f.read()
+        except OSError:
+            return names
+        for paragraph in text.split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in paragraph.splitlines() if ': ' in line and not line.startswith(' '))
+            if 'Package' in fields and 'Version' in fields and fields.get('Status', '').endswith(' installed'):
+                version, architecture = fields['Version'], fields.get('Architecture', 'all')
+                names.add(f"{fields['Package']}_{version.replace(':', '%3a')}_{architecture}.deb")
+                names.add(f"{fields['Package']}_{version.split(':', 1)[-1]}_{architecture}.deb")
+        return names
+
+    def update(self, status):
+        """
+        Marks the installed packages as used, and removes the least recently used packages until the cache
+        fits in 'max_size'. The result is stored in 'result': 'files', 'bytes' (kept), 'reused', 'downloaded',
+        'downloaded_bytes' (by this installation) and 'evicted'.
+
+        Args:
+            status (str): The dpkg status file of the new install.
+
+        Returns:
+            dict: The result.
+        """
+        now = time.time()
+        index = self._load()
+        debs = self.debs()
+        installed = PackageCache.installed(status)
+        for name in debs:
+            entry = index.setdefault(name, {'used': os.stat(os.path.join(self.directory, name)).st_mtime})
+            if name in installed:
+                entry['used'] = now
+
+        evicted, total = [], sum(debs.values())
+        for name in sorted(debs, key=lambda name: index[name]['used']):
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            index.pop(name)
+            total -= debs[name]
+            evicted.append(name)
+        for name in set(index) - set(debs):
+            index.pop(name)     # Removed by apt or by hand
+        self._save(index)
+
+        downloaded = [name for name in debs if name not in self.before]
+        self.result = {'files': len(debs) - len(evicted), 'bytes': total, 'reused': len(installed & set(self.before)),
+                       'downloaded': len(downloaded), 'downloaded_bytes': sum(debs[name] for name in downloaded), 'evicted': len(evicted)}
+        return self.result
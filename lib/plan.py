@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import threading
+from dataclasses import dataclass, field, asdict
+from rich.table import Table
+from rich.text import Text
+
+@dataclass
+class PlanStep:
+    """A single resolved step of an installation plan."""
+    description: str
+    command: str
+    inputs: list = field(default_factory=list)      # {VARIABLES} used by the step
+    outputs: list = field(default_factory=list)     # Variables set by the step (output_var)
+    devices: list = field(default_factory=list)     # Block devices touched by the step
+    root: str = None                                # Root directory the command runs in (Chroot)
+    seconds: float = None                           # Estimated duration (None if never recorded)
+    bytes: int = None                               # Estimated bytes written to the device (None if never recorded)
+
+class TimingHistory:
+    """
+    A class to record step timings of earlier runs, and estimate the cost of future runs.
+
+    Steps are identified by their unsubstituted description and command templates, which are the
+    same for every run. The history is stored as JSON (e.g. 'install.timings.json').
+    """
+
+    def __init__(self, history_file='install.timings.json'):
+        """
+        Initializes the TimingHistory and loads earlier recordings.
+
+        Args:
+            history_file (str, optional): Path to the history file. Defaults to 'install.timings.json'.
+        """
+        self.history_file = history_file
+        self.steps = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.history_file, 'r') as f:
+                self.steps = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.steps = {}
+
+    @staticmethod
+    def key(description, command):
+        """Returns the key identifying a step in the history."""
+        return f'{description}\n{command}'
+
+    def record(self, description, command, seconds, bytes_written=None):
+        """
+        Records the measured cost of a step as a running average over all runs, and saves the history.
+
+        Args:
+            description (str): The unsubstituted description of the step.
+            command (str): The unsubstituted command of the step.
+            seconds (float): Wall-clock time of the step.
+            bytes_written (int, optional): Bytes written to the device during the step. Defaults to None.
+        """
+        with self.lock:
+            step = self.steps.setdefault(TimingHistory.key(description, command), {'runs': 0, 'seconds': 0.0, 'bytes': 0})
+            runs = step['runs'] + 1
+            step['seconds'] += (seconds - step['seconds']) / runs
+            if bytes_written is not None:
+                step['bytes'] += int((bytes_written - step['bytes']) / runs)
+            step['runs'] = runs
+            self.save()
+
+    def estimate(self, description, command):
+        """
+        Returns:
+            tuple: (seconds, bytes) estimated for the step, or (None, None) if it was never recorded.
+        """
+        step = self.steps.get(TimingHistory.key(description, command))
+        if not step:
+            return None, None
+        return step['seconds'], step['bytes']
+
+    def save(self):
+        """Writes the history to disk."""
+        with open(self.history_file, 'w') as f:
+            json.dump(self.steps, f, indent=2)
+
+    @staticmethod
+    def bytes_written(device):
+        """
+        Reads the number of bytes written to a block device since boot from /sys/class/block/<dev>/stat.
+
+        Args:
+            device (str): The device (e.g. '/dev/sdb').
+
+        Returns:
+            int: Bytes written, or None if the device has no statistics.
+        """
+        try:
+            with open(f'/sys/class/block/{os.path.basename(device)}/stat', 'r') as f:
+                return int(f.read().split()[6]) * 512   # Field 7: sectors written (always 512 bytes)
+        except (OSError, IndexError, ValueError):
+            return None
+
+class Plan:
+    """
+    A class to collect the resolved steps of an installation without executing them (dry-run).
+
+    When a Shell has a plan, Shell.execute resolves every {VARIABLE} and adds the step to the plan
+    instead of running it. Variables set by 'output_var' get a placeholder value (e.g. '<PART3_UUID>').
+    """
+
+    # Regex to find {VARIABLE} placeholders (same format as Shell._substitute_globals)
+    PATTERN = re.compile(r"\{([a-zA-Z_][a-zA-Z0-9_]*)\}")
+
+    # Regex to find block devices in a command
+    DEVICE = re.compile(r"/dev/(?!null\b|random\b|urandom\b|zero\b|stdin\b)[\w/.-]+")
+
+    def __init__(self, history=None):
+        """
+        Initializes the Plan.
+
+        Args:
+            history (TimingHistory, optional): Recorded timings used for the estimates. Defaults to None.
+        """
+        self.history = history
+        self.steps = []
+        self.root = None    # Set by Chroot while adding steps running inside the chroot
+
+    def add(self, description, command, resolved_description, resolved_command, input=None, output_var=None):
+        """
+        Adds a step to the plan.
+
+        Args:
+            description (str): The unsubstituted description.
+            command (str): The unsubstituted command.
+            resolved_description (str): The description with all variables substituted.
+            resolved_command (str): The command with all variables substituted.
+            input (str, optional): The unsubstituted input of the command. Defaults to None.
+            output_var (str, optional): The variable set by the step. Defaults to None.
+
+        Returns:
+            PlanStep: The added step.
+        """
+        inputs = []
+        for text in (description, command, input or ''):
+            for name in Plan.PATTERN.findall(text):
+                if name not in inputs:
+                    inputs.append(name)
+
+        seconds, bytes_written = self.history.estimate(description, command) if self.history else (None, None)
+
+        step = PlanStep(
+            description=resolved_description,
+            command=resolved_command,
+            inputs=inputs,
+            outputs=[output_var] if output_var else [],
+            devices=sorted(set(Plan.DEVICE.findall(resolved_command))),
+            root=self.root,
+            seconds=seconds,
+            bytes=bytes_written,
+        )
+        self.steps.append(step)
+        return step
+
+    def totals(self):
+        """
+        Returns:
+            tuple: (seconds, bytes, unknown) - the estimated totals and the number of steps without an estimate.
+        """
+        seconds = sum(step.seconds for step in self.steps if step.seconds is not None)
+        bytes_written = sum(step.bytes for step in self.steps if step.bytes is not None)
+        unknown = sum(1 for step in self.steps if step.seconds is None)
+        return seconds, bytes_written, unknown
+
+    def to_json(self):
+        """Returns the plan as JSON."""
+        return json.dumps([asdict(step) for step in self.steps], indent=2)
+
+    @staticmethod
+    def _format_seconds(seconds):
+        if seconds is None:
+            return '?'
+        if seconds < 10:
+            return f'{seconds:.1f}s'
+        minutes, seconds = divmod(int(round(seconds)), 60)
+        return f'{minutes}m{seconds:02d}s' if minutes else f'{seconds}s'
+
+    @staticmethod
+    def _format_bytes(size):
+        if not size:
+            return '' if size is None else '0'
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if size < 1024:
+                return f'{size:.0f}{unit}'
+            size /= 1024
+        return f'{size:.1f}TiB'
+
+    def print(self, console):
+        """
+        Prints the plan as a table on the rich console.
+
+        Args:
+            console (Console): The rich console object.
+        """
+        table = Table(title='Installation plan', show_lines=False)
+        table.add_column('#', justify='right')
+        table.add_column('Description', style='info')
+        table.add_column('Command', style='command')
+        table.add_column('Inputs')
+        table.add_column('Outputs')
+        table.add_column('Devices')
+        table.add_column('Time', justify='right')
+        table.add_column('Written', justify='right')
+
+        for index, step in enumerate(self.steps, start=1):
+            command = f'chroot {step.root}: {step.command}' if step.root else step.command
+            table.add_row(
+                str(index), Text(step.description), Text(command),   # Text: commands may contain [markup]
+                ' '.join(step.inputs), ' '.join(step.outputs), ' '.join(step.devices),
+                Plan._format_seconds(step.seconds), Plan._format_bytes(step.bytes),
+            )
+
+        seconds, bytes_written, unknown = self.totals()
+        table.add_section()
+        table.add_row('', 'Total', f'{len(self.steps)} steps ({unknown} without recorded timings)', '', '', '',
+                      Plan._format_seconds(seconds), Plan._format_bytes(bytes_written))
+        console.print(table)
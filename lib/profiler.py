@@ -0,0 +1,165 @@
+import json
+import time
+import threading
+from rich.table import Table
+from rich.text import Text
+
+class Profiler:
+    """
+    A class to profile an installation: the wall time, child CPU time and return code of every
+    Shell.execute step, grouped by the phases of the installation (see Shell.phase).
+
+    At the end of a run the profiler reports the time per phase, the slowest steps and the
+    critical path (the chain of steps that determined the total wall time, also when steps ran
+    concurrently), and exports everything as JSON to compare runs.
+    """
+
+    def __init__(self):
+        """Initializes the Profiler."""
+        self.started = time.time()
+        self.origin = time.monotonic()
+        self.phases = []    # [{'name', 'start', 'end'}]
+        self.steps = []     # [{'phase', 'description', 'command', 'returncode', 'start', 'end', 'wall', 'user', 'system'}]
+        self.lock = threading.Lock()
+
+    def _now(self):
+        """Returns the number of seconds since the profiler was started."""
+        return time.monotonic() - self.origin
+
+    def phase(self, name):
+        """
+        Starts a new phase (ending the current one).
+
+        Args:
+            name (str): Name of the phase (e.g. 'Partitioning USB Device').
+        """
+        with self.lock:
+            now = self._now()
+            if self.phases and self.phases[-1]['end'] is None:
+                self.phases[-1]['end'] = now
+            self.phases.append({'name': name, 'start': now, 'end': None})
+
+    def record(self, description, command, returncode, start, end, cpu=None):
+        """
+        Records a finished step.
+
+        Args:
+            description (str): Description of the step.
+            command (str): The command executed.
+            returncode (int): Return code of the command (None if an exception occurred).
+            start (float): time.monotonic() when the step started.
+            end (float): time.monotonic() when the step ended.
+            cpu (tuple, optional): (user, system) CPU time of the command and its children. Defaults to None.
+        """
+        with self.lock:
+            self.steps.append({
+                'phase': self.phases[-1]['name'] if self.phases else '',
+                'description': description,
+                'command': command,
+                'returncode': returncode,
+                'start': start - self.origin,
+                'end': end - self.origin,
+                'wall': end - start,
+                'user': cpu[0] if cpu else None,
+                'system': cpu[1] if cpu else None,
+            })
+
+    def finish(self):
+        """Ends the current phase."""
+        with self.lock:
+            if self.phases and self.phases[-1]['end'] is None:
+                self.phases[-1]['end'] = self._now()
+
+    def critical_path(self):
+        """
+        Determines the critical path from the recorded start and end times: starting from the step
+        that finished last, repeatedly take the step that finished last before the current one started.
+
+        Returns:
+            list: The steps on the critical path, in execution order.
+        """
+        with self.lock:
+            steps = sorted(self.steps, key=lambda step: step['end'])
+        path = []
+        current = steps[-1] if steps else None
+        while current is not None:
+            path.append(current)
+            before = [step for step in steps if step['end'] <= current['start']]
+            current = before[-1] if before else None
+        return list(reversed(path))
+
+    def summary(self):
+        """
+        Returns:
+            list: Per phase: {'name', 'elapsed', 'steps', 'wall', 'cpu', 'failed'}.
+        """
+        self.finish()
+        summary = []
+        for phase in self.phases:
+            steps = [step for step in self.steps if step['phase'] == phase['name']]
+            summary.append({
+                'name': phase['name'],
+                'elapsed': phase['end'] - phase['start'],
+                'steps': len(steps),
+                'wall': sum(step['wall'] for step in steps),
+                'cpu': sum((step['user'] or 0) + (step['system'] or 0) for step in steps),
+                'failed': sum(1 for step in steps if step['returncode'] != 0),
+            })
+        return summary
+
+    def save(self, profile_file):
+        """
+        Exports the profile as JSON.
+
+        Args:
+            profile_file (str): Path to the JSON file (e.g. 'install.profile.json').
+        """
+        with open(profile_file, 'w') as f:
+            json.dump({
+                'started': self.started,
+                'phases': self.summary(),
+                'steps': self.steps,
+                'critical_path': [step['description'] for step in self.critical_path()],
+            }, f, indent=2)
+
+    def report(self, console, top=10):
+        """
+        Prints the profile report on the rich console.
+
+        Args:
+            console (Console): The rich console object.
+            top (int, optional): Number of slowest steps to show. Defaults to 10.
+        """
+        phases = Table(title='Time per phase')
+        phases.add_column('Phase')
+        phases.add_column('Elapsed', justify='right')
+        phases.add_column('Steps', justify='right')
+        phases.add_column('Step time', justify='right')
+        phases.add_column('CPU', justify='right')
+        phases.add_column('Failed', justify='right')
+        for phase in self.summary():
+            phases.add_row(Text(phase['name']), f"{phase['elapsed']:.1f}s", str(phase['steps']),
+                           f"{phase['wall']:.1f}s", f"{phase['cpu']:.1f}s", str(phase['failed']))
+        console.print(phases)
+
+        slowest = Table(title=f'Top {top} slowest steps')
+        slowest.add_column('Phase')
+        slowest.add_column('Step')
+        slowest.add_column('Wall', justify='right')
+        slowest.add_column('CPU', justify='right')
+        slowest.add_column('Return code', justify='right')
+        for step in sorted(self.steps, key=lambda step: step['wall'], reverse=True)[:top]:
+            cpu = f"{step['user'] + step['system']:.1f}s" if step['user'] is not None else '-'
+            slowest.add_row(Text(step['phase']), Text(step['description']), f"{step['wall']:.1f}s", cpu, str(step['returncode']))
+        console.print(slowest)
+
+        path = self.critical_path()
+        critical = Table(title=f"Critical path ({sum(step['wall'] for step in path):.1f}s in {len(path)} steps)")
+        critical.add_column('Phase')
+        critical.add_column('Time', justify='right')
+        critical.add_column('Steps', justify='right')
+        for phase in self.phases:
+            steps = [step for step in path if step['phase'] == phase['name']]
+            if steps:
+                critical.add_row(Text(phase['name']), f"{sum(step['wall'] for step in steps):.1f}s", str(len(steps)))
+        console.print(critical)
@@ -0,0 +1,156 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class Scheduler:
+    """
+    A class to execute Shell steps as a dependency graph, running independent steps concurrently.
+
+    A step is a dictionary with the arguments for 'Shell.execute', optionally extended with:
+        requires (list): Resources the step reads (e.g. 'PART3_LUKS', 'mnt').
+        provides (list): Resources the step creates or modifies.
+
+    Every {VARIABLE} used in the description, command or input is an implicit requirement,
+    and the 'output_var' of a step is an implicit resource it provides.
+
+    The order of the step list defines the meaning of the graph (like a script would):
+        - a step reading a resource waits for the last earlier step providing it
+        - a step providing a resource waits for the last earlier provider and all readers since
+    """
+
+    # Step keys used by the scheduler only (not passed to Shell.execute)
+    STEP_KEYS = ('requires', 'provides')
+
+    # Regex to find {VARIABLE} placeholders (same format as Shell._substitute_globals)
+    PATTERN = re.compile(r"\{([a-zA-Z_][a-zA-Z0-9_]*)\}")
+
+    def __init__(self, shell, workers=4):
+        """
+        Initializes the Scheduler.
+
+        Args:
+            shell (Shell): The shell executing the steps.
+            workers (int, optional): Maximum number of steps running at the same time. Defaults to 4.
+        """
+        self.shell = shell
+        self.workers = workers
+
+    def _reads(self, step):
+        """Returns the set of resources read by a step."""
+        reads = set(step.get('requires', []))
+        for key in ('description', 'command', 'input'):
+            if step.get(key):
+                reads.update(Scheduler.PATTERN.findall(step[key]))
+        return reads
+
+    def _writes(self, step):
+        """Returns the set of resources provided by a step."""
+        writes = set(step.get('provides', []))
+        if step.get('output_var'):
+            writes.add(step['output_var'])
+        return writes
+
+    def graph(self, steps):
+        """
+        Determines the dependencies between steps.
+
+        Args:
+            steps (list): A list of step dictionaries.
+
+        Returns:
+            list: For every step the set of indexes of the steps it has to wait for.
+        """
+        last_writer = {}    # resource -> index of the last step providing it
+        readers = {}        # resource -> indexes of the steps reading it since the last provider
+        dependencies = []
+
+        for index, step in enumerate(steps):
+            reads, writes = self._reads(step), self._writes(step)
+            depends = set()
+
+            for resource in reads:
+                if resource in last_writer:
+                    depends.add(last_writer[resource])
+
+            for resource in writes:
+                if resource in last_writer:
+                    depends.add(last_writer[resource])
+                depends.update(readers.get(resource, ()))
+
+            for resource in reads:
+                readers.setdefault(resource, set()).add(index)
+            for resource in writes:
+                last_writer[resource] = index
+                readers[resource] = set()
+
+            depends.discard(index)
+            dependencies.append(depends)
+
+        return dependencies
+
+    def critical_path(self, steps, durations):
+        """
+        Calculates the length of the critical path through the graph.
+
+        Args:
+            steps (list): A list of step dictionaries.
+            durations (list): The (expected) duration in seconds of every step.
+
+        Returns:
+            float: The minimal wall-clock time to run all steps with unlimited workers.
+        """
+        finish = []
+        for depends, duration in zip(self.graph(steps), durations):
+            finish.append(max((finish[i] for i in depends), default=0.0) + duration)
+        return max(finish, default=0.0)
+
+    def _run_step(self, step):
+        """Runs a single step in its own output section, so its output is not interleaved."""
+        arguments = {key: value for key, value in step.items() if key not in Scheduler.STEP_KEYS}
+        with self.shell.section():
+            return self.shell.execute(**arguments)
+
+    def run(self, steps):
+        """
+        Runs the steps concurrently, respecting their dependencies.
+
+        When a step fails no new steps are started; steps already running are completed.
+
+        Args:
+            steps (list): A list of step dictionaries.
+
+        Returns:
+            bool: True if all steps were successful, False otherwise.
+        """
+        dependencies = self.graph(steps)
+        waiting = {index: set(depends) for index, depends in enumerate(dependencies)}
+        dependents = {index: [] for index in range(len(steps))}
+        for index, depends in enumerate(dependencies):
+            for depend in depends:
+                dependents[depend].append(index)
+
+        all_successful = True
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                # Start every step that has no outstanding dependencies
+                if all_successful:
+                    ready = sorted(index for index, depends in waiting.items() if not depends)
+                    for index in ready:
+                        del waiting[index]
+                        running[pool.submit(self._run_step, steps[index])] = index
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    if not future.result():
+                        all_successful = False
+                        continue
+                    for dependent in dependents[index]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(index)
+
+        return all_successful
@@ -0,0 +1,211 @@
+import os
+import re
+import queue
+import uuid
+import threading
+import subprocess
+from lib.capture import Capture
+
+class BashSession:
+    """
+    A class to run many shell commands in one long-lived bash process.
+
+    Commands are sent over the stdin pipe of the bash process and their output is framed with a
+    unique sentinel, which carries the exit status of the command:
+
+        ( eval $'<command>' ) </dev/null
+        printf '\n<sentinel> %d\n' $?          (stdout)
+        printf '\n<sentinel>\n' >&2            (stderr)
+
+    Every command runs in its own subshell (a fork of the session, not a new exec of bash), so a
+    command has the same semantics as in a fresh shell: 'exit', 'set -e', 'cd' etc. do not leak
+    into the next command. Environment variables changed in the Python process (os.environ) are
+    exported into the session before a command runs.
+    """
+
+    # Pattern splitting output into lines (progress meters such as 'dd' use '\r')
+    LINE_SPLIT = re.compile(rb'[\r\n]')
+
+    def __init__(self, command=None, cwd=None):
+        """
+        Initializes the BashSession. The bash process is started on first use.
+
+        Args:
+            command (list, optional): Command starting the session. Defaults to a plain non-interactive bash.
+            cwd (str, optional): Working directory of the session. Defaults to None (current directory).
+        """
+        self.command = command if command else ['/bin/bash', '--noprofile', '--norc']
+        self.cwd = cwd
+        self.process = None
+        self.lines = None
+        self.environ = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def quote(text):
+        """
+        Quotes a string as a bash ANSI-C string ($'...'), which bash never interprets further.
+
+        Args:
+            text (str): The string to quote.
+
+        Returns:
+            str: The quoted string.
+        """
+        quoted = []
+        for byte in text.encode():
+            if 0x20 <= byte < 0x7f and byte not in (0x27, 0x5c):   # Printable, except ' and \
+                quoted.append(chr(byte))
+            else:
+                quoted.append(f'\\x{byte:02x}')
+        return "$'" + ''.join(quoted) + "'"
+
+    def _read(self, pipe, name):
+        """Reads a pipe of the session in chunks and queues every line as (name, line)."""
+        pending = b''
+        for chunk in iter(lambda: pipe.read1(65536), b''):
+            lines = BashSession.LINE_SPLIT.split(pending + chunk)
+            pending = lines.pop()
+            for line in lines:
+                self.lines.put((name, line))
+        if pending:
+            self.lines.put((name, pending))
+        self.lines.put((name, None))    # End of file: the session has exited
+
+    def _children_times(self):
+        """
+        Reads the CPU time of the commands the session has waited for from /proc/<pid>/stat.
+
+        Returns:
+            tuple: (user, system) CPU time in seconds, or None if not available.
+        """
+        try:
+            with open(f'/proc/{self.process.pid}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            return int(fields[13]) / ticks, int(fields[14]) / ticks     # cutime, cstime
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def alive(self):
+        """
+        Returns:
+            bool: True if the bash process is running.
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Starts (or restarts) the bash process.
+        """
+        self.close()
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+        )
+        self.lines = queue.Queue()
+        self.environ = dict(os.environ)     # The environment the session was started with
+        for pipe, name in ((self.process.stdout, 'stdout'), (self.process.stderr, 'stderr')):
+            threading.Thread(target=self._read, args=(pipe, name), daemon=True).start()
+
+    def close(self):
+        """
+        Stops the bash process (it exits when its input is closed).
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def _export(self):
+        """
+        Returns the bash statements synchronising the environment of the session with os.environ.
+        """
+        statements = []
+        current = dict(os.environ)
+        for name, value in current.items():
+            if self.environ.get(name) != value and re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name):
+                statements.append(f'export {name}={BashSession.quote(value)}')
+        for name in self.environ:
+            if name not in current and re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name):
+                statements.append(f'unset {name}')
+        self.environ = current
+        return ''.join(statement + '\n' for statement in statements)
+
+    def run(self, command, input=None, on_line=None, head=None, tail=None, keep=False):
+        """
+        Runs a command in the session.
+
+        When the session has crashed it is restarted first. When it crashes while running the
+        command, the command fails with return code -1 and the session is restarted by the next call.
+
+        Args:
+            command (str): The shell command to execute.
+            input (str, optional): Input for the command. Defaults to None.
+            on_line (callable, optional): Called with (name, text) for every output line as it arrives. Defaults to None.
+            head (int, optional): Number of leading lines kept per stream. Defaults to None (all lines).
+            tail (int, optional): Number of trailing lines kept per stream (see Capture). Defaults to None (all lines).
+            keep (bool, optional): Also return the whole stdout (see Capture.value). Defaults to False.
+
+        Returns:
+            tuple: (returncode, stdout, stderr, cpu, value) with stdout and stderr as stripped (bounded) strings, cpu the
+                   (user, system) CPU time of the command (None if unknown), and value the whole stdout (None without 'keep').
+        """
+        with self.lock:
+            if not self.alive():
+                self.start()
+
+            sentinel = uuid.uuid4().hex
+            if input:
+                script = f'printf %s {BashSession.quote(input)} | ( eval {BashSession.quote(command)} )\n'
+            else:
+                script = f'( eval {BashSession.quote(command)} ) </dev/null\n'
+            script = self._export() + script
+            script += f"printf '\\n{sentinel} %d\\n' $?\n"
+            script += f"printf '\\n{sentinel}\\n' >&2\n"
+
+            before = self._children_times()
+            try:
+                self.process.stdin.write(script.encode())
+                self.process.stdin.flush()
+            except OSError:
+                return -1, '', 'Session terminated unexpectedly.', None, '' if keep else None
+
+            output = {'stdout': Capture(head, tail, keep), 'stderr': Capture(head, tail)}
+            open_streams = {'stdout', 'stderr'}
+            returncode = -1
+
+            while open_streams:
+                name, line = self.lines.get()
+                if line is None:
+                    open_streams.discard(name)      # Session crashed
+                    continue
+
+                line = line.decode(errors='replace')
+                text = line.rstrip()
+                status = re.fullmatch(f'{sentinel} (\\d+)', text) if name == 'stdout' else None
+                if status:
+                    returncode = int(status.group(1))
+                    open_streams.discard(name)
+                elif name == 'stderr' and text == sentinel:
+                    open_streams.discard(name)
+                else:
+                    output[name].append(line)
+                    if text and on_line:
+                        on_line(name, text)
+
+            after = self._children_times() if self.alive() else None
+            cpu = (after[0] - before[0], after[1] - before[1]) if before and after else None
+
+            return returncode, output['stdout'].text(), output['stderr'].text(), cpu, output['stdout'].value()
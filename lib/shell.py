@@ -1,11 +1,22 @@
 import subprocess
+import threading
 import logging
+import logging.handlers
+import atexit
+import queue
 import os
 import re
+import time
+from contextlib import contextmanager
 from rich.panel import Panel
 from rich.text import Text
 from rich.style import Style
+from rich.rule import Rule
 from rich.logging import RichHandler
+from lib.scheduler import Scheduler
+from lib.session import BashSession
+from lib.plan import TimingHistory
+from lib.capture import Capture
 
 class Shell:
     """
@@ -36,7 +47,12 @@ class Shell:
             record.msg = f'[{log_color}]{record.msg}[/{log_color}]'
             return super().format(record)
 
-    def __init__(self, console, log, debug=False, theme=None, log_file='install.log'):
+    # Pattern splitting streamed output into lines (progress meters such as 'dd' use '\r')
+    LINE_SPLIT = re.compile(rb'[\r\n]')
+
+    def __init__(self, console, log, debug=False, theme=None, log_file='install.log', stream=False, head_lines=50, tail_lines=200,
+                 backend='popen', history=None, plan=None, profiler=None, journal=None, log_max_bytes=10 * 1024 * 1024, log_backups=5,
+                 dashboard=None):
         """
         Initializes the Shell.
 
@@ -46,45 +62,125 @@ class Shell:
             debug (bool, optional): Enables debug output. Defaults to False.
             theme (dict, optional): A dictionary defining the theme for rich console. Defaults to None.
             log_file (str, optional): Path to the log file. Defaults to 'install.log'.
+            stream (bool, optional): Stream command output line by line instead of buffering it. Defaults to False.
+            head_lines (int, optional): Number of leading output lines captured per stream of a command. Defaults to 50.
+            tail_lines (int, optional): Number of trailing output lines captured per stream of a command; the lines
+                                        between head and tail are elided. Defaults to 200.
+            backend (str, optional): 'popen' starts a new bash for every command, 'session' runs the commands in
+                                     long-lived bash sessions (see lib/session.py). Defaults to 'popen'.
+            history (TimingHistory, optional): Records the duration and bytes written of every step. Defaults to None.
+            plan (Plan, optional): Collect the steps in this plan instead of executing them (dry-run). Defaults to None.
+            profiler (Profiler, optional): Records wall time, CPU time and return code of every step. Defaults to None.
+            journal (Journal, optional): Records completed steps, and skips them when resuming. Defaults to None.
+            log_max_bytes (int, optional): Size at which the log file is rotated. Defaults to 10 MiB.
+            log_backups (int, optional): Number of rotated log files kept. Defaults to 5.
+            dashboard (Dashboard, optional): Live progress dashboard replacing the '[ ]' status lines. Defaults to None.
         """
         self.debug = debug
         self.log_file = log_file
+        self.stream = stream
+        self.head_lines = head_lines
+        self.tail_lines = tail_lines
+        self.backend = backend
+        self.history = history
+        self.plan = plan
+        self.profiler = profiler
+        self.journal = journal
+        self.dashboard = dashboard
+        self.failed = []    # Descriptions of the steps that failed
         self.theme = theme if theme else Shell.COLOR_THEME # Use Shell.COLOR_THEME as default
         self.console = console
         self.log = log
 
+        # Per-thread output section (see 'section'), used to keep output of concurrent steps together
+        self._local = threading.local()
+        self._section_lock = threading.Lock()
+
+        # Idle bash sessions of the 'session' backend (one per concurrently executing thread)
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
         # Configure the logger
         self.log.setLevel(logging.DEBUG if self.debug else logging.INFO)
         self.log.propagate = False
-
-        # Check if the log already has a file handler and add if it doesn't
-        has_file_handler = any(isinstance(handler, logging.FileHandler) for handler in self.log.handlers)
-        if not has_file_handler:
-            self.file_handler = logging.FileHandler(self.log_file, mode='a')
+        self.log.addFilter(self._section_filter)
+
+        # Log records are handed to a queue, and written to the log file and console by a background thread,
+        # so writing (large) command output never stalls the commands. Add the queue only once per logger.
+        has_queue_handler = any(isinstance(handler, logging.handlers.QueueHandler) for handler in self.log.handlers)
+        if not has_queue_handler:
+            # Log file, rotated by size
+            self.file_handler = logging.handlers.RotatingFileHandler(self.log_file, mode='a', maxBytes=log_max_bytes, backupCount=log_backups)
             self.formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
             self.file_handler.setFormatter(self.formatter)
-            self.log.addHandler(self.file_handler)
-
-        # Rich Handler for Console Output (only for execute method feedback)
-        self.console_handler = RichHandler(
-            console=self.console, # Explicitly pass the console object
-            rich_tracebacks=True,
-            markup=True,
-            show_time=False,
-            show_level=False, # Don't show level again as it's in the console output
-            show_path=False
-        )
-        self.console_formatter = Shell.CustomFormatter(self.theme)
-        self.console_handler.setFormatter(self.console_formatter)
-        self.console_handler.setLevel(logging.WARNING) # Only print warnings or higher to the console
 
-        # Ensure the console handler is added only once
-        has_console_handler = any(isinstance(handler, RichHandler) for handler in self.log.handlers)
-        if not has_console_handler:
-            self.log.addHandler(self.console_handler)
+            # Rich Handler for Console Output (only for execute method feedback)
+            self.console_handler = RichHandler(
+                console=self.console, # Explicitly pass the console object
+                rich_tracebacks=True,
+                markup=True,
+                show_time=False,
+                show_level=False, # Don't show level again as it's in the console output
+                show_path=False
+            )
+            self.console_formatter = Shell.CustomFormatter(self.theme)
+            self.console_handler.setFormatter(self.console_formatter)
+            self.console_handler.setLevel(logging.WARNING) # Only print warnings or higher to the console
+
+            # The console handler must be last: its formatter adds markup to the record
+            log_queue = queue.SimpleQueue()
+            self.log.addHandler(logging.handlers.QueueHandler(log_queue))
+            self.listener = logging.handlers.QueueListener(log_queue, self.file_handler, self.console_handler, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.listener.stop)     # Write out the queued records before exiting
 
         self.log.info("Shell initialized.")
 
+    def _section_filter(self, record):
+        """
+        Logging filter that holds back records emitted inside an output section.
+
+        Returns:
+            bool: False if the record was buffered (flushed later by 'section'), True otherwise.
+        """
+        section = getattr(self._local, 'section', None)
+        if section is None:
+            return True
+        section.append(('log', record))
+        return False
+
+    def _print(self, *args, **kwargs):
+        """
+        Prints to the console, or buffers the output when running inside an output section.
+        """
+        section = getattr(self._local, 'section', None)
+        if section is None:
+            self.console.print(*args, **kwargs)
+        else:
+            section.append(('print', (args, kwargs)))
+
+    @contextmanager
+    def section(self):
+        """
+        Context manager collecting all console and log output of the current thread,
+        and writing it out as one uninterrupted block when the section ends.
+
+        This keeps the output of steps executed concurrently (see Scheduler) from interleaving.
+        """
+        section = []
+        self._local.section = section
+        try:
+            yield section
+        finally:
+            self._local.section = None
+            with self._section_lock:
+                for kind, item in section:
+                    if kind == 'log':
+                        self.log.handle(item)
+                    else:
+                        args, kwargs = item
+                        self.console.print(*args, **kwargs)
+
     def __substitute_globals(self, text):
         """
         Substitutes global $variables in a string.
@@ -166,7 +262,196 @@ class Shell:
 
         return substituted_string
 
-    def execute(self, description, command, input=None, output_var=None, check_returncode=True, strict=False):
+    def _wait(self, process):
+        """
+        Waits for a process to exit and collects its resource usage (including the processes it waited for).
+
+        Args:
+            process (Popen): The process.
+
+        Returns:
+            tuple: (user, system) CPU time in seconds used by the process and its children.
+        """
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return rusage.ru_utime, rusage.ru_stime
+
+    def _write_input(self, process, input):
+        """Writes the input to the process and closes its stdin."""
+        try:
+            process.stdin.write(input.encode())
+            process.stdin.close()
+        except BrokenPipeError:
+            pass    # The command exited without reading its input
+
+    def _read_stream(self, pipe, name, capture, on_line=None, section=None):
+        """
+        Reads a pipe in chunks as data arrives and splits it into lines.
+
+        Only a bounded number of lines is captured, so memory use does not grow with the output size.
+
+        Args:
+            pipe: The binary pipe (stdout or stderr of the process).
+            name (str): Name of the stream ('stdout' or 'stderr').
+            capture (Capture): Receives the lines.
+            on_line (callable, optional): Called with (name, text) for every line as it arrives. Defaults to None.
+            section (list, optional): Output section of the calling thread. Defaults to None.
+        """
+        self._local.section = section
+        pending = b''
+        for chunk in iter(lambda: pipe.read1(65536), b''):
+            lines = Shell.LINE_SPLIT.split(pending + chunk)
+            pending = lines.pop()   # Last element is an incomplete line (or empty)
+            for line in lines:
+                self._capture_line(name, line.decode(errors='replace'), capture, on_line)
+        if pending:
+            self._capture_line(name, pending.decode(errors='replace'), capture, on_line)
+        pipe.close()
+
+    def _capture_line(self, name, text, capture, on_line=None):
+        """Captures a line of output, and passes it on immediately when streaming."""
+        capture.append(text)
+        text = text.rstrip()
+        if text and on_line:
+            on_line(name, text)
+
+    def _stream_line(self, name, text):
+        """
+        Handles a single streamed output line: log it and show it in debug mode.
+        """
+        text = text.rstrip()
+        if not text:
+            return
+        self.log.info(f"Command - {name}: {text}")
+        if self.debug:
+            self._print(Text(text, style=self.theme[name]))
+
+    def _log_output(self, stdout_str, stderr_str):
+        """Logs the (bounded) output of a command that was not streamed."""
+        # Log stdout
+        if stdout_str:
+            self.log.info(f"Command - stdout: {stdout_str}")
+
+        # Log stderr
+        if stderr_str:
+            self.log.info(f"Command - stderr: {stderr_str}")
+
+    def _run_process(self, shell_command, input=None, on_line=None, keep=False):
+        """
+        Runs a shell command in a new bash process.
+
+        Args:
+            shell_command (str): The (substituted) shell command to execute.
+            input (str, optional): Input for the command. Defaults to None.
+            on_line (callable, optional): Called with (name, text) for every output line while the command runs
+                                          (streaming). Defaults to None (the output is logged when the command ends).
+            keep (bool, optional): Also return the whole stdout (see Capture.value). Defaults to False.
+
+        Returns:
+            tuple: (returncode, stdout, stderr, cpu, value) with stdout and stderr the captured (head and tail) lines,
+                   cpu the (user, system) CPU time of the command, and value the whole stdout (None without 'keep').
+        """
+        process = subprocess.Popen(
+            shell_command,
+            shell=True,
+            stdin=subprocess.PIPE if input else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            executable='/bin/bash'
+        )
+
+        stdout = Capture(self.head_lines, self.tail_lines, keep)
+        stderr = Capture(self.head_lines, self.tail_lines)
+        section = getattr(self._local, 'section', None)
+        readers = [
+            threading.Thread(target=self._read_stream, args=(process.stdout, 'stdout', stdout, on_line, section), daemon=True),
+            threading.Thread(target=self._read_stream, args=(process.stderr, 'stderr', stderr, on_line, section), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        if input:
+            self._write_input(process, input)
+
+        cpu = self._wait(process)
+        for reader in readers:
+            reader.join()
+
+        stdout_str, stderr_str = stdout.text(), stderr.text()
+        if not on_line:
+            self._log_output(stdout_str, stderr_str)
+
+        return process.returncode, stdout_str, stderr_str, cpu, stdout.value()
+
+    def _run_session(self, shell_command, input=None, on_line=None, session=None, keep=False):
+        """
+        Runs a shell command in a long-lived bash session.
+
+        Args:
+            shell_command (str): The (substituted) shell command to execute.
+            input (str, optional): Input for the command. Defaults to None.
+            on_line (callable, optional): Called with (name, text) for every output line while the command runs
+                                          (streaming). Defaults to None (the output is logged when the command ends).
+            session (BashSession, optional): The session to use. Defaults to None (an idle session of this Shell).
+            keep (bool, optional): Also return the whole stdout (see Capture.value). Defaults to False.
+
+        Returns:
+            tuple: (returncode, stdout, stderr, cpu, value) with stdout and stderr as stripped (bounded) strings, cpu the
+                   (user, system) CPU time of the command (None if unknown), and value the whole stdout (None without 'keep').
+        """
+        pooled = session is None
+        if pooled:
+            with self._sessions_lock:
+                session = self._sessions.pop() if self._sessions else BashSession()
+
+        try:
+            returncode, stdout_str, stderr_str, cpu, value = session.run(shell_command, input, on_line=on_line, head=self.head_lines, tail=self.tail_lines, keep=keep)
+            if not on_line:
+                self._log_output(stdout_str, stderr_str)
+        finally:
+            if pooled:
+                with self._sessions_lock:
+                    self._sessions.append(session)
+
+        return returncode, stdout_str, stderr_str, cpu, value
+
+    def _run_function(self, function, task=None):
+        """
+        Runs a Python callable as a step (see 'execute').
+
+        Args:
+            function (callable): Called with a progress callback (done, total), returns True on success, or a string:
+                                 the output of the step (see 'output_var').
+            task (Dashboard.Task, optional): The task of the step on the dashboard. Defaults to None.
+
+        Returns:
+            tuple: (returncode, stdout, stderr, cpu, value) with returncode 0 on success, cpu the (user, system)
+                   CPU time of the process during the step, and value the output of the step.
+        """
+        def progress(done, total):
+            if task is not None:
+                task.advance(done, total)
+            self.log.debug(f"Progress: {done}/{total}")
+
+        before = os.times()
+        result = function(progress)
+        after = os.times()
+        cpu = (after.user - before.user, after.system - before.system)
+        if isinstance(result, str):
+            return 0, result, '', cpu, result
+        return 0 if result else 1, '', '', cpu, ''
+
+    def close(self):
+        """
+        Closes the bash sessions of the 'session' backend.
+        """
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+
+    def execute(self, description, command, input=None, output_var=None, check_returncode=True, strict=False, stream=None, session=None,
+                replay=False, verify=None, progress=None, function=None):
         """
         Executes a shell command.
 
@@ -177,52 +462,105 @@ class Shell:
             output_var (str, optional): Global variable to store the output. Defaults to None.
             check_returncode (bool, optional): If True, raises an exception on non-zero return code. Defaults to True.
             strict (bool, optional): when strict is True the shell command is strict with "set -euo pipefail' (bool - optional - default False)
+            stream (bool, optional): Log the output line by line while the command runs. Defaults to None (use the Shell setting).
+                                     Either way only the first 'head_lines' and last 'tail_lines' lines of output are
+                                     logged and shown ('output_var' gets the whole output).
+            session (BashSession, optional): Run the command in this bash session (e.g. a Chroot). Defaults to None.
+            replay (bool, optional): When resuming, execute the step again even if it was completed before, because it
+                                     re-establishes state that does not survive a restart (mounts, opened LUKS devices).
+                                     Defaults to False.
+            verify (str, optional): When resuming, a command verifying that the result of a completed step is still
+                                    present. If it fails, the step and everything after it is executed again. Defaults to None.
+            progress (str, optional): Progress shown on the dashboard while the step runs: 'bytes' (written to {DEVICE})
+                                      or 'packages' (apt-get / debootstrap). Implies streaming. Defaults to None.
+            function (callable, optional): Run this Python callable as the step instead of a shell command; 'command' then
+                                           only names the step (log, journal, plan). The callable receives a progress callback
+                                           (done, total) and returns True on success, or the output as a string. Defaults to None.
+
+        When resuming (see Journal), completed steps are skipped up to the first incomplete step; from there on every step is executed.
 
         Returns:
             bool: True if the command was successful, False otherwise.
         """
+        description_template, command_template = description, command
         description = self._substitute_globals(description)
         command = self._substitute_globals(command)
+
+        # Dry-run: only record the resolved step
+        if self.plan is not None:
+            self.plan.add(description_template, command_template, description, command, input, output_var)
+            if output_var:
+                os.environ[output_var] = f'<{output_var}>'
+            return True
+
+        # Resume: skip steps completed in an earlier run, restoring their output variables
+        journal_key = self.journal.key(description_template, command_template) if self.journal is not None else None
+        if journal_key is not None and not replay:
+            outputs = self.journal.completed(journal_key)
+            if outputs is not None and verify and not self._verify(verify):
+                self.log.warning(f"Verification failed, resuming from: {description}")
+                self.journal.invalidate()
+                outputs = None
+            if outputs is None:
+                self.journal.invalidate()   # First incomplete step: continue from here
+            else:
+                os.environ.update(outputs)
+                self._print(f"[{self.theme['success']}][✓] {description} (completed earlier)[/{self.theme['success']}]")
+                self.log.info(f"Command skipped, completed earlier: {command}")
+                return True
+
         if input: input = self._substitute_globals(input)
 
+        started = time.monotonic()
+        returncode = None
+        task = None
         try:
-            # Print description to console using rich directly
-            self.console.print(f"[{self.theme['warning']}][ ] {description}[/{self.theme['warning']}]", end='\r')
+            # Print description to console using rich directly (the dashboard shows running steps itself)
+            if self.dashboard is not None:
+                task = self.dashboard.begin(description, progress, os.environ.get('DEVICE'))
+            else:
+                self._print(f"[{self.theme['warning']}][ ] {description}[/{self.theme['warning']}]", end='\r')
 
             if self.debug:
-                self.console.print(Panel(f"[{self.theme['command']}]{command}[/{self.theme['command']}]", title="Command"))
+                self._print(Panel(f"[{self.theme['command']}]{command}[/{self.theme['command']}]", title="Command"))
 
             shell_command = command
             if strict:
                 shell_command = 'set -euo pipefail;' + command
 
-            process = subprocess.Popen(
-                shell_command,
-                shell=True,
-                stdin=subprocess.PIPE if input else None,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                executable='/bin/bash'
-            )
-
-            stdout, stderr = process.communicate(input=input.encode() if input else None)
-            stdout_str = stdout.decode().strip()
-            stderr_str = stderr.decode().strip()
-
-            returncode = process.returncode
-
             # Log the command itself
             self.log.info(f"Command: {command}")
 
-            # Log stdout
-            if stdout_str:
-                self.log.info(f"Command - stdout: {stdout_str}")
+            written = TimingHistory.bytes_written(os.environ.get('DEVICE', ''))
+
+            streaming = self.stream if stream is None else stream
+            on_line = None
+            if task is not None and progress:
+                on_line = self._progress_line(task)
+            elif streaming or progress:
+                on_line = self._stream_line
+
+            keep = output_var is not None
+            if function is not None:
+                returncode, stdout_str, stderr_str, cpu, value = self._run_function(function, task)
+            elif session is not None:
+                returncode, stdout_str, stderr_str, cpu, value = self._run_session(shell_command, input, on_line, session, keep)
+            elif self.backend == 'session':
+                returncode, stdout_str, stderr_str, cpu, value = self._run_session(shell_command, input, on_line, keep=keep)
+            else:
+                returncode, stdout_str, stderr_str, cpu, value = self._run_process(shell_command, input, on_line, keep)
 
-            # Log stderr
-            if stderr_str:
-                self.log.info(f"Command - stderr: {stderr_str}")
+            if self.profiler is not None:
+                self.profiler.record(description, command, returncode, started, time.monotonic(), cpu)
 
-            if self.debug:
+            # Record the cost of the step for future estimates (see Plan)
+            if self.history is not None and returncode == 0:
+                after = TimingHistory.bytes_written(os.environ.get('DEVICE', ''))
+                self.history.record(description_template, command_template, time.monotonic() - started,
+                                    after - written if None not in (written, after) else None)
+
+            # Streamed output was already shown line by line
+            if self.debug and not on_line:
                 output_panel = Panel(
                     Text.assemble(
                         ("STDOUT:\n", "bold"),
@@ -235,48 +573,107 @@ class Shell:
                 )
                 # Only print output when present
                 if stdout_str != "" or stderr_str != "":
-                    self.console.print(output_panel)
+                    self._print(output_panel)
 
             if check_returncode and returncode != 0:
-                self.console.print(f"[{self.theme['error']}][✗] {description}[/{self.theme['error']}]")
+                self._print(f"[{self.theme['error']}][✗] {description}[/{self.theme['error']}]")
                 self.log.error(f"Command failed: {command}")
                 self.log.error(f"Return code: {returncode}")
                 self.log.error(f"Stdout: {stdout_str}")
                 self.log.error(f"Stderr: {stderr_str}")
+                self.failed.append(description)
                 return False # Indicate failure
             else:
                 if check_returncode:
-                    self.console.print(f"[{self.theme['success']}][✓] {description}[/{self.theme['success']}]")
+                    self._print(f"[{self.theme['success']}][✓] {description}[/{self.theme['success']}]")
                 else:
-                    self.console.print(f"[{self.theme['success']}][✓] {description} (return code ignored)[/{self.theme['success']}]")
+                    self._print(f"[{self.theme['success']}][✓] {description} (return code ignored)[/{self.theme['success']}]")
 
             # Store output in global variable if specified
             if output_var:
-                os.environ[output_var] = stdout_str
+                os.environ[output_var] = value
                 self.log.debug(f"Stored output in global variable '{output_var}'")
 
+            if journal_key is not None:
+                self.journal.complete(journal_key, {output_var: value} if output_var else None)
+
             self.log.info(f"Command executed successfully: {command}")
             return True  # Indicate success
 
         except Exception:
-            self.console.print(f"[{self.theme['error']}][✗] {description}[/{self.theme['error']}]")
+            if self.profiler is not None and returncode is None:
+                self.profiler.record(description, command, None, started, time.monotonic())
+            self._print(f"[{self.theme['error']}][✗] {description}[/{self.theme['error']}]")
             self.log.exception(f"Exception while executing command: {command}")
             if self.debug:
                 self.console.print_exception(show_locals=True)
+            self.failed.append(description)
             return False  # Indicate failure
 
-    def execute_all(self, commands):
+        finally:
+            if task is not None:
+                self.dashboard.end(task)
+
+    def _progress_line(self, task):
+        """
+        Returns the line callback of a step shown on the dashboard: every line is logged and updates the progress.
+
+        Args:
+            task (Dashboard.Task): The task of the step on the dashboard.
+        """
+        def on_line(name, text):
+            self._stream_line(name, text)
+            task.line(text)
+        return on_line
+
+    def _verify(self, verify):
+        """
+        Runs a verification command (see 'execute').
+
+        Args:
+            verify (str): The verification command, may contain {VARIABLES}.
+
+        Returns:
+            bool: True if the verification command succeeded.
+        """
+        command = self._substitute_globals(verify)
+        result = subprocess.run(command, shell=True, executable='/bin/bash', capture_output=True)
+        self.log.info(f"Verify: {command} (return code {result.returncode})")
+        return result.returncode == 0
+
+    def phase(self, title):
+        """
+        Starts a new phase of the installation: prints a rule with the title and marks the phase in the profiler.
+
+        Args:
+            title (str): Title of the phase (e.g. 'Partitioning USB Device').
+        """
+        self.console.print(Rule(title), style='success')
+        self.log.info(f"Phase: {title}")
+        if self.dashboard is not None:
+            self.dashboard.phase(title)
+        if self.profiler is not None:
+            self.profiler.phase(title)
+
+    def execute_all(self, commands, workers=1):
         """
         Executes a list of shell commands.
 
         Args:
             commands (list): A list of dictionaries, where each dictionary contains the arguments for the 'execute' method.
+            workers (int, optional): Number of commands to run concurrently. With more than one worker the commands
+                                     are run as a dependency graph by the Scheduler (see lib/scheduler.py), where
+                                     each dictionary may declare 'requires' and 'provides'. Defaults to 1.
 
         Returns:
             bool: True if all commands were successful, False otherwise.
         """
+        if workers > 1 and self.plan is None:
+            return Scheduler(self, workers=workers).run(commands)
+
         all_successful = True
         for command_data in commands:
+            command_data = {key: value for key, value in command_data.items() if key not in Scheduler.STEP_KEYS}
             if not self.execute(**command_data):
                 all_successful = False
         return all_successful
@@ -0,0 +1,493 @@
+import os
+import mmap
+import json
+import time
+import zlib
+import random
+import struct
+import hashlib
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from rich.table import Table
+from rich.text import Text
+
+# numpy is optional: it finds the chunk boundaries of a whole block at once, without it they are found byte by byte
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KiB = 1024
+MiB = 1024 * KiB
+
+# Index of the store, opened once in every worker process (see Store._init_worker)
+_worker_index = None
+
+class Store:
+    """
+    A class to keep deduplicated backups of a directory tree on the storage partition, for hosts without btrfs.
+
+    Files are split into chunks at content defined boundaries (FastCDC: a gear hash over the last 32 bytes,
+    tested on its high bits, with normalized chunking), so an insertion in a file only changes the chunks
+    around it. Files are chunked as one stream, read in blocks, so a boundary never depends on where a
+    block ends. With numpy the hash of a whole block is computed at once (hundreds of MB/s), without it
+    byte by byte (a few MB/s). Chunks are identified by their BLAKE2b hash, and only chunks not yet in the
+    store are compressed and written. Hashing and compressing runs in a pool of processes; the workers
+    look up the hashes themselves, and only send back the chunks the store does not have.
+
+    On disk (in the 'store' directory of the storage partition):
+
+        packs/000001.pack    the compressed chunks, appended; a new pack is started at 'pack_size'
+        index                fixed size records sorted by hash: (hash, pack, offset, length, size, codec),
+                             memory-mapped and binary searched, so lookups do not load the index
+        snapshots/*.json     one manifest per backup: per file its metadata and chunk hashes
+
+    A file whose size and modification time match the previous backup of the same source reuses the
+    chunks of that backup without being read, so a repeated backup of mostly unchanged data only reads
+    and writes what changed.
+
+    Usage:
+        store = Store('/storage/store')
+        if store.backup('/home/user'): print(store.result['new_chunks'], store.result['written'])
+        store.restore(store.snapshots()[-1], '/tmp/restore')
+    """
+
+    # Index record: BLAKE2b-256 hash, pack number, offset, stored length, original size, codec (0 raw, 1 zlib)
+    RECORD = struct.Struct('>32sIQIIB')
+
+    # Chunk sizes: boundaries are searched between MIN and MAX, aiming at AVERAGE
+    MIN_CHUNK = 256 * KiB
+    AVERAGE_CHUNK = 1 * MiB
+    MAX_CHUNK = 4 * MiB
+
+    # Files are read in blocks of SEGMENT bytes; the bytes after the last boundary of a block are chunked with the next
+    SEGMENT = 16 * MiB
+
+    # Gear table of the rolling hash: one random 32 bit value per byte value (fixed, boundaries must not change)
+    GEAR = struct.unpack('>256I', random.Random(0x5EC0BE).randbytes(1024))
+
+    # Boundary masks on the high bits of the hash (bit k depends on the last k + 1 bytes): before the average chunk
+    # size a boundary needs two bits more than average, after it two bits less (FastCDC normalized chunking)
+    BITS = AVERAGE_CHUNK.bit_length() - 1
+    STRICT = ((1 << (BITS + 2)) - 1) << (32 - (BITS + 2))
+    LOOSE = ((1 << (BITS - 2)) - 1) << (32 - (BITS - 2))
+
+    class Index:
+        """The sorted chunk index of a store, memory-mapped read-only."""
+
+        def __init__(self, path):
+            """
+            Opens the index.
+
+            Args:
+                path (str): Path of the index file (it may not exist yet).
+            """
+            self.map = None
+            self.count = 0
+            try:
+                with open(path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size >= Store.RECORD.size:
+                        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        self.count = len(self.map) // Store.RECORD.size
+            except FileNotFoundError:
+                pass
+
+        def record(self, number):
+            """Returns record 'number' as a tuple (hash, pack, offset, length, size, codec)."""
+            return Store.RECORD.unpack_from(self.map, number * Store.RECORD.size)
+
+        def lookup(self, digest):
+            """
+            Returns:
+                tuple: The record of a chunk hash (see RECORD), or None if the chunk is not in the index.
+            """
+            low, high = 0, self.count
+            size = Store.RECORD.size
+            while low < high:
+                middle = (low + high) // 2
+                key = self.map[middle * size:middle * size + 32]
+                if key < digest:
+                    low = middle + 1
+                elif key > digest:
+                    high = middle
+                else:
+                    return self.record(middle)
+            return None
+
+        def __iter__(self):
+            for number in range(self.count):
+                yield self.record(number)
+
+        def close(self):
+            """Unmaps the index."""
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+
+    def __init__(self, path, workers=None, level=3, pack_size=512 * MiB):
+        """
+        Initializes the Store, creating its directories.
+
+        Args:
+            path (str): Directory of the store (e.g. '/storage/store').
+            workers (int, optional): Number of processes chunking and compressing. Defaults to None (one per CPU).
+            level (int, optional): zlib compression level. Defaults to 3.
+            pack_size (int, optional): Size at which a new pack file is started. Defaults to 512 MiB.
+        """
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.level = level
+        self.pack_size = pack_size
+        self.result = None
+        for directory in ('packs', 'snapshots'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    @staticmethod
+    def _candidates(data):
+        """
+        Computes the gear hash of every position of data at once (numpy), as the sum of the gear values of the
+        last 32 bytes shifted by their distance, built by doubling the window five times.
+
+        Returns:
+            tuple: (strict, loose): sorted arrays of the offsets after the bytes where the hash passes each mask.
+        """
+        h = numpy.array(Store.GEAR, dtype=numpy.uint32)[numpy.frombuffer(data, dtype=numpy.uint8)]
+        shifted = numpy.empty_like(h)
+        shift = 1
+        while shift < 32:
+            count = len(h) - shift
+            numpy.left_shift(h[:count], shift, out=shifted[:count])
+            numpy.add(h[shift:], shifted[:count], out=h[shift:])
+            shift *= 2
+        # The STRICT mask contains the LOOSE mask: strict boundaries are among the loose ones
+        loose = numpy.flatnonzero((h & numpy.uint32(Store.LOOSE)) == 0)
+        strict = loose[(h[loose] & numpy.uint32(Store.STRICT)) == 0]
+        return strict + 1, loose + 1
+
+    @staticmethod
+    def _search(data, mask, low, high, candidates=None):
+        """Returns the first boundary in (low, high] passing a mask, or None."""
+        if low >= high:
+            return None
+        if candidates is not None:
+            index = int(numpy.searchsorted(candidates, low + 1))
+            return int(candidates[index]) if index < len(candidates) and candidates[index] <= high else None
+        gear = Store.GEAR
+        h = 0
+        for position in range(max(0, low - 31), high):
+            h = ((h << 1) + gear[data[position]]) & 0xFFFFFFFF
+            if position >= low and not h & mask:
+                return position + 1
+        return None
+
+    @staticmethod
+    def boundaries(data, final=True):
+        """
+        Finds the chunk boundaries of data (FastCDC). A boundary is searched between MIN_CHUNK and MAX_CHUNK after
+        the previous one: up to AVERAGE_CHUNK with the STRICT mask, then with the LOOSE mask, else at MAX_CHUNK.
+
+        Args:
+            data (bytes): The data, starting at a boundary.
+            final (bool, optional): The data is the end of the file (the end is a boundary). Defaults to True;
+                                    otherwise the bytes after the last certain boundary are left out.
+
+        Returns:
+            list: The end offsets of the chunks.
+        """
+        end = len(data)
+        candidates = Store._candidates(data) if numpy is not None and end > Store.MIN_CHUNK else (None, None)
+        cuts = []
+        start = 0
+        while start < end:
+            if end - start <= Store.MIN_CHUNK:
+                if final:
+                    cuts.append(end)
+                break
+            normal, limit = start + Store.AVERAGE_CHUNK, start + Store.MAX_CHUNK
+            cut = Store._search(data, Store.STRICT, start + Store.MIN_CHUNK, min(normal, end), candidates[0])
+            if cut is None:
+                cut = Store._search(data, Store.LOOSE, normal, min(limit, end), candidates[1])
+            if cut is None:
+                if limit > end and not final:
+                    break       # A boundary may follow in the next block
+                cut = min(limit, end)
+            cuts.append(cut)
+            start = cut
+        return cuts
+
+    @staticmethod
+    def chunks(path):
+        """
+        Reads a file in blocks of SEGMENT bytes and yields its chunks (see 'boundaries').
+
+        Raises:
+            OSError: When the file can not be read.
+        """
+        with open(path, 'rb') as f:
+            buffer = b''
+            while True:
+                block = f.read(Store.SEGMENT)
+                final = not block
+                buffer = buffer + block if buffer else block
+                start = 0
+                for cut in Store.boundaries(buffer, final):
+                    yield buffer[start:cut]
+                    start = cut
+                buffer = buffer[start:]
+                if final:
+                    return
+
+    @staticmethod
+    def _init_worker(index_path):
+        """Opens the index in a worker process."""
+        global _worker_index
+        _worker_index = Store.Index(index_path)
+
+    @staticmethod
+    def _process(chunk, level):
+        """
+        Hashes and compresses a chunk (runs in a worker process).
+
+        Args:
+            chunk (bytes): The chunk.
+            level (int): zlib compression level.
+
+        Returns:
+            tuple: (hash, size, codec, payload), with payload None when the index has the chunk.
+        """
+        digest = hashlib.blake2b(chunk, digest_size=32).digest()
+        if _worker_index is not None and _worker_index.lookup(digest) is not None:
+            return digest, len(chunk), None, None
+        compressed = zlib.compress(chunk, level)
+        if len(compressed) < len(chunk):
+            return digest, len(chunk), 1, compressed
+        return digest, len(chunk), 0, chunk
+
+    def snapshots(self, source=None):
+        """
+        Args:
+            source (str, optional): Only the backups of this source directory. Defaults to None (all).
+
+        Returns:
+            list: The names of the backups, oldest first.
+        """
+        names = sorted(name[:-5] for name in os.listdir(os.path.join(self.path, 'snapshots')) if name.endswith('.json'))
+        if source is not None:
+            prefix = Store.prefix(source) + '.'
+            names = [name for name in names if name.startswith(prefix)]
+        return names
+
+    @staticmethod
+    def prefix(source):
+        """
+        Returns the name prefix of the backups of a source directory, e.g. 'home-user-b98d692c' for '/home/user':
+        readable, and unique by a hash of the path ('/home/user-a' and '/home/user/a' read alike).
+        """
+        source = os.path.abspath(source)
+        return f"{source.strip('/').replace('/', '-') or 'root'}-{hashlib.sha256(os.fsencode(source)).hexdigest()[:8]}"
+
+    def manifest(self, name):
+        """
+        Returns:
+            dict: The manifest of a backup: 'source', 'created' and 'files' (per file 'path', 'mode', 'mtime_ns',
+                  'size' and 'chunks', the hashes in hex).
+        """
+        with open(os.path.join(self.path, 'snapshots', name + '.json'), 'r') as f:
+            return json.load(f)
+
+    def _changed(self, source, previous, files, result):
+        """Walks the source, yields (entry, path) of new and changed files, and fills 'files' (the manifest entries)."""
+        for root, directories, names in os.walk(source):
+            directories.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.lstat(path)
+                except OSError as e:
+                    result['errors'].append((path, str(e)))
+                    continue
+                if not os.path.isfile(path) or os.path.islink(path):
+                    continue
+                relative = os.path.relpath(path, source)
+                entry = {'path': relative, 'mode': stat.st_mode & 0o7777, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'chunks': []}
+                files.append(entry)
+                result['files'] += 1
+
+                known = previous.get(relative)
+                if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                    entry['chunks'] = known['chunks']
+                    result['unchanged'] += 1
+                    continue
+                yield entry, path
+
+    def _open_pack(self):
+        """Returns (number, file) of the pack to append to."""
+        packs = sorted(name for name in os.listdir(os.path.join(self.path, 'packs')) if name.endswith('.pack'))
+        number = int(packs[-1][:-5]) if packs else 1
+        path = os.path.join(self.path, 'packs', f'{number:06d}.pack')
+        if os.path.exists(path) and os.path.getsize(path) >= self.pack_size:
+            number += 1
+            path = os.path.join(self.path, 'packs', f'{number:06d}.pack')
+        return number, open(path, 'ab')
+
+    def _write_index(self, index, added):
+        """Merges the records added by a backup into the sorted index, replacing it atomically."""
+        records = sorted(list(index) + list(added.values()))
+        path = os.path.join(self.path, 'index')
+        with open(path + '.tmp', 'wb') as f:
+            for record in records:
+                f.write(Store.RECORD.pack(*record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def backup(self, source, progress=None):
+        """
+        Backs up a directory tree into the store. The result is stored in 'result': 'snapshot', 'files', 'unchanged'
+        (not read), 'chunks', 'new_chunks', 'read' and 'written' (bytes), 'seconds' and 'errors'.
+
+        Args:
+            source (str): The directory to back up.
+            progress (callable, optional): Called with (bytes read, None). Defaults to None.
+
+        Returns:
+            bool: True if the backup was stored (files that could not be read are listed in 'errors').
+        """
+        started = time.monotonic()
+        source = os.path.abspath(source)
+        name = f"{Store.prefix(source)}.{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}"
+        result = {'snapshot': name, 'source': source, 'files': 0, 'unchanged': 0, 'chunks': 0, 'new_chunks': 0,
+                  'read': 0, 'written': 0, 'seconds': 0.0, 'errors': []}
+        self.result = result
+        if not os.path.isdir(source):
+            result['errors'].append((source, 'not a directory'))
+            return False
+
+        earlier = self.snapshots(source)
+        previous = {entry['path']: entry for entry in self.manifest(earlier[-1])['files']} if earlier else {}
+
+        index_path = os.path.join(self.path, 'index')
+        index = Store.Index(index_path)
+        added = {}
+        files = []
+        number, pack = self._open_pack()
+        try:
+            def store(entry, digest, size, codec, payload):
+                nonlocal number, pack
+                result['chunks'] += 1
+                result['read'] += size
+                if payload is not None and digest not in added and index.lookup(digest) is None:
+                    if pack.tell() >= self.pack_size:
+                        pack.close()
+                        number, pack = self._open_pack()
+                    added[digest] = (digest, number, pack.tell(), len(payload), size, codec)
+                    pack.write(payload)
+                    result['new_chunks'] += 1
+                    result['written'] += len(payload)
+                if entry['chunks'] is not None:
+                    entry['chunks'].append(digest.hex())
+                if progress is not None:
+                    progress(result['read'], None)
+
+            # Results are stored in submission order; the number of chunks in flight is bounded, so the
+            # workers can not run ahead of the (slower) writes to the USB device. The workers are started by a
+            # fork server: forking this process would copy the threads of the log listener and the dashboard.
+            pending = collections.deque()
+            context = multiprocessing.get_context('forkserver')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=Store._init_worker, initargs=(index_path,)) as pool:
+                for entry, path in self._changed(source, previous, files, result):
+                    try:
+                        for chunk in Store.chunks(path):
+                            pending.append((entry, pool.submit(Store._process, chunk, self.level)))
+                            if len(pending) >= 2 * self.workers:
+                                entry_done, future = pending.popleft()
+                                store(entry_done, *future.result())
+                    except OSError as e:
+                        result['errors'].append((entry['path'], str(e)))
+                        entry['chunks'] = None
+                while pending:
+                    entry_done, future = pending.popleft()
+                    store(entry_done, *future.result())
+            pack.flush()
+            os.fsync(pack.fileno())
+        finally:
+            pack.close()
+
+        # The packs are on disk before the index refers to them, and the index before the manifest
+        if added:
+            self._write_index(index, added)
+        index.close()
+        manifest = {'source': source, 'created': time.time(), 'files': [entry for entry in files if entry['chunks'] is not None]}
+        path = os.path.join(self.path, 'snapshots', name + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        result['seconds'] = time.monotonic() - started
+        return True
+
+    def restore(self, name, destination):
+        """
+        Restores a backup into a directory.
+
+        Args:
+            name (str): The backup (see 'snapshots').
+            destination (str): The directory to restore into.
+
+        Returns:
+            list: The errors as (path, message), empty if all files were restored.
+        """
+        errors = []
+        index = Store.Index(os.path.join(self.path, 'index'))
+        packs = {}
+        try:
+            for entry in self.manifest(name)['files']:
+                path = os.path.join(destination, entry['path'])
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        for digest in entry['chunks']:
+                            record = index.lookup(bytes.fromhex(digest))
+                            if record is None:
+                                raise OSError(f'chunk {digest} missing from the store')
+                            _, number, offset, length, size, codec = record
+                            if number not in packs:
+                                packs[number] = open(os.path.join(self.path, 'packs', f'{number:06d}.pack'), 'rb')
+                            payload = os.pread(packs[number].fileno(), length, offset)
+                            f.write(zlib.decompress(payload) if codec == 1 else payload)
+                    os.chmod(path, entry['mode'])
+                    os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+                except OSError as e:
+                    errors.append((entry['path'], str(e)))
+        finally:
+            for pack in packs.values():
+                pack.close()
+            index.close()
+        return errors
+
+    @staticmethod
+    def report(console, results):
+        """
+        Prints the results of backups (see 'backup') on the rich console.
+
+        Args:
+            console (Console): The rich console object.
+            results (list): The 'result' of every backup.
+        """
+        table = Table(title='Deduplicated backups')
+        table.add_column('Source')
+        table.add_column('Files', justify='right')
+        table.add_column('Unchanged', justify='right')
+        table.add_column('New chunks', justify='right')
+        table.add_column('Read', justify='right')
+        table.add_column('Written', justify='right')
+        table.add_column('Time', justify='right')
+        table.add_column('Errors', justify='right')
+        for result in results:
+            table.add_row(Text(result['source']), str(result['files']), str(result['unchanged']),
+                          f"{result['new_chunks']}/{result['chunks']}", f"{result['read'] / 1e6:.1f} MB",
+                          f"{result['written'] / 1e6:.1f} MB", f"{result['seconds']:.1f}s", str(len(result['errors'])))
+        console.print(table)
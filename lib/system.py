@@ -1,8 +1,8 @@
 import os
-import re
-import shutil
 import subprocess
 from typing import List, Union
+from lib.blockdev import BlockDevices
+from lib.copier import Copier
 
 class System:
     """
@@ -10,14 +10,16 @@ class System:
     This class has no specific dependencies.
     """
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, block_devices=None):
         """
         Initializes the ArchInstallHelper class.
 
         Args:
             debug (bool, optional): Enables debug output to console (print). Defaults to False.
+            block_devices (BlockDevices, optional): Block device discovery to share. Defaults to None (a new one).
         """
         self.debug = debug
+        self.block_devices = block_devices if block_devices is not None else BlockDevices()
 
     def check_sudo(self):
         """
@@ -298,56 +300,37 @@ class System:
 
         return packages
 
-    def get_partition(self, device: str, partition_no: int):
+    def get_partition(self, device: str, partition_no: int, timeout: float = 10):
         """
-        Determines the first partition of a given device using the 'ls' command.
+        Determines a partition of a given device by number from sysfs (see lib/blockdev.py),
+        waiting for udev to create the partition node after the partition table was written.
 
         Args:
             device (str): The device name (e.g., '/dev/sda' or '/dev/nvme0n1').
             partition_no (int): The partiton number (e.g., '1' format '/dev/nvme0n1p1').
+            timeout (float, optional): Seconds to wait for the partition to appear. Defaults to 10.
 
         Returns:
             str: The name of the partition (e.g., '/dev/sda1' or '/dev/nvme0n1p1'),
                  or None if no partition is found.
-            None: If the device doesn't exist or if an error occurs while listing partitions.
+            None: If the device doesn't exist or the partition did not appear in time.
         """
+        partition = self.block_devices.wait_partition(device, partition_no, timeout)
+        if partition is None and self.debug: print(f"Partition {partition_no} of {device} not found.")
+        return partition
 
-        def _get_partitions(device, pattern):
-            """Helper function to run ls with a specific pattern."""
-            command = f"ls {device}{pattern} 2>/dev/null"
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            stdout, stderr = process.communicate()
-            if process.returncode == 0:
-                return stdout.strip().split('\n')
-            else:
-                return []
-
-        try:
-            # Try the NVMe-style pattern first
-            partitions = _get_partitions(device, "p*[0-9]")  # Matches nvme0n1p1, nvme0n1p2, etc.
-
-            # If NVMe-style partitions weren't found, try the sdX-style pattern
-            if not partitions:
-                partitions = _get_partitions(device, "[0-9]")  # Matches sda1, sda2, etc.
-
-            if partitions:
-                partitions.sort()
-                first_partition = partitions[partition_no -1]
+    def get_partition_name(self, device: str, partition_no: int) -> str:
+        """
+        Determines the name a partition of a device will get, without accessing the device.
 
-                # Updated regex to match both /dev/sda1 and /dev/nvme0n1p1 formats
-                if re.match(rf"^{device}(p?[0-9]+|[0-9]+)$", first_partition):
-                    return first_partition
-                else:
-                    return None
-            else:
-                return None
+        Args:
+            device (str): The device name (e.g. '/dev/sda' or '/dev/nvme0n1').
+            partition_no (int): The partition number.
 
-        except FileNotFoundError:
-            if self.debug: print("Error: 'ls' command not found.  Please ensure it is in your PATH.")
-            return None
-        except Exception as e:
-            if self.debug: print(f"An error occurred: {e}")
-            return None
+        Returns:
+            str: The partition name (e.g. '/dev/sda1', or '/dev/nvme0n1p1' for devices ending in a digit).
+        """
+        return f"{device}p{partition_no}" if device[-1:].isdigit() else f"{device}{partition_no}"
 
     def find_subdirectory(self, source_name: str) -> Union[str, None]:
         """
@@ -391,41 +374,38 @@ class System:
             if self.debug: print(f"An unexpected error occurred: {e}")
             return None
 
-    def copy_file_structure(self, source: str, destination: str) -> None:
+    def copy_file_structure(self, source: str, destination: str, workers: int = 8, changes: dict = None) -> dict:
         """
         Copies the file structure (folders and files) from a source directory to a
         destination directory, creating any missing folders in the destination.
+        Files are copied concurrently, and skipped when unchanged (see lib/copier.py).
 
         Args:
             source: The path to the source directory.
             destination: The path to the destination directory.
+            workers: Number of files copied concurrently. Defaults to 8.
+            changes: Only copy the changed paths recorded by a watcher (see Watch.take). Defaults to None (the whole tree).
+
+        Returns:
+            The result of the copy (see Copier.copy_tree): 'copied', 'skipped', 'files_per_second',
+            'mb_per_second' and 'errors' (a list of (path, message)), among others.
         """
         #log.info(f'Copying file from {source} to {destination}')
 
-        try:
-            # Check if the source directory exists
-            if not os.path.isdir(source):
-                source = self.find_subdirectory(source)
-                if not source:
-                    if self.debug: print(f"Error: Source directory '{source}' not found.")
-                    return
-
-            # Create the destination directory if it doesn't exist
-            os.makedirs(destination, exist_ok=True)  # exist_ok=True prevents an error if the directory already exists
-
-            for root, _, files in os.walk(source):
-                # Create the corresponding directory structure in the destination
-                dest_dir = os.path.join(destination, os.path.relpath(root, source))
-                os.makedirs(dest_dir, exist_ok=True)
-
-                for file in files:
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.join(dest_dir, file)
-                    try:
-                        shutil.copy2(source_file, dest_file)  # copy2 preserves metadata
-                    except Exception as e:
-                        if self.debug: print(f"Warning: Could not copy '{source_file}' to '{dest_file}': {e}")
+        # Check if the source directory exists
+        if not os.path.isdir(source):
+            found = self.find_subdirectory(source)
+            if not found:
+                if self.debug: print(f"Error: Source directory '{source}' not found.")
+                return Copier.failed(source, 'Source directory not found')
+            source = found
 
-        except Exception as e:
-            if self.debug: print(f"An unexpected error occurred: {e}")
-            return None
+        try:
+            result = Copier(workers=workers).copy_tree(source, destination, changes)
+        except OSError as e:
+            result = Copier.failed(destination, str(e))
+
+        if self.debug:
+            print(f"Copied {result['copied']} files ({result['skipped']} unchanged): {result['files_per_second']:.0f} files/s, "
+                  f"{result['mb_per_second']:.1f} MB/s, {len(result['errors'])} errors")
+        return result
@@ -1,13 +1,20 @@
 import os
 import sys
 import subprocess
+from lib.blockdev import BlockDevices
 
 class UserEntry:
     """A class for gathering user information via dialog prompts."""
 
-    def __init__(self):
-        """Initializes the UserEntry class."""
+    def __init__(self, block_devices=None):
+        """
+        Initializes the UserEntry class.
+
+        Args:
+            block_devices (BlockDevices, optional): Block device discovery to share. Defaults to None (a new one).
+        """
         self.user_data = {}  # To store user entries
+        self.block_devices = block_devices if block_devices is not None else BlockDevices()
 
     # --- Support Functions ---
 
@@ -71,7 +78,7 @@ class UserEntry:
             # Clear the screen using escape codes
             print("\033[2J\033[H", end="")  # Clear screen and move cursor to top-left
             result = subprocess.run(cmd, capture_output=False, text=True, check=False)
-            if result.check_returncode == 0:
+            if result.returncode == 0:
                 return 'yes'
             else:
 
@@ -92,56 +99,26 @@ class UserEntry:
     # --- System Functions ---
 
     def _get_drive_info(self, drive):
-        """Gets drive size and model information using `lsblk` and `hdparm`."""
+        """Gets drive size and model information from sysfs (see lib/blockdev.py)."""
         size = "Unknown"
         model = "Unknown"
 
-        try:
-            # Get size using lsblk
-            result = subprocess.run(['lsblk', '-dn', '-b', '-o', 'SIZE', f'/dev/{drive}'], capture_output=True, text=True, check=True)
-            size_bytes = int(result.stdout.strip())
-            size_gb = size_bytes / (1024 ** 3)  # Convert to GB
-            size = f"{size_gb:.2f} GB"
-        except subprocess.CalledProcessError as e:
-            print(f"Error getting size for {drive}: {e.stderr}")
-        except Exception as e:
-            print(f"Error getting size for {drive}: {e}")
-
-        try:
-            # Get model using hdparm
-            result = subprocess.run(['hdparm', '-I', f'/dev/{drive}'], capture_output=True, text=True, check=True)
-            for line in result.stdout.splitlines():
-                if "Model Number:" in line:
-                    model = line.split(":", 1)[1].strip()
-                    break
-        except subprocess.CalledProcessError as e:
-            print(f"Error getting model for {drive}: {e.stderr}")
-        except FileNotFoundError:
-            print("Error: hdparm not found. Please install it.")
-        except Exception as e:
-            print(f"Error getting model for {drive}: {e}")
+        info = self.block_devices.drive(drive)
+        if info:
+            size = f"{info['size'] / (1024 ** 3):.2f} GB"  # Convert to GB
+            model = ' '.join(part for part in (info['vendor'], info['model']) if part) or model
+            if info['transport'] != 'unknown':
+                model += f" [{info['transport']}{', removable' if info['removable'] else ''}]"
 
         return size, model
 
     def _get_drives(self):
         """Lists available drives and their info."""
-        try:
-            result = subprocess.run(['lsblk', '-dn', '-o', 'NAME'], capture_output=True, text=True, check=True)
-            drives = [line.strip() for line in result.stdout.splitlines() if "loop" not in line]
-            drive_info = []
-            for drive in drives:
-                size, model = self._get_drive_info(drive)
-                drive_info.append((drive, size, model))
-            return drive_info
-        except subprocess.CalledProcessError as e:
-            print(f"Error listing drives: {e.stderr}")
-            return []
-        except FileNotFoundError:
-            print("Error: 'lsblk' command not found.")
-            return []
-        except Exception as e:
-            print(f"An error occurred listing drives: {e}")
-            return []
+        drive_info = []
+        for drive in self.block_devices.drives():
+            size, model = self._get_drive_info(drive['name'])
+            drive_info.append((drive['name'], size, model))
+        return drive_info
 
     def _get_timezones(self):
         """Lists timezones from /usr/share/zoneinfo using glob."""
@@ -283,6 +260,19 @@ class UserEntry:
             self.user_data["drive"] = selected_drive
         return selected_drive
 
+    def configure_wipe(self):
+        """Presents a menu to select how the drive is wiped (see lib/wipe.py)."""
+        menu_items = [
+            "full", "Random data over the whole drive (slowest)",
+            "discard", "Discard all blocks (fast, if the drive supports it)",
+            "headers", "Random data over partition tables and headers only (fastest)",
+            "outside-luks", "Random data outside the encrypted partitions, discard the rest",
+        ]
+        strategy = self._run_dialog("--menu", "Select how to wipe the drive:", "15", "80", "4", *menu_items)
+        if strategy:
+            self.user_data["wipe"] = strategy
+        return strategy
+
     def configure_locale(self, default=""):
         """Prompts the user for a locale and filters the results."""
         locales = self._get_locales()
@@ -0,0 +1,346 @@
+import os
+import time
+import errno
+import fcntl
+import select
+import signal
+import struct
+import ctypes
+import contextlib
+
+class Watch:
+    """
+    A class to record the changed paths of a directory tree between backups, so a backup only visits
+    what changed instead of scanning the whole tree.
+
+    A watcher ('run', a long-running process on the host) watches every directory of the source with
+    inotify and appends the changed paths to a journal in 'directory':
+
+        F <path>    a file was written (also while it stays open), created, deleted, renamed or its attributes changed
+        T <path>    a directory appeared (created or moved in): its whole tree must be visited
+        A           changes may have been missed: the whole source must be visited
+
+    Records are NUL terminated (paths may contain any character) and relative to the source. Changes are
+    collected in memory and appended once per 'interval', and the journal is compacted (duplicates and
+    paths inside a recorded tree removed) when it grows, so a file written a thousand times is one record.
+
+    A file written in place and kept open (a log, a database, a mailbox) is recorded at every write, and
+    recorded again in every new journal until it is closed: a write through a shared memory map has no
+    event of its own, so the file is visited by every backup while it is open. A directory that can not
+    be watched (other than removed meanwhile) records 'A'.
+
+    A backup takes the journal ('take'), visits the recorded paths, and confirms with 'commit' when it
+    succeeded; a failed backup leaves the taken records in place for the next one. 'take' asks for a full
+    scan (returns None) when no watcher is running, when the watcher started after the previous backup
+    (it writes 'A' when it starts), when the kernel event queue overflowed, or when the inotify watch limit
+    (fs.inotify.max_user_watches) was reached.
+
+    fanotify is not used: its file system wide marks report file handles, which need CAP_SYS_ADMIN and a
+    handle to path lookup; inotify needs one watch per directory, but reports names directly.
+
+    Usage:
+        Watch('/home/user').run()                       # Watcher, e.g. in a systemd service
+        watch = Watch('/home/user')
+        changes = watch.take()                          # None: full scan
+        if copy(changes): watch.commit()
+    """
+
+    # inotify (linux/inotify.h)
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+            | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+    # An inotify event: watch descriptor, mask, cookie, length of the name
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, source, directory='/var/lib/secure-usb', interval=1.0, compact_size=1024 * 1024):
+        """
+        Initializes the Watch.
+
+        Args:
+            source (str): The directory tree to watch.
+            directory (str, optional): Directory of the journal. Defaults to '/var/lib/secure-usb'.
+            interval (float, optional): Seconds between appends to the journal. Defaults to 1.0.
+            compact_size (int, optional): The journal is compacted when it grows beyond this size in bytes. Defaults to 1 MiB.
+        """
+        self.source = os.path.abspath(source)
+        self.directory = directory
+        self.interval = interval
+        self.compact_size = compact_size
+        name = Watch.name(self.source)
+        self.journal = os.path.join(directory, f'{name}.journal')
+        self.taken = self.journal + '.taken'
+        self.pid_file = os.path.join(directory, f'{name}.pid')
+        self.watches = {}       # Watch descriptor: directory path
+        self.pending = set()    # Records not yet appended to the journal
+        self.writing = set()    # Files written and not closed yet (relative paths)
+        self.complete = True    # Every directory is watched (False once the watch limit is reached)
+        self.stopped = False
+
+    @staticmethod
+    def name(source):
+        """
+        Returns the name of the journal of a source: its path escaped as 'systemd-escape --path' does, so every source
+        has its own name ('/home/user-a': 'home-user\\x2da', '/home/user/a': 'home-user-a', '/': '-').
+        """
+        escaped = []
+        for index, character in enumerate(os.path.abspath(source).strip('/')):
+            if character == '/':
+                escaped.append('-')
+            elif character.isascii() and (character.isalnum() or character in ':_' or (character == '.' and index > 0)):
+                escaped.append(character)
+            else:
+                escaped.append(''.join(f'\\x{byte:02x}' for byte in character.encode()))
+        return ''.join(escaped) or '-'
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serializes journal updates between the watcher and a backup (an flock on a lock file)."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with open(self.journal + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path):
+        """Returns the records of a journal file as a set of (kind, path), empty if it does not exist."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return set()
+        records = set()
+        for record in data.split(b'\0'):
+            if record:
+                records.add((record[:1].decode(), os.fsdecode(record[2:])))
+        return records
+
+    @staticmethod
+    def compact(records):
+        """
+        Removes the records made redundant by others: everything when the whole source is to be visited,
+        and files and trees inside a recorded tree.
+
+        Args:
+            records (set): (kind, path) records.
+
+        Returns:
+            set: The compacted records.
+        """
+        if any(kind == 'A' for kind, _ in records):
+            return {('A', '')}
+        trees = sorted(path for kind, path in records if kind == 'T')
+        # A tree inside a shorter tree is covered by it (sorted order puts a parent before its children)
+        covering = []
+        for tree in trees:
+            if not covering or not (tree + '/').startswith(covering[-1] + '/'):
+                covering.append(tree)
+        compacted = {('T', tree) for tree in covering}
+        for kind, path in records:
+            if kind == 'F' and not any((path + '/').startswith(tree + '/') for tree in covering):
+                compacted.add(('F', path))
+        return compacted
+
+    @staticmethod
+    def _write(path, records, mode='wb'):
+        """Writes records to a journal file."""
+        with open(path, mode) as f:
+            f.write(b''.join(kind.encode() + b' ' + os.fsencode(name) + b'\0' for kind, name in sorted(records)))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _flush(self):
+        """Appends the pending records to the journal, compacting it when it grew too large."""
+        if not self.pending and not self.writing:
+            return
+        with self._locked():
+            # A backup took the journal: the files still open for writing are recorded again in the new one
+            if not os.path.exists(self.journal):
+                self.pending |= {('F', path) for path in self.writing}
+            if not self.pending:
+                return
+            Watch._write(self.journal, self.pending, 'ab')
+            if os.path.getsize(self.journal) > self.compact_size:
+                Watch._write(self.journal + '.tmp', Watch.compact(Watch._read(self.journal)))
+                os.replace(self.journal + '.tmp', self.journal)
+        self.pending.clear()
+
+    def _relative(self, path):
+        """Returns a path relative to the source ('' for the source itself)."""
+        relative = os.path.relpath(path, self.source)
+        return '' if relative == '.' else relative
+
+    def _add(self, inotify, libc, directory):
+        """
+        Watches a directory and every directory below it. A directory that can not be read or watched records 'A'
+        (its changes would be missed), unless it was removed meanwhile.
+
+        Returns:
+            bool: False if the watch limit was reached (some directories are not watched).
+        """
+        def failed(error):
+            if error.errno != errno.ENOENT:
+                self.pending.add(('A', ''))
+
+        for root, directories, _ in os.walk(directory, onerror=failed):
+            if os.path.abspath(root) == os.path.abspath(self.directory):
+                directories[:] = []
+                continue
+            descriptor = libc.inotify_add_watch(inotify, os.fsencode(root), Watch.MASK)
+            if descriptor < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    return False
+                failed(OSError(error, os.strerror(error)))
+                continue
+            self.watches[descriptor] = root
+        return True
+
+    def _event(self, inotify, libc, descriptor, mask, name):
+        """Records an inotify event."""
+        if mask & Watch.IN_Q_OVERFLOW:
+            self.pending.add(('A', ''))
+            return
+        if mask & Watch.IN_IGNORED:
+            self.watches.pop(descriptor, None)
+            return
+        directory = self.watches.get(descriptor)
+        if directory is None:
+            return
+        if mask & (Watch.IN_DELETE_SELF | Watch.IN_MOVE_SELF):
+            self.pending.add(('F', self._relative(directory)))
+            return
+        path = os.path.join(directory, os.fsdecode(name))
+        if mask & Watch.IN_ISDIR and mask & (Watch.IN_CREATE | Watch.IN_MOVED_TO):
+            self.pending.add(('T', self._relative(path)))
+            if not self._add(inotify, libc, path) and self.complete:
+                self.complete = False
+                self._announce()
+        else:
+            relative = self._relative(path)
+            self.pending.add(('F', relative))
+            if mask & Watch.IN_MODIFY:
+                self.writing.add(relative)
+            elif mask & (Watch.IN_CLOSE_WRITE | Watch.IN_DELETE | Watch.IN_MOVED_FROM):
+                self.writing.discard(relative)
+
+    def _announce(self):
+        """Writes the pid file: the pid of the watcher, and whether it watches every directory."""
+        with open(self.pid_file + '.tmp', 'w') as f:
+            f.write(f"{os.getpid()} {'complete' if self.complete else 'incomplete'}")
+        os.replace(self.pid_file + '.tmp', self.pid_file)
+
+    def run(self):
+        """
+        Watches the source and records the changes, until SIGTERM or SIGINT.
+
+        Returns:
+            bool: False if inotify is not available.
+        """
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify = libc.inotify_init1(Watch.IN_NONBLOCK | Watch.IN_CLOEXEC)
+        if inotify < 0:
+            return False
+
+        def stop(signum, frame):
+            self.stopped = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        try:
+            # Changes before the watches were in place are unknown. The watcher announces itself (pid file)
+            # only after that is recorded, so a backup never relies on a journal with a gap.
+            self.complete = self._add(inotify, libc, self.source)
+            self.pending.add(('A', ''))
+            self._flush()
+            self._announce()
+
+            flushed = time.monotonic()
+            while not self.stopped:
+                try:
+                    readable, _, _ = select.select([inotify], [], [], self.interval)
+                except InterruptedError:
+                    continue
+                if readable:
+                    try:
+                        data = os.read(inotify, 65536)
+                    except BlockingIOError:
+                        data = b''
+                    offset = 0
+                    while offset + Watch.EVENT.size <= len(data):
+                        descriptor, mask, _, length = Watch.EVENT.unpack_from(data, offset)
+                        offset += Watch.EVENT.size
+                        name = data[offset:offset + length].rstrip(b'\0')
+                        offset += length
+                        self._event(inotify, libc, descriptor, mask, name)
+                if time.monotonic() - flushed >= self.interval:
+                    self._flush()
+                    flushed = time.monotonic()
+            self._flush()
+        finally:
+            os.close(inotify)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.pid_file)
+        return True
+
+    def running(self):
+        """
+        Returns:
+            bool: True if a watcher of the source is running and watches every directory.
+        """
+        try:
+            with open(self.pid_file, 'r') as f:
+                pid, status = f.read().split()
+            os.kill(int(pid), 0)
+        except (OSError, ValueError):
+            return False
+        return status == 'complete'
+
+    def take(self):
+        """
+        Takes the changes recorded since the last committed backup. The watcher continues in a new journal.
+
+        Returns:
+            dict: 'files' and 'trees' (sets of paths relative to the source) to visit, or None when the whole
+                  source must be visited.
+        """
+        with self._locked():
+            records = Watch._read(self.taken)
+            if os.path.exists(self.journal):
+                records |= Watch._read(self.journal)
+                records = Watch.compact(records)
+                Watch._write(self.taken + '.tmp', records)
+                os.replace(self.taken + '.tmp', self.taken)
+                os.remove(self.journal)
+            else:
+                records = Watch.compact(records)
+        if not self.running() or ('A', '') in records:
+            return None
+        return {'files': {path for kind, path in records if kind == 'F'}, 'trees': {path for kind, path in records if kind == 'T'}}
+
+    def commit(self):
+        """
+        Confirms that the changes returned by 'take' are backed up.
+        """
+        with self._locked():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.taken)
@@ -0,0 +1,524 @@
+import os
+import stat
+import mmap
+import time
+import fcntl
+import queue
+import random
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# The 'cryptography' package is optional: without it the keystream is read from the kernel CSPRNG
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+class Wipe:
+    """
+    A class to overwrite a block device (or a plain file) with cryptographically strong random data.
+
+    The data is an AES-256-CTR keystream of a random key (with the optional 'cryptography' package),
+    otherwise it is read from /dev/urandom. Every chunk of the device has its own counter range, so
+    chunks are generated in parallel by worker threads, directly into page-aligned buffers, while
+    the previous chunks are written with O_DIRECT (bypassing the page cache). With more buffers
+    than workers, generating and writing always overlap.
+
+    The wipe can be cancelled (see 'cancel') and resumed from the offset reached (see 'offset').
+    Besides overwriting, the class can discard ranges of a device ('discard'), and verify a wipe
+    by reading random samples ('verify').
+
+    Strategies (see STRATEGIES and secure_usb.py):
+        full         - random data over the whole device
+        discard      - discard the whole device (BLKSECDISCARD, BLKDISCARD or BLKZEROOUT)
+        headers      - random data over the start and end of the device and of every partition
+                       (partition tables, LUKS headers, file system superblocks)
+        outside-luks - random data over every partition except the LUKS payloads, which are discarded
+                       (the payloads are covered by ciphertext from then on); runs after partitioning
+
+    Usage:
+        wipe = Wipe('/dev/sdb', progress=lambda written, total: print(written, total))
+        if not wipe.run():
+            wipe.run(offset=wipe.offset)
+        wipe.verify(samples=256)
+
+        Wipe('/dev/sdb').apply('headers') and Wipe('/dev/sdb').check('headers')
+    """
+
+    ALIGNMENT = 4096                    # O_DIRECT alignment of offsets, sizes and buffers
+    CHUNK_SIZE = 4 * 1024 * 1024        # Bytes generated and written at once
+    HEADER_SIZE = 16 * 1024 * 1024      # Bytes overwritten at the start and end by the 'headers' strategy (LUKS2 header size)
+    STRATEGIES = ('full', 'discard', 'headers', 'outside-luks')
+    PARTITIONS = (1, 2, 3, 4)           # Partitions the 'outside-luks' strategy expects (see secure_usb.py)
+
+    # Block device ioctls (linux/fs.h), with a (start, length) range in bytes
+    BLKDISCARD = 0x1277
+    BLKSECDISCARD = 0x127d
+    BLKZEROOUT = 0x127f
+
+    def __init__(self, path, size=None, ranges=None, workers=None, chunk_size=CHUNK_SIZE, direct=True, progress=None, cancel=None,
+                 block_devices=None):
+        """
+        Initializes the Wipe.
+
+        Args:
+            path (str): The block device or file to overwrite.
+            size (int, optional): Size of the device in bytes. Defaults to None (the size of the device or file).
+            ranges (list, optional): (start, length) ranges in bytes to overwrite. Defaults to None (the whole device).
+            workers (int, optional): Number of threads generating random data. Defaults to None (number of CPUs).
+            chunk_size (int, optional): Bytes per write, a multiple of ALIGNMENT. Defaults to CHUNK_SIZE (4 MiB).
+            direct (bool, optional): Write with O_DIRECT when supported. Defaults to True.
+            progress (callable, optional): Called with (written, total) bytes about twice per second. Defaults to None.
+            cancel (threading.Event, optional): Stops the wipe when set. Defaults to None (a new event).
+            block_devices (BlockDevices, optional): Waits for new partitions with it (see 'wait_partitions'). Defaults to None (polling).
+        """
+        self.path = path
+        self.size = size
+        self.ranges = ranges
+        self.workers = workers if workers else os.cpu_count() or 1
+        self.chunk_size = max(Wipe.ALIGNMENT, chunk_size - chunk_size % Wipe.ALIGNMENT)
+        self.direct = direct
+        self.progress = progress
+        self.cancel = cancel if cancel is not None else threading.Event()
+        self.block_devices = block_devices
+        self.offset = 0         # Position on the device up to which the ranges are overwritten (the offset to resume from)
+        self.rate = None        # Average throughput of the last run in bytes per second
+        self.failures = []      # Offsets of the samples that failed the last verification
+        self.key = os.urandom(32)
+        self.random = None
+
+    def total(self):
+        """
+        Returns:
+            int: Size of the device in bytes.
+        """
+        if self.size is not None:
+            return self.size
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return os.lseek(fd, 0, os.SEEK_END)     # Also the size of a block device
+        finally:
+            os.close(fd)
+
+    def _ranges(self):
+        """Returns the sorted (start, length) ranges to overwrite, clipped to the device."""
+        total = self.total()
+        ranges = self.ranges if self.ranges is not None else [(0, total)]
+        clipped = []
+        for start, length in sorted(ranges):
+            length = min(length, total - start)
+            if length > 0:
+                clipped.append((start, length))
+        return clipped
+
+    @staticmethod
+    def partitions(device):
+        """
+        Reads the partitions of a block device from sysfs.
+
+        Args:
+            device (str): The block device (e.g. '/dev/sdb').
+
+        Returns:
+            dict: Partition number -> (start, length) in bytes. Empty for a plain file or a device without partitions.
+        """
+        partitions = {}
+        name = os.path.basename(device)
+        try:
+            entries = os.listdir(f'/sys/class/block/{name}')
+        except OSError:
+            return partitions
+        for entry in entries:
+            try:
+                with open(f'/sys/class/block/{name}/{entry}/partition', 'r') as f:
+                    number = int(f.read())
+                with open(f'/sys/class/block/{name}/{entry}/start', 'r') as f:
+                    start = int(f.read()) * 512
+                with open(f'/sys/class/block/{name}/{entry}/size', 'r') as f:
+                    length = int(f.read()) * 512
+            except (OSError, ValueError):
+                continue
+            partitions[number] = (start, length)
+        return partitions
+
+    def wait_partitions(self, numbers, timeout=10):
+        """
+        Waits until the kernel knows the partitions of the device (after sgdisk wrote a new partition table).
+
+        Args:
+            numbers (tuple): The partition numbers expected.
+            timeout (float, optional): Seconds to wait. Defaults to 10.
+
+        Returns:
+            dict: The partitions (see 'partitions'), or None when one of them did not appear in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.block_devices is not None:
+                for number in numbers:
+                    self.block_devices.wait_partition(self.path, number, max(0, deadline - time.monotonic()))
+            partitions = Wipe.partitions(self.path)
+            if all(number in partitions for number in numbers):
+                return partitions
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    @staticmethod
+    def header_ranges(device, size, header_size=HEADER_SIZE):
+        """
+        Returns the ranges of the 'headers' strategy: the start and end of the device (partition tables)
+        and the start of every partition (LUKS headers, file system superblocks).
+
+        Args:
+            device (str): The block device.
+            size (int): Size of the device in bytes.
+            header_size (int, optional): Bytes overwritten per header. Defaults to HEADER_SIZE.
+
+        Returns:
+            list: (start, length) ranges in bytes.
+        """
+        ranges = [(0, header_size), (max(0, size - header_size), header_size)]
+        for start, length in Wipe.partitions(device).values():
+            ranges.append((start, min(length, header_size)))
+        return Wipe.merge(ranges)
+
+    @staticmethod
+    def outside_ranges(partitions, payloads, header_size=HEADER_SIZE):
+        """
+        Returns the ranges of the 'outside-luks' strategy: every partition, except the payloads of the
+        LUKS partitions (after their header area). The partition table itself is left intact.
+
+        Args:
+            partitions (dict): The partitions of the device (see 'partitions').
+            payloads (list): Numbers of the partitions that will be LUKS encrypted.
+            header_size (int, optional): Bytes at the start of a LUKS partition kept in the ranges. Defaults to HEADER_SIZE.
+
+        Returns:
+            tuple: (ranges, excluded) lists of (start, length) ranges in bytes: the ranges to overwrite,
+                   and the payloads (to discard).
+        """
+        ranges, excluded = [], []
+        for number, (start, length) in partitions.items():
+            if number in payloads and length > header_size:
+                ranges.append((start, header_size))
+                excluded.append((start + header_size, length - header_size))
+            else:
+                ranges.append((start, length))
+        return Wipe.merge(ranges), sorted(excluded)
+
+    def plan(self, strategy, payloads=(3, 4)):
+        """
+        Returns the ranges a strategy overwrites and discards.
+
+        Args:
+            strategy (str): One of STRATEGIES.
+            payloads (tuple, optional): Numbers of the LUKS partitions ('outside-luks'). Defaults to (3, 4).
+
+        Returns:
+            tuple: (overwrite, discard) lists of (start, length) ranges in bytes, or None when the strategy can not be
+                   planned (an unknown strategy, or partitions missing for 'outside-luks'): nothing would be wiped.
+        """
+        size = self.total()
+        if strategy == 'full':
+            return [(0, size)], []
+        if strategy == 'discard':
+            return [], [(0, size)]
+        if strategy == 'headers':
+            return Wipe.header_ranges(self.path, size), []
+        if strategy == 'outside-luks':
+            partitions = self.wait_partitions(tuple(sorted(set(Wipe.PARTITIONS) | set(payloads))))
+            return Wipe.outside_ranges(partitions, payloads) if partitions is not None else None
+        return None
+
+    def apply(self, strategy, payloads=(3, 4)):
+        """
+        Wipes the device with a strategy (see the class description).
+
+        Args:
+            strategy (str): One of STRATEGIES.
+            payloads (tuple, optional): Numbers of the LUKS partitions ('outside-luks'). Defaults to (3, 4).
+
+        Returns:
+            bool: True if the wipe succeeded.
+        """
+        plan = self.plan(strategy, payloads)
+        if plan is None or not any(plan):
+            return False        # Nothing to wipe is a failed wipe
+        overwrite, discard = plan
+        self.ranges = overwrite
+        if overwrite and not self.run():
+            return False
+        return not discard or self.discard(discard) is not None
+
+    def check(self, strategy, samples=256, payloads=(3, 4)):
+        """
+        Verifies a wipe with a strategy by sampling (see 'verify'): overwritten ranges must read as random,
+        a discarded device as a uniform byte. Discarded LUKS payloads are not checked, as a device may return
+        its old data for discarded blocks.
+
+        Args:
+            strategy (str): One of STRATEGIES.
+            samples (int, optional): Number of blocks to read. Defaults to 256.
+            payloads (tuple, optional): Numbers of the LUKS partitions ('outside-luks'). Defaults to (3, 4).
+
+        Returns:
+            bool: True if all samples passed, False if there was nothing to sample.
+        """
+        plan = self.plan(strategy, payloads)
+        if plan is None:
+            return False
+        ranges = plan[1] if strategy == 'discard' else plan[0]
+        if not [length for _, length in ranges if length >= Wipe.ALIGNMENT]:
+            return False
+        return self.verify(samples, 'uniform' if strategy == 'discard' else 'random', ranges)
+
+    @staticmethod
+    def merge(ranges):
+        """Merges overlapping (start, length) ranges."""
+        merged = []
+        for start, length in sorted(ranges):
+            if merged and start <= merged[-1][0] + merged[-1][1]:
+                end = max(merged[-1][0] + merged[-1][1], start + length)
+                merged[-1] = (merged[-1][0], end - merged[-1][0])
+            else:
+                merged.append((start, length))
+        return merged
+
+    def _open(self):
+        """
+        Opens the device for writing, with O_DIRECT if requested and supported (not by tmpfs for example).
+        The device must exist: a mistyped path fails instead of creating a file.
+
+        Returns:
+            tuple: (file descriptor, True if O_DIRECT is used)
+        """
+        flags = os.O_WRONLY
+        if self.direct and hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(self.path, flags | os.O_DIRECT, 0o600), True
+            except OSError:
+                pass
+        return os.open(self.path, flags, 0o600), False
+
+    def _generate(self, buffer, offset, length):
+        """
+        Fills a buffer with the keystream for a chunk of the device (runs in a worker thread).
+
+        Args:
+            buffer (mmap): The aligned buffer to fill.
+            offset (int): Offset of the chunk on the device, determines the counter of the keystream.
+            length (int): Number of bytes to generate.
+
+        Returns:
+            mmap: The filled buffer.
+        """
+        view = memoryview(buffer)
+        if Cipher is not None:
+            # The counter block is the offset in AES blocks, so every chunk is independent
+            nonce = (offset // 16).to_bytes(16, 'big')
+            encryptor = Cipher(algorithms.AES(self.key), modes.CTR(nonce)).encryptor()
+            encryptor.update_into(bytes(length), view[:length + 15])   # Keystream = encrypted zeros
+        else:
+            filled = 0
+            while filled < length:
+                filled += self.random.readinto(view[filled:length])
+        view.release()
+        return buffer
+
+    def _chunks(self, offset):
+        """Yields the (position, length) chunks of the ranges from an offset on."""
+        for start, length in self._ranges():
+            end = start + length
+            position = max(start, offset)
+            while position < end:
+                size = min(self.chunk_size, end - position)
+                yield position, size
+                position += size
+
+    def _report(self, written, total):
+        """Calls the progress callback."""
+        if self.progress:
+            self.progress(written, total)
+
+    def run(self, offset=0):
+        """
+        Overwrites the ranges (or the whole device) from an offset on.
+
+        Args:
+            offset (int, optional): Offset to start from, rounded down to ALIGNMENT (resume). Defaults to 0.
+
+        Returns:
+            bool: True if all ranges were overwritten, False if the wipe was cancelled ('offset' is where it stopped).
+        """
+        ranges = self._ranges()
+        end = ranges[-1][0] + ranges[-1][1] if ranges else 0
+        total = sum(length for _, length in ranges)
+        offset -= offset % Wipe.ALIGNMENT
+        done = sum(min(length, max(0, offset - start)) for start, length in ranges)    # Bytes overwritten before the offset
+        self.offset = offset
+        started, start_done = time.monotonic(), done
+        if Cipher is None:
+            self.random = open('/dev/urandom', 'rb', buffering=0)
+
+        fd, direct = self._open()
+        # Buffers: one per worker being filled, plus two being written or waiting (double buffering).
+        # Anonymous mmaps are page aligned, as O_DIRECT requires. The extra space is needed by update_into.
+        buffers = queue.Queue()
+        for _ in range(self.workers + 2):
+            buffers.put(mmap.mmap(-1, self.chunk_size + Wipe.ALIGNMENT))
+        pending = queue.Queue()
+        chunks = self._chunks(offset)
+        reported = 0.0
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                def submit():
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        buffer = buffers.get()
+                        pending.put(chunk + (executor.submit(self._generate, buffer, *chunk),))
+
+                # Fill the pipeline, then write the chunks in order and hand each buffer back for the next chunk
+                while not buffers.empty():
+                    submit()
+
+                while not pending.empty():
+                    position, length, future = pending.get()
+                    buffer = future.result()
+                    if self.cancel.is_set():
+                        continue    # Drain the pipeline without writing
+
+                    if direct and (position | length) % Wipe.ALIGNMENT:
+                        # Unaligned ranges (e.g. the end of the device) can not be written with O_DIRECT
+                        os.close(fd)
+                        fd, direct = os.open(self.path, os.O_WRONLY), False
+                    view = memoryview(buffer)[:length]
+                    written = 0
+                    while written < length:
+                        written += os.pwrite(fd, view[written:], position + written)
+                    view.release()
+                    self.offset = position + length
+                    done += length
+
+                    buffers.put(buffer)
+                    submit()
+
+                    if time.monotonic() - reported >= 0.5:
+                        reported = time.monotonic()
+                        self._report(done, total)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            if self.random is not None:
+                self.random.close()
+                self.random = None
+            elapsed = time.monotonic() - started
+            self.rate = (done - start_done) / elapsed if elapsed > 0 else None
+
+        self._report(done, total)
+        if not self.cancel.is_set():
+            self.offset = max(self.offset, end)
+        return not self.cancel.is_set()
+
+    def discard(self, ranges=None):
+        """
+        Discards ranges of the device: tries BLKSECDISCARD, then BLKDISCARD, then BLKZEROOUT (which writes
+        zeros on devices without discard support). A plain file is overwritten with zeros.
+
+        Args:
+            ranges (list, optional): (start, length) ranges in bytes. Defaults to None (the ranges of the Wipe).
+
+        Returns:
+            str: The method used ('secure discard', 'discard', 'zero out' or 'zeros'), or None if all failed.
+        """
+        ranges = ranges if ranges is not None else self._ranges()
+        total = sum(length for _, length in ranges)
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            if not stat.S_ISBLK(os.fstat(fd).st_mode):
+                zeros, done = bytes(self.chunk_size), 0
+                for start, length in ranges:
+                    for position in range(start, start + length, self.chunk_size):
+                        done += os.pwrite(fd, zeros[:min(self.chunk_size, start + length - position)], position)
+                        self._report(done, total)
+                os.fsync(fd)
+                return 'zeros'
+
+            for request, method in ((Wipe.BLKSECDISCARD, 'secure discard'), (Wipe.BLKDISCARD, 'discard'), (Wipe.BLKZEROOUT, 'zero out')):
+                try:
+                    done = 0
+                    for start, length in ranges:
+                        # Ranges must be multiples of the (logical) sector size
+                        start, length = start - start % 512, length - length % 512
+                        fcntl.ioctl(fd, request, struct.pack('QQ', start, length))
+                        done += length
+                        self._report(done, total)
+                    return method
+                except OSError:
+                    continue    # Not supported by the device, try the next method
+            return None
+        finally:
+            os.close(fd)
+
+    def verify(self, samples=256, expect='random', ranges=None, block_size=ALIGNMENT):
+        """
+        Verifies a wipe by reading randomly chosen blocks, instead of reading the whole device back.
+        If a fraction p of the device was not wiped, all samples pass with a probability of (1 - p) ** samples
+        (e.g. 256 samples detect 2% unwiped with 99.4% confidence).
+
+        Args:
+            samples (int, optional): Number of blocks to read. Defaults to 256.
+            expect (str, optional): 'random' (every byte value present in a plausible spread) or 'uniform'
+                                    (a single repeated byte, as discarded blocks read back). Defaults to 'random'.
+            ranges (list, optional): (start, length) ranges to sample. Defaults to None (the ranges of the Wipe).
+            block_size (int, optional): Size of a sample in bytes. Defaults to ALIGNMENT.
+
+        Returns:
+            bool: True if all samples passed (the offsets of failed samples are in 'failures').
+        """
+        ranges = ranges if ranges is not None else self._ranges()
+        ranges = [(start, length) for start, length in ranges if length >= block_size]
+        self.failures = []
+        if not ranges:
+            return True
+
+        # Read past the page cache, so the data on the device is verified
+        try:
+            fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_DIRECT', 0))
+        except OSError:
+            fd = os.open(self.path, os.O_RDONLY)
+        buffer = mmap.mmap(-1, block_size)
+        try:
+            total = sum(length for _, length in ranges)
+            for _ in range(samples):
+                # Choose a range weighted by its length, and an aligned block inside it
+                point = random.randrange(total)
+                for start, length in ranges:
+                    if point < length:
+                        break
+                    point -= length
+                position = start + min(point - point % block_size, length - block_size)
+                position -= position % Wipe.ALIGNMENT
+                try:
+                    read = os.preadv(fd, [buffer], position)
+                except OSError:
+                    read = 0
+                data = buffer[:read]
+                if read < block_size or not Wipe._passes(data, expect):
+                    self.failures.append(position)
+        finally:
+            os.close(fd)
+            buffer.close()
+        return not self.failures
+
+    @staticmethod
+    def _passes(data, expect):
+        """Checks a sample block (see 'verify')."""
+        if expect == 'uniform':
+            return data.count(data[:1]) == len(data)
+        # Random data: nearly all byte values occur, and none far more often than expected
+        counts = [data.count(bytes([value])) for value in range(256)]
+        expected = len(data) / 256
+        return sum(1 for count in counts if count) > 200 and max(counts) < expected * 3 + 8
@@ -0,0 +1,132 @@
+import os
+import signal
+import logging
+import argparse
+from rich.console import Console
+from rich.rule import Rule
+from rich.theme import Theme
+
+from lib.shell import Shell
+from lib.system import System
+from lib.profiler import Profiler
+from lib.dashboard import Dashboard
+from lib.backup import Backup
+from lib.store import Store
+from lib.watch import Watch
+
+# Python constants
+DEBUG  = False
+KEEP   = 14         # Number of snapshots kept per source on the storage partition
+TARGET = '/storage' # Mount point of the snapshots subvolume of the storage partition (see the fstab of secure_usb.py)
+JOURNAL = '/var/lib/secure-usb'  # Change journals of the watchers (--watch), used by --copy
+
+if __name__ == "__main__":
+
+#-- Arguments -----------------------------------------------------------------
+
+    parser = argparse.ArgumentParser(description='Back up btrfs subvolumes onto the storage partition of a Secure USB device.')
+    parser.add_argument('sources', nargs='+', help='btrfs subvolumes (or directories, with --store or --copy) to back up (e.g. /home)')
+    parser.add_argument('--target', default=TARGET, help=f'directory on the unlocked storage partition receiving the snapshots (default {TARGET})')
+    parser.add_argument('--keep', type=int, default=KEEP, help=f'number of snapshots kept per source on the storage partition (default {KEEP})')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--store', action='store_true', help='back up into a deduplicated store in <target>/store, for hosts without btrfs')
+    mode.add_argument('--copy', action='store_true', help='copy the changed files into <target>/copy, using the change journal of --watch')
+    mode.add_argument('--watch', action='store_true', help='record the changes of the sources in a journal until stopped (run as a service)')
+    parser.add_argument('--snapshots', help='directory for the snapshots on the host (default <source>/.snapshots)')
+    args = parser.parse_args()
+
+#-- Create Objects ------------------------------------------------------------
+
+    system    = System(debug=DEBUG)
+    system.check_sudo()
+    theme     = Theme(Shell.COLOR_THEME)
+    console   = Console(theme=theme)
+    log       = logging.getLogger("shell")
+    profiler  = Profiler()
+    dashboard = Dashboard(console, phases=len(args.sources)) if console.is_terminal else None
+    shell     = Shell(console=console, log=log, debug=DEBUG, log_file='backup.log', profiler=profiler, dashboard=dashboard)
+
+#-- Watch ---------------------------------------------------------------------
+
+    # A watcher per source, each in its own process (see lib/watch.py)
+    if args.watch:
+        watchers = []
+        for source in args.sources:
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0 if Watch(source, JOURNAL).run() else 1)
+            watchers.append(pid)
+        console.print(f'Recording changes of {", ".join(args.sources)} in {JOURNAL}.', style='info')
+        # Stopping the service stops every watcher (SIGINT reaches them with the terminal's process group)
+        signal.signal(signal.SIGTERM, lambda signum, frame: [os.kill(pid, signal.SIGTERM) for pid in watchers])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for pid in watchers:
+            os.waitpid(pid, 0)
+        exit()
+
+#-- Backup --------------------------------------------------------------------
+
+    console.print(Rule("Backup"), style='success')
+    if not os.path.ismount(args.target) and not Backup.show(args.target):
+        console.print(f'{args.target} is not mounted: unlock and mount the storage partition first.', style='critical')
+        exit()
+
+    if dashboard: dashboard.start()
+
+    results = []
+    os.environ['BACKUP_TARGET'] = args.target
+
+    # Hosts without btrfs: the changed files are chunked, and only chunks new to the store are written (see lib/store.py)
+    if args.store:
+        store = Store(os.path.join(args.target, 'store'))
+        os.environ['BACKUP_STORE'] = store.path
+        for source in args.sources:
+            os.environ['BACKUP_SOURCE'] = os.path.abspath(source)
+            shell.phase(f'Backup {source}')
+            shell.execute('Backup - Store {BACKUP_SOURCE}', 'store {BACKUP_SOURCE} {BACKUP_STORE}', progress='bytes',
+                          function=lambda progress: store.backup(os.environ['BACKUP_SOURCE'], progress))
+            if store.result:
+                results.append(store.result)
+
+    # Copy the files changed since the previous copy (all files without a running watcher, see lib/watch.py)
+    elif args.copy:
+        for source in args.sources:
+            watch = Watch(source, JOURNAL)
+            os.environ['BACKUP_SOURCE'] = watch.source
+            os.environ['BACKUP_COPY'] = os.path.join(args.target, 'copy', os.path.basename(watch.journal)[:-len('.journal')])
+            shell.phase(f'Backup {watch.source}')
+            changes = watch.take()
+            copied = {}
+            def copy(progress, changes=changes, copied=copied):
+                copied.update(system.copy_file_structure(os.environ['BACKUP_SOURCE'], os.environ['BACKUP_COPY'], changes=changes))
+                return not copied['errors']
+            if shell.execute('Backup - Copy {BACKUP_SOURCE}', 'copy {BACKUP_SOURCE} {BACKUP_COPY}', function=copy):
+                watch.commit()
+            if copied:
+                results.append(dict(copied, source=watch.source, scan='changes' if changes is not None else 'full'))
+
+    # One snapshot per source, sent incrementally against the previous one (see lib/backup.py)
+    else:
+        for source in args.sources:
+            backup = Backup(source, args.target, snapshots=args.snapshots, keep=args.keep)
+            os.environ['BACKUP_SOURCE'] = backup.source
+            shell.phase(f'Backup {backup.source}')
+            shell.execute('Backup - Send {BACKUP_SOURCE}', 'btrfs send {BACKUP_SOURCE} | btrfs receive {BACKUP_TARGET}', progress='bytes',
+                          function=backup.run)
+            if backup.result:
+                results.append(backup.result)
+
+    shell.close()
+    if dashboard: dashboard.stop()
+
+    if args.store:
+        Store.report(console, results)
+    elif args.copy:
+        for result in results:
+            console.print(f"{result['source']} ({result['scan']} scan): {result['copied']} copied, {result['skipped']} unchanged, "
+                          f"{result['files_per_second']:.0f} files/s, {result['mb_per_second']:.1f} MB/s", style='info')
+            for path, message in result['errors']:
+                console.print(f'  {path}: {message}', style='error')
+    else:
+        Backup.report(console, results)
+    console.print(Rule("Done"))
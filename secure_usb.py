@@ -1,25 +1,58 @@
 import os
 import logging
+import argparse
 from rich.console import Console
 from rich.rule import Rule
 from rich.prompt import Prompt
 from rich.theme import Theme
 
 from lib.shell import Shell
+from lib.chroot import Chroot
 from lib.system import System
 from lib.userentry import UserEntry
+from lib.plan import Plan, TimingHistory
+from lib.profiler import Profiler
+from lib.journal import Journal
+from lib.dashboard import Dashboard
+from lib.wipe import Wipe
+from lib.layout import Layout
+from lib.blockdev import BlockDevices
+from lib.luks import Luks
+from lib.fsbench import FsBench
+from lib.automount import AutoMount
+from lib.pkgcache import PackageCache
+from lib.golden import Golden
 
 # Python constants
-DEBUG = True
+DEBUG   = True
+WORKERS = 4         # Number of independent install steps executed concurrently
+BACKEND = 'session' # Run commands in long-lived bash sessions ('session') or a new bash per command ('popen')
+PHASES  = 3         # Number of installation phases (shell.phase), for the overall progress bar
+GRUB_UNLOCK = 3.0   # Target time in seconds for GRUB to unlock the Linux partition at boot
+ROOT_PROFILE = 'auto' # Root file system of the Linux partition: 'auto' (chosen by benchmark) or one of FsBench.ROOT_PROFILES
+TUNE_BTRFS  = True  # Choose the btrfs options of the storage partition by benchmark (a few minutes), otherwise the defaults
+HOST_AUTOMOUNT = True # Unlock and mount the storage partition on this computer when the device is plugged in (see lib/automount.py)
+MIRROR  = 'http://ftp.us.debian.org/debian' # Debian mirror (a file:// mirror must also exist at the same path inside /mnt)
+PKG_CACHE = '/var/cache/secure-usb/debs'     # Downloaded packages kept for the next installation (see lib/pkgcache.py)
+GOLDEN  = True      # Build the device independent part of the Linux install once, and unpack it onto the next devices (see lib/golden.py)
+GOLDEN_DIR = '/var/cache/secure-usb/golden' # Archives of the golden root
 
 if __name__ == "__main__":
 
+#-- Arguments -----------------------------------------------------------------
+
+    parser = argparse.ArgumentParser(description='Create a Secure USB backup device.')
+    parser.add_argument('--plan', action='store_true', help='show the installation steps with estimated time and bytes written, without executing them')
+    parser.add_argument('--resume', action='store_true', help='continue a failed installation from the first incomplete step')
+    args = parser.parse_args()
+
 #-- Environment Variables  ----------------------------------------------------
 
     # Create environment variables.
     os.environ["DEVICE"] = ""
     os.environ["DEVICE_NAME"] = ""
     os.environ["DEVICE_WIPE"] = ""
+    os.environ["DEVICE_WIPE_STRATEGY"] = ""
     os.environ["USER_NAME"] = ""
     os.environ["USER_PASS"] = ""
     os.environ["PART1"] = ""
@@ -40,24 +73,36 @@ if __name__ == "__main__":
     os.environ['PART3_LABEL']  = "LINUX"
     os.environ['PART4_LABEL']  = "STORAGE"
     os.environ['PART4_FORMAT'] = "BTRFS"
+    os.environ['LINUX_MIRROR'] = MIRROR
+    os.environ['LINUX_RELEASE'] = "--arch amd64 --components main,contrib,non-free-firmware stable"
+    os.environ['LINUX_SECURITY'] = "deb http://security.debian.org/ stable-security main contrib non-free-firmware"
+    os.environ['PKG_CACHE']    = PKG_CACHE
     os.environ['LINUX_ENV']    = "LANG=en_US.UTF-8 LC_ALL=en_US.UTF-8 KEYMAP=us DEBIAN_FRONTEND=noninteractive TERM=xterm-color"
     os.environ['LINUX_PKGS']   = "linux-image-amd64 firmware-linux firmware-iwlwifi zstd grub-efi cryptsetup cryptsetup-initramfs btrfs-progs fdisk gdisk sudo network-manager xserver-xorg xinit lightdm xfce4 dbus-x11 thunar xfce4-terminal firefox-esr keepassxc network-manager-gnome mg"
 
 
 #-- Update System  ------------------------------------------------------------
 
-    system = System(debug=DEBUG)
-    system.check_sudo()
+    block_devices = BlockDevices()
+    system = System(debug=DEBUG, block_devices=block_devices)
+    if not args.plan: system.check_sudo()
     #TODO system.check_pacman(['dialog', 'python-rich', 'debootstrap', 'gptfdisk'])
 
 #-- Create Objects ------------------------------------------------------------
 
-    userentry = UserEntry()
+    userentry = UserEntry(block_devices=block_devices)
     theme     = Theme(Shell.COLOR_THEME)
     console   = Console(theme=theme)
     prompt    = Prompt(console=console)
     log       = logging.getLogger("shell")
-    shell     = Shell(console=console, log=log, debug=DEBUG)
+    history   = TimingHistory('install.timings.json')
+    plan      = Plan(history) if args.plan else None
+    profiler  = Profiler()
+    journal   = Journal('install.journal.json')
+    luks      = Luks(grub_latency=GRUB_UNLOCK)
+    pkgcache  = PackageCache(PKG_CACHE)
+    dashboard = Dashboard(console, phases=PHASES) if console.is_terminal and not args.plan else None
+    shell     = Shell(console=console, log=log, debug=DEBUG, backend=BACKEND, history=history, plan=plan, profiler=profiler, dashboard=dashboard)
 
 #-- System Check --------------------------------------------------------------
 
@@ -65,10 +110,19 @@ if __name__ == "__main__":
 
 #-- User input ----------------------------------------------------------------
 
+    # Resume with the selections of the failed installation (the password is never stored)
+    if args.resume:
+        if not journal.config():
+            console.print('No installation to resume.', style='critical')
+            exit()
+        os.environ.update(journal.config())
+
     # Get user variables
     if not os.environ.get('DEVICE'):          os.environ['DEVICE']          = userentry.configure_drive()
     if not os.environ.get('DEVICE_NAME'):     os.environ['DEVICE_NAME']     = userentry.configure_hostname('Secure-USB').lower()
     if not os.environ.get('DEVICE_WIPE'):     os.environ['DEVICE_WIPE']     = userentry.run_yesno_str("Hard drive", "Wipe the entire drive (lengthy)")
+    if os.environ.get('DEVICE_WIPE') == 'yes' and not os.environ.get('DEVICE_WIPE_STRATEGY'):
+        os.environ['DEVICE_WIPE_STRATEGY'] = userentry.configure_wipe() or 'full'
     if not os.environ.get('USER_NAME'):       os.environ['USER_NAME']       = userentry.configure_username()
     if not os.environ.get('USER_PASS'):       os.environ['USER_PASS']       = userentry.configure_userpassword()
     if not os.environ.get('SYSTEM_LOCALE'):   os.environ['SYSTEM_LOCALE']   = userentry.configure_locale()
@@ -85,6 +139,8 @@ if __name__ == "__main__":
 
     if os.environ.get('DEVICE_WIPE'):
         console.print(f'Wipe drive:........ [green]{os.environ.get('DEVICE_WIPE')}[/]', style='info')
+        if os.environ.get('DEVICE_WIPE') == 'yes':
+            console.print(f'Wipe strategy:..... [green]{os.environ.get('DEVICE_WIPE_STRATEGY')}[/]', style='info')
     else:
         os.environ['DEVICE_WIPE'] = 'no'
 
@@ -113,11 +169,28 @@ if __name__ == "__main__":
     else:
         console.print('No system timezone selected.', style='critical')
 
-    if prompt.ask('\nAre these selections correct, and continue installation?', choices=['y', 'n']) == 'n':
+    if not args.plan and prompt.ask('\nAre these selections correct, and continue installation?', choices=['y', 'n']) == 'n':
         exit()
 
+#-- Resume --------------------------------------------------------------------
+
+    if dashboard: dashboard.start()
+
+    if not args.plan:
+        if journal.start(resume=args.resume):
+            console.print(Rule("Resuming installation"), style='success')
+
+            # Restore the outputs of completed steps, and release what the failed run left behind.
+            # Mounts and LUKS mappings are re-established by the 'replay' steps.
+            os.environ.update(journal.outputs())
+            shell.execute('Resume - Umount leftovers', 'umount --recursive /mnt', check_returncode=False)
+            shell.execute('Resume - Close {PART4_LABEL}', 'cryptsetup luksClose {PART4_UUID}', check_returncode=False)
+            shell.execute('Resume - Close {PART3_LABEL}', 'cryptsetup luksClose {PART3_UUID}', check_returncode=False)
+
+        shell.journal = journal
+
 #-- Partitioning --------------------------------------------------------------
-    console.print(Rule("Partitioning USB Device"), style='success')
+    shell.phase("Partitioning USB Device")
 
     #--------------------------------------------------------------------------
     # Create Partitions
@@ -128,62 +201,143 @@ if __name__ == "__main__":
     # - Partition 4: LUKS encrypted partition which will contain all your data
     #--------------------------------------------------------------------------
 
-    # Write random data to the whole disk
-    if os.environ.get('DEVICE_WIPE') == 'yes': shell.execute('Disk - Write random data to disk', 'dd bs=1M if=/dev/urandom of={DEVICE}', check_returncode=False)
+    # Partitions aligned to the erase blocks, with partition 3 sized to the Linux install (see lib/layout.py).
+    # A device too small is refused before anything on it is wiped or partitioned.
+    layout = Layout(os.environ.get('DEVICE'), os.environ.get('LINUX_PKGS'), footprint_file='install.footprint.json')
+    if not layout.fits():
+        console.print(f'Device too small for a Linux install of {layout.footprint() // 2**20} MiB.', style='critical')
+        exit()
+    os.environ['PART_LAYOUT'] = layout.sgdisk()
+
+    # Wipe the disk with the selected strategy, and verify the wipe by sampling (see lib/wipe.py)
+    wipe_strategy = os.environ.get('DEVICE_WIPE_STRATEGY') if os.environ.get('DEVICE_WIPE') == 'yes' else None
+    wipe_steps = [
+        dict(description='Disk - Wipe ({DEVICE_WIPE_STRATEGY})', command='wipe {DEVICE} {DEVICE_WIPE_STRATEGY}', progress='bytes',
+             function=lambda progress: Wipe(os.environ['DEVICE'], progress=progress, block_devices=block_devices).apply(os.environ['DEVICE_WIPE_STRATEGY'])),
+        dict(description='Disk - Verify wipe ({DEVICE_WIPE_STRATEGY})', command='verify {DEVICE} {DEVICE_WIPE_STRATEGY}',
+             function=lambda progress: Wipe(os.environ['DEVICE'], block_devices=block_devices).check(os.environ['DEVICE_WIPE_STRATEGY'])),
+    ]
+    if wipe_strategy in ('full', 'discard', 'headers'):
+        shell.execute_all(wipe_steps)
 
     # Remove any file system magic bytes
     shell.execute('Disk - Remove file magic bytes','wipefs --all {DEVICE}')
 
-    # Create partition table
-    # command = "sgdisk --clear /dev/sdb --new 1::+64MiB --new 2::+128MiB --typecode 2:ef00 /dev/sdb --new 3::+10GiB --new 4::0"
-    shell.execute('Partitioning - Create partition table', 'sgdisk --clear {DEVICE} --new 1::+64MiB --new 2::+128MiB --typecode 2:ef00 {DEVICE} --new 3::+10GiB --new 4::0')
+    # Create partition table (see the layout above)
+    # command = "sgdisk --clear /dev/sdb --set-alignment=8192 --new 1:8192:139263 --new 2:139264:401407 --new 3:401408:13475839 --new 4:13475840:0 --typecode 2:ef00"
+    shell.execute('Partitioning - Create partition table', 'sgdisk --clear {DEVICE} {PART_LAYOUT}', verify='sgdisk --verify {DEVICE}')
 
     # Rename the partitions
     # command = "sgdisk /dev/sdb --change-name=1:README --change-name=2:EFI --change-name=3:LINUX_ENCRYPTED --change-name=4:STORAGE_ENCRYPTED"
     shell.execute('Partitioning - Name the partitions', 'sgdisk {DEVICE} --change-name=1:{PART1_LABEL} --change-name=2:{PART2_LABEL} --change-name=3:{PART3_LABEL} --change-name=4:{PART4_LABEL}')
 
-    # Get the partitions (/dev/sda1 etc)
-    os.environ['PART1'] = system.get_partition(os.environ.get('DEVICE'), 1)
-    os.environ['PART2'] = system.get_partition(os.environ.get('DEVICE'), 2)
-    os.environ['PART3'] = system.get_partition(os.environ.get('DEVICE'), 3)
-    os.environ['PART4'] = system.get_partition(os.environ.get('DEVICE'), 4)
-
-    # -- partition 1 - README -------------------------------------------------
-    shell.execute('Partition 1 - Formatting {PART1_LABEL}','mkfs.vfat -n {PART1_LABEL} -F 32 {PART1}')
-    shell.execute('Partition 1 - Get UUID for {PART1_LABEL}', 'lsblk -o uuid {PART1} | tail -1', output_var='PART1_UUID')
-
-    # -- partition 2 - EFI ----------------------------------------------------
-    shell.execute('Partition 2 - Formatting {PART2_LABEL}','mkfs.vfat -n {PART2_LABEL} -F 32 {PART2}')
-    shell.execute('Partition 2 - Get UUID for {PART2_LABEL}', 'lsblk -o uuid {PART2} | tail -1', output_var='PART2_UUID')
-
-    # -- partition 3 ----------------------------------------------------------
-    shell.execute('Partition 3 - Encrypting {PART3_LABEL}','cryptsetup luksFormat -q --type luks1 --label {PART3_LABEL} {PART3}',input="{USER_PASS}")
-    shell.execute('Partition 3 - Get UUID for {PART3_LABEL}', 'cryptsetup luksUUID {PART3}', output_var='PART3_UUID')
-    shell.execute('Partition 3 - Open {PART3_LABEL}', 'cryptsetup luksOpen {PART3} {PART3_UUID}' ,input="{USER_PASS}")
-    shell.execute('Partition 3 - Set file system {PART3_LABEL} to ext4', 'mkfs.ext4 -L {PART3_LABEL} /dev/mapper/{PART3_UUID}')
-
-    # -- partition 4 ----------------------------------------------------------
-    shell.execute('Partition 4 - Encrypting {PART4_LABEL}','cryptsetup luksFormat -q --type luks1 --label {PART4_LABEL} {PART4}',input="{USER_PASS}")
-    shell.execute('Partition 4 - Get UUID for {PART4_LABEL}', 'cryptsetup luksUUID {PART4}', output_var='PART4_UUID')
-    shell.execute('Partition 4 - Open {PART4_LABEL}', 'cryptsetup luksOpen {PART4} {PART4_UUID}' ,input="{USER_PASS}")
+    # The 'outside-luks' wipe needs the partitions: it leaves the payloads of partitions 3 and 4 to the encryption
+    if wipe_strategy == 'outside-luks':
+        shell.execute_all(wipe_steps)
+
+    # Get the partitions (/dev/sda1 etc) - a plan uses the names the partitions will get
+    get_partition = system.get_partition_name if args.plan else system.get_partition
+    os.environ['PART1'] = get_partition(os.environ.get('DEVICE'), 1)
+    os.environ['PART2'] = get_partition(os.environ.get('DEVICE'), 2)
+    os.environ['PART3'] = get_partition(os.environ.get('DEVICE'), 3)
+    os.environ['PART4'] = get_partition(os.environ.get('DEVICE'), 4)
+
+    # Key derivation cost: the Linux partition is unlocked by GRUB, keyfile slots need no brute force protection (see lib/luks.py)
+    os.environ['PART3_PBKDF']   = luks.grub_options()
+    os.environ['KEYFILE_PBKDF'] = luks.keyfile_options()
+
+    # The keyfiles are created before formatting, in memory (/run): the volumes are formatted and opened with
+    # the cheap keyfile slot, and the passphrase is derived only once per volume, when it is added.
+    os.environ['PART3_KEYFILE'] = '/run/secure-usb/luks_part3.keyfile'
+    os.environ['PART4_KEYFILE'] = '/run/secure-usb/luks_part4.keyfile'
+    os.environ['HOST_KEYFILE']  = '/run/secure-usb/luks_host.keyfile'
+    os.environ['HOST_KEY_SLOT'] = str(AutoMount.KEY_SLOT)
+    shell.execute('Keyfiles - Create directory', 'install -d -m 700 /run/secure-usb', replay=True)
+
+    # Cipher profile of the storage partition (LUKS2, not unlocked by GRUB), chosen and verified by benchmark
+    crypto = luks.cipher_profile(system.get_cpu_brand())
+    os.environ['PART4_CRYPT'] = luks.format_options(crypto)
+    shell.execute('Partition 4 - Benchmark cipher {PART4_CRYPT}', 'benchmark {PART4_CRYPT}', check_returncode=False,
+                  function=lambda progress: luks.verify_profile(crypto))
+    os.environ['PART4_OPEN'] = luks.open_options(crypto)
+    if not args.plan: luks.save_profile(crypto, 'install.crypto.json')
+
+    # Root file system of the Linux partition (LUKS1, cryptsetup's default cipher), chosen by a benchmark of cold
+    # small-file reads (boot) and an apt upgrade on a loop device (see lib/fsbench.py)
+    rootbench = FsBench(luks, dict(crypto, cipher='aes-xts-plain64', key_size=256, sector_size=512, no_workqueue=False))
+    shell.execute('Partition 3 - Choose root file system', 'compare root file systems {PART3_LABEL}', output_var='PART3_FS',
+                  function=lambda progress: rootbench.compare_root(layout.alignment, progress)['profile'] if ROOT_PROFILE == 'auto' else ROOT_PROFILE)
+    os.environ['PART3_MKFS'], os.environ['PART3_MOUNT_OPTS'], os.environ['PART3_FSTYPE'] = FsBench.root_options(os.environ['PART3_FS'], os.environ['PART3_LABEL'], layout.alignment)
+    if os.environ['PART3_FSTYPE'] == 'f2fs': os.environ['LINUX_PKGS'] += ' f2fs-tools'
+    if not args.plan and rootbench.results: rootbench.save('install.rootfs.json')
+
+    # Format the partitions as a dependency graph: independent steps (e.g. the two partitions
+    # being encrypted) run concurrently, steps sharing a resource run in the listed order.
+    partition_steps = [
+        # -- partition 1 - README ---------------------------------------------
+        dict(description='Partition 1 - Formatting {PART1_LABEL}', command='mkfs.vfat -n {PART1_LABEL} -F 32 {PART1}', provides=['PART1_FS']),
+        dict(description='Partition 1 - Get UUID for {PART1_LABEL}', command='lsblk -o uuid {PART1} | tail -1', output_var='PART1_UUID', requires=['PART1_FS']),
+
+        # -- partition 2 - EFI ------------------------------------------------
+        dict(description='Partition 2 - Formatting {PART2_LABEL}', command='mkfs.vfat -n {PART2_LABEL} -F 32 {PART2}', provides=['PART2_FS']),
+        dict(description='Partition 2 - Get UUID for {PART2_LABEL}', command='lsblk -o uuid {PART2} | tail -1', output_var='PART2_UUID', requires=['PART2_FS']),
+
+        # -- partition 3 ------------------------------------------------------
+        dict(description='Partition 3 - Create Keyfile for {PART3_LABEL}', command='dd bs=512 count=4 if=/dev/random of={PART3_KEYFILE} iflag=fullblock && chmod 400 {PART3_KEYFILE}', provides=['PART3_KEYFILE'], verify='test -s {PART3_KEYFILE}'),
+        dict(description='Partition 3 - Encrypting {PART3_LABEL}', command='cryptsetup luksFormat -q --type luks1 {KEYFILE_PBKDF} --label {PART3_LABEL} {PART3} {PART3_KEYFILE}', requires=['PART3_KEYFILE'], provides=['PART3_LUKS'], verify='cryptsetup isLuks {PART3}'),
+        dict(description='Partition 3 - Add passphrase to {PART3_LABEL}', command='cryptsetup luksAddKey {PART3_PBKDF} --key-file {PART3_KEYFILE} {PART3}', input="{USER_PASS}", requires=['PART3_LUKS'], provides=['PART3_SLOTS']),
+        dict(description='Partition 3 - Get UUID for {PART3_LABEL}', command='cryptsetup luksUUID {PART3}', output_var='PART3_UUID', requires=['PART3_LUKS']),
+        # Open with the keyfile (after a reboot /run is empty, then the passphrase is used), after every key slot is written
+        dict(description='Partition 3 - Open {PART3_LABEL}', command='cryptsetup open --key-file {PART3_KEYFILE} {PART3} {PART3_UUID}', requires=['PART3_SLOTS'], provides=['PART3_MAPPER'], replay=True,
+             function=lambda progress: luks.open(os.environ['PART3_LABEL'], os.environ['PART3'], os.environ['PART3_UUID'], os.environ['PART3_KEYFILE'], os.environ['USER_PASS'])),
+        dict(description='Partition 3 - Set file system {PART3_LABEL} to {PART3_FS}', command='{PART3_MKFS} /dev/mapper/{PART3_UUID}', requires=['PART3_MAPPER'], verify='blkid -t TYPE={PART3_FSTYPE} /dev/mapper/{PART3_UUID}'),
+
+        # -- partition 4 ------------------------------------------------------
+        dict(description='Partition 4 - Create Keyfile for {PART4_LABEL}', command='dd bs=512 count=4 if=/dev/random of={PART4_KEYFILE} iflag=fullblock && chmod 400 {PART4_KEYFILE}', provides=['PART4_KEYFILE'], verify='test -s {PART4_KEYFILE}'),
+        dict(description='Partition 4 - Encrypting {PART4_LABEL}', command='cryptsetup luksFormat -q {PART4_CRYPT} {KEYFILE_PBKDF} --label {PART4_LABEL} {PART4} {PART4_KEYFILE}', requires=['PART4_KEYFILE'], provides=['PART4_LUKS'], verify='cryptsetup isLuks {PART4}'),
+        dict(description='Partition 4 - Add passphrase to {PART4_LABEL}', command='cryptsetup luksAddKey --key-file {PART4_KEYFILE} {PART4}', input="{USER_PASS}", requires=['PART4_LUKS'], provides=['PART4_SLOTS']),
+        dict(description='Partition 4 - Get UUID for {PART4_LABEL}', command='cryptsetup luksUUID {PART4}', output_var='PART4_UUID', requires=['PART4_LUKS']),
+        # A keyfile of this computer in its own cheap slot, after the passphrase (slot 1), to unlock the storage partition when plugged in
+        dict(description='Partition 4 - Create host keyfile for {PART4_LABEL}', command='dd bs=512 count=4 if=/dev/random of={HOST_KEYFILE} iflag=fullblock && chmod 400 {HOST_KEYFILE}', provides=['HOST_KEYFILE'], verify='test -s {HOST_KEYFILE}'),
+        dict(description='Partition 4 - Add host keyfile to {PART4_LABEL}', command='cryptsetup luksAddKey {KEYFILE_PBKDF} --key-slot {HOST_KEY_SLOT} --key-file {PART4_KEYFILE} {PART4} {HOST_KEYFILE}', requires=['PART4_SLOTS', 'HOST_KEYFILE'], provides=['PART4_HOST_SLOT'],
+             verify='cryptsetup open --test-passphrase --key-slot {HOST_KEY_SLOT} --key-file {HOST_KEYFILE} {PART4}'),
+        dict(description='Partition 4 - Open {PART4_LABEL}', command='cryptsetup open {PART4_OPEN} --key-file {PART4_KEYFILE} {PART4} {PART4_UUID}', requires=['PART4_SLOTS', 'PART4_HOST_SLOT'], provides=['PART4_MAPPER'], replay=True,
+             function=lambda progress: luks.open(os.environ['PART4_LABEL'], os.environ['PART4'], os.environ['PART4_UUID'], os.environ['PART4_KEYFILE'], os.environ['USER_PASS'],
+                                                 os.environ.get('PART4_OPEN', ''))),
+    ]
 
     if os.environ.get('PART4_FORMAT') == "BTRFS":
-        shell.execute('Partition 4 - Set file system {PART4_LABEL} to BTRFS', 'mkfs.btrfs --label {PART4_LABEL} /dev/mapper/{PART4_UUID}')
-        shell.execute('Partition 4 - Mount {PART4_LABEL}', 'mount /dev/mapper/{PART4_UUID} /mnt')
-        shell.execute('Partition 4 - Create subvolume @snapshots' , 'btrfs subvolume create /mnt/@snapshots')
-        shell.execute('Partition 4 - Umount {PART4_LABEL}', 'umount /mnt')
+        # Compression, metadata profile and node size of the storage partition, chosen by a benchmark on a loop device
+        # with the cipher profile of the partition (see lib/fsbench.py); the report is saved next to install.log
+        fsbench = FsBench(luks, crypto)
+        shell.execute('Partition 4 - Tune BTRFS options', 'tune btrfs {PART4_CRYPT}', output_var='PART4_MKFS_OPTS', progress='bytes',
+                      function=lambda progress: fsbench.tune_btrfs(progress, measure=TUNE_BTRFS)['mkfs'])
+        shell.execute('Partition 4 - BTRFS mount options', 'tune btrfs mount {PART4_CRYPT}', output_var='PART4_MOUNT_OPTS',
+                      function=lambda progress: fsbench.btrfs()['mount'])
+        if not args.plan and fsbench.results: fsbench.save('install.btrfs.json')
+
+        partition_steps += [
+            dict(description='Partition 4 - Set file system {PART4_LABEL} to BTRFS', command='mkfs.btrfs --label {PART4_LABEL} {PART4_MKFS_OPTS} /dev/mapper/{PART4_UUID}', requires=['PART4_MAPPER'], provides=['PART4_FS']),
+            dict(description='Partition 4 - Mount {PART4_LABEL}', command='mount /dev/mapper/{PART4_UUID} /mnt', requires=['PART4_FS'], provides=['mnt']),
+            dict(description='Partition 4 - Create subvolume @snapshots', command='btrfs subvolume create /mnt/@snapshots', provides=['mnt']),
+            dict(description='Partition 4 - Umount {PART4_LABEL}', command='umount /mnt', provides=['mnt']),
+        ]
     else:
-        shell.execute('Partition 4 - Set file system {PART4_LABEL} to EXT4', 'mkfs.ext4 -L {PART4_LABEL} /dev/mapper/{PART4_UUID}')
+        partition_steps += [
+            dict(description='Partition 4 - Set file system {PART4_LABEL} to EXT4', command='mkfs.ext4 -L {PART4_LABEL} /dev/mapper/{PART4_UUID}', requires=['PART4_MAPPER']),
+        ]
+
+    shell.execute_all(partition_steps, workers=WORKERS)
 
 #-- Install Readme  ------------------------------------------------------------
-    console.print(Rule("Installing Readme"), style='success')
+    shell.phase("Installing Readme")
 
     shell.execute('Partition 1 - Mount {PART1_LABEL}','mount {PART1} /mnt')
     shell.execute('Partition 1 - Copy readme.org', 'cp README.org /mnt/README.org')
     shell.execute('Partition 1 - Umount', 'umount /mnt')
 
 #-- Install Linux  ------------------------------------------------------------
-    console.print(Rule("Installing Linux"), style='success')
+    shell.phase("Installing Linux")
 
     #--------------------------------------------------------------------------
     # Install Linux on the embedded USB device
@@ -200,23 +354,63 @@ if __name__ == "__main__":
     #--------------------------------------------------------------------------
 
     # Mount linux partition
-    shell.execute('Partition 3 - Mount {PART3_LABEL}', 'mount /dev/mapper/{PART3_UUID} /mnt')
-
-    # Install Debian (add the --foreign option if the host is different from the target)
-    shell.execute('Linux - Install Linux Debian', 'debootstrap --arch amd64 --components main,contrib,non-free-firmware stable /mnt http://ftp.us.debian.org/debian')
+    shell.execute('Partition 3 - Mount {PART3_LABEL}', 'mount -o {PART3_MOUNT_OPTS} /dev/mapper/{PART3_UUID} /mnt', replay=True)
+
+    # The device independent part of the install (Debian, repositories, packages) is built once per configuration
+    # and archived; the next devices with the same configuration unpack it (see lib/golden.py)
+    golden = Golden(GOLDEN_DIR)
+    golden_config = {key: os.environ[key] for key in ('LINUX_MIRROR', 'LINUX_RELEASE', 'LINUX_SECURITY', 'LINUX_ENV', 'LINUX_PKGS')}
+    os.environ['GOLDEN'] = golden.path(golden_config)
+    os.environ['GOLDEN_DIR'] = GOLDEN_DIR
+    os.environ['GOLDEN_TAR'] = Golden.archive_options()
+    os.environ['GOLDEN_UNTAR'] = Golden.extract_options()
+    shell.execute('Linux - Find golden root', 'test -s {GOLDEN}', output_var='GOLDEN_USE',
+                  function=lambda progress: 'yes' if GOLDEN and golden.available(golden_config) else 'no')
+
+    # The package cache is bind mounted on both paths (see 'Mount resources')
+    shell.execute('Packages - Create cache', 'mkdir -p {PKG_CACHE}')
+
+    if os.environ['GOLDEN_USE'] == 'yes':
+        shell.execute('Linux - Unpack golden root', 'tar -C /mnt {GOLDEN_UNTAR} -xf {GOLDEN}', progress='bytes', verify='test -x /mnt/usr/sbin/lightdm')
+    else:
+        # Install Debian (add the --foreign option if the host is different from the target), with the packages
+        # downloaded by earlier installations; cached packages not matching the signed index are dropped before apt uses them
+        shell.execute('Linux - Install Linux Debian', 'debootstrap {LINUX_RELEASE} --cache-dir={PKG_CACHE} /mnt {LINUX_MIRROR}', progress='packages', verify='test -x /mnt/usr/bin/apt-get')
+        shell.execute('Packages - Verify cache', 'verify {PKG_CACHE} against /mnt/var/lib/apt/lists',
+                      function=lambda progress: pkgcache.verify('/mnt/var/lib/apt/lists') is not None)
 
     # Mount resources
-    shell.execute('Linux - Mount "boot/efi"', 'mount --mkdir {PART2} /mnt/boot/efi')
-    shell.execute('Linux - Mount "proc"',     'mount -t proc  proc /mnt/proc')
-    shell.execute('Linux - Mount "sys"',      'mount -t sysfs sys  /mnt/sys')
-    shell.execute('Linux - Mount "dev"',      'mount -o bind  /dev /mnt/dev')
-    shell.execute('Linux - Mount "efivars"',  'mount --rbind /sys/firmware/efi/efivars /mnt/sys/firmware/efi/efivars')
-
-    # Configure Linux
+    shell.execute('Linux - Mount "boot/efi"', 'mount --mkdir {PART2} /mnt/boot/efi', replay=True)
+    shell.execute('Linux - Mount "proc"',     'mount -t proc  proc /mnt/proc', replay=True)
+    shell.execute('Linux - Mount "sys"',      'mount -t sysfs sys  /mnt/sys', replay=True)
+    shell.execute('Linux - Mount "dev"',      'mount -o bind  /dev /mnt/dev', replay=True)
+    shell.execute('Linux - Mount "efivars"',  'mount --rbind /sys/firmware/efi/efivars /mnt/sys/firmware/efi/efivars', replay=True)
+    shell.execute('Linux - Mount "archives"', 'mount --mkdir --bind {PKG_CACHE} /mnt/var/cache/apt/archives', replay=True)
+
+    # Enter the new Linux install once, all chroot commands run in the same login shell
+    chroot = Chroot(shell, '/mnt', env='{LINUX_ENV}')
+
+    if os.environ['GOLDEN_USE'] != 'yes':
+        shell.execute('Linux - Set repository', 'echo "{LINUX_SECURITY}" | tee -a /mnt/etc/apt/sources.list')
+
+        # Update Linux repositories
+        chroot.execute('Linux - Update repositories', 'apt-get update && apt-get upgrade -y', progress='packages')
+
+        # Install packages
+        chroot.execute('Linux - Install packages', 'apt-get install -y {LINUX_PKGS}', progress='packages', verify='test -x /mnt/usr/sbin/lightdm')
+        shell.execute('Packages - Update cache', 'update {PKG_CACHE}', function=lambda progress: pkgcache.update('/mnt/var/lib/dpkg/status') is not None)
+
+        # Archive the golden root for the next devices (written to a temporary file, recorded once complete)
+        if GOLDEN:
+            shell.execute('Linux - Archive golden root', 'mkdir -p {GOLDEN_DIR} && tar -C /mnt {GOLDEN_TAR} -cf {GOLDEN}.tmp . && mv {GOLDEN}.tmp {GOLDEN}', check_returncode=False)
+            shell.execute('Linux - Record golden root', 'record {GOLDEN}', check_returncode=False, function=lambda progress: golden.save(golden_config))
+
+    # Configure Linux (the golden root has no machine-id: an empty one is generated at the first boot, unique per device)
+    if os.environ['GOLDEN_USE'] == 'yes':
+        shell.execute('Linux - Reset machine-id', 'truncate -s 0 /mnt/etc/machine-id')
     shell.execute('Linux - Set hostname',   'echo {DEVICE_NAME} | tee /mnt/etc/hostname')
     shell.execute('Linux - Set hosts',      'echo "127.0.0.1 {DEVICE_NAME}" | tee -a /mnt/etc/hosts')
     shell.execute('Linux - Set motd',       'echo | tee /mnt/etc/motd')
-    shell.execute('Linux - Set repository', 'echo "deb http://security.debian.org/ stable-security main contrib non-free-firmware" | tee -a /mnt/etc/apt/sources.list')
 
     # shell.execute('Set the system font to "$SYSTEM_FONT"', 'echo "FONT=$SYSTEM_FONT" >/mnt/etc/vconsole.conf')
     # shell.execute('Set the hostname to $SYSTEM_HOSTNAME', 'echo "$SYSTEM_HOSTNAME" >/mnt/etc/hostname')
@@ -224,57 +418,59 @@ if __name__ == "__main__":
     shell.execute('Set the system keyboard to {SYSTEM_KEYB}"', 'echo "KEYMAP={SYSTEM_KEYB}" >>/mnt/etc/vconsole.conf')
     shell.execute('Set the language to {SYSTEM_LOCALE}', 'echo "{SYSTEM_LOCALE}" >>/mnt/etc/locale.gen')
     shell.execute('Set the timezone to {SYSTEM_TIMEZONE}', 'ln -sf /usr/share/zoneinfo/{SYSTEM_TIMEZONE} /mnt/etc/localtime')
-    shell.execute('Generate locale', '{LINUX_ENV} chroot /mnt bash --login -c "locale-gen"')
-
-    # Update Linux repositories
-    shell.execute('Linux - Update repositories', '{LINUX_ENV} chroot /mnt bash --login -c "apt-get update && apt-get upgrade -y"')
-
-    # Install packages
-    shell.execute('Linux - Install packages', '{LINUX_ENV} chroot /mnt bash --login -c "apt-get install -y {LINUX_PKGS}"')
-
-    # Create swapfile
-    shell.execute('Linux - Allocate swapfile', 'fallocate -l 1G /mnt/swapfile')
-    shell.execute('Linux - Set permissions swapfile', 'chmod 600 /mnt/swapfile')
-    shell.execute('Linux - Make swapfile', 'mkswap /mnt/swapfile')
-
-    # Create keyfiles for to auto-mount partitions
-    shell.execute('Linux - Create Keyfile for {PART3_LABEL}', 'dd bs=512 count=4 if=/dev/random of=/mnt/root/luks_{PART3_UUID}.keyfile iflag=fullblock')
-    shell.execute('Linux - Set permission Keyfile {PART3_LABEL}', 'chmod 400 /mnt/root/luks_{PART3_UUID}.keyfile')
-    shell.execute('Linux - Create Keyfile for {PART4_LABEL}', 'dd bs=512 count=4 if=/dev/random of=/mnt/root/luks_{PART4_UUID}.keyfile iflag=fullblock')
-    shell.execute('Linux - Set permission Keyfile {PART4_LABEL}', 'chmod 400 /mnt/root/luks_{PART4_UUID}.keyfile')
-
-    # Enroll the keyfiles so we can open the USB device
-    shell.execute('Linux - Enroll Keyfile for (PART3_LABEL)', 'cryptsetup luksAddKey {PART3} /mnt/root/luks_{PART3_UUID}.keyfile', input="{USER_PASS}")
-    shell.execute('Linux - Enroll Keyfile for (PART4_LABEL)', 'cryptsetup luksAddKey {PART4} /mnt/root/luks_{PART4_UUID}.keyfile', input="{USER_PASS}")
-
-    # And add the following to crypttab so that `cryptsetup-initramfs` knows which key to use to allow the initramfs to decrypt the root partition:
-    shell.execute('Linux - Configure crypttab for {PART3_LABEL}', 'echo "{PART3_UUID} UUID={PART3_UUID} /root/luks_{PART3_UUID}.keyfile luks,discard" | tee -a /mnt/etc/crypttab')
-    shell.execute('Linux - Configure crypttab for {PART4_LABEL}', 'echo "{PART4_UUID} UUID={PART4_UUID} /root/luks_{PART4_UUID}.keyfile luks,discard" | tee -a /mnt/etc/crypttab')
-    shell.execute('Linux - Configure cryptsetup hook', 'echo KEYFILE_PATTERN="/root/luks_*.keyfile" | tee -a /mnt/etc/cryptsetup-initramfs/conf-hook')
-
-    # Setup fstab
-    shell.execute('Linux - Configure fstab for {PART2_LABEL}', 'echo "UUID={PART2_UUID} /boot/efi vfat rw,relatime,fmask=0077,dmask=0077,codepage=437,iocharset=ascii,shortname=mixed,utf8,errors=remount-ro 0 0" | tee -a /mnt/etc/fstab')
-    shell.execute('Linux - Configure fstab for {PART3_LABEL}', 'echo "/dev/mapper/{PART3_UUID} / ext4 defaults 0 1" | tee /mnt/etc/fstab')
-    shell.execute('Linux - Configure fstab for {PART4_LABEL}', 'echo "/dev/mapper/{PART4_UUID} /storage btrfs defaults,noatime,nodiratime,subvol=@snapshots,compress=zstd,space_cache=v2    0  2" | tee -a /mnt/etc/fstab')
-    shell.execute('Linux - Configure fstab for swapfile', 'echo "/swapfile none swap sw 0 0" | tee -a /mnt/etc/fstab')
-
-    # Setup bootloader
-    shell.execute('Linux - Configure grub', 'echo GRUB_ENABLE_CRYPTODISK=y | tee -a /mnt/etc/default/grub')
-    shell.execute('Linux - Configure grub', 'echo GRUB_CMDLINE_LINUX="cryptdevice=UUID={PART3_UUID}:{PART3_UUID}" | tee -a /mnt/etc/default/grub')
-    shell.execute('Linux - Configure grub', 'echo GRUB_DISTRIBUTOR="{DEVICE_NAME}" | tee -a /mnt/etc/default/grub')
-    shell.execute('Linux - Configure intitamfs', 'echo UMASK=0077 | tee -a /mnt/etc/initramfs-tools/initramfs.conf')
-    shell.execute('Linux - Update initramfs', 'chroot /mnt bash --login -c "update-initramfs -u -k all"')
-    shell.execute('Linux - Update grub', 'chroot /mnt bash --login -c "update-grub"')
-    shell.execute('Linux - Install grub', 'chroot /mnt bash --login -c "grub-install {DEVICE}"')
+
+    chroot.execute('Generate locale', 'locale-gen')
+
+    # Measure the size of the install, to size partition 3 of the next device
+    shell.execute('Linux - Measure install size', 'measure /mnt', function=lambda progress: layout.record('/mnt'))
+
+    # Configure the encrypted boot as a dependency graph (files written by several steps are a shared resource)
+    config_steps = [
+        # Create swapfile
+        dict(description='Linux - Allocate swapfile', command='fallocate -l 1G /mnt/swapfile', provides=['swapfile']),
+        dict(description='Linux - Set permissions swapfile', command='chmod 600 /mnt/swapfile', provides=['swapfile']),
+        dict(description='Linux - Make swapfile', command='mkswap /mnt/swapfile', provides=['swapfile']),
+
+        # Install the keyfiles (enrolled when formatting) to auto-mount partitions
+        dict(description='Linux - Install Keyfile for {PART3_LABEL}', command='install -m 400 {PART3_KEYFILE} /mnt/root/luks_{PART3_UUID}.keyfile'),
+        dict(description='Linux - Install Keyfile for {PART4_LABEL}', command='install -m 400 {PART4_KEYFILE} /mnt/root/luks_{PART4_UUID}.keyfile'),
+
+        # Measure how long unlocking the Linux partition takes (GRUB tries all key slots in order)
+        dict(description='Linux - Benchmark unlock of {PART3_LABEL}', command='cryptsetup open --test-passphrase {PART3}',
+             function=lambda progress: luks.benchmark(os.environ['PART3_LABEL'] + ' passphrase', os.environ['PART3'], os.environ['USER_PASS']) is not None),
+
+        # And add the following to crypttab so that `cryptsetup-initramfs` knows which key to use to allow the initramfs to decrypt the root partition:
+        dict(description='Linux - Configure crypttab for {PART3_LABEL}', command='echo "{PART3_UUID} UUID={PART3_UUID} /root/luks_{PART3_UUID}.keyfile luks,discard" | tee -a /mnt/etc/crypttab', provides=['crypttab']),
+        dict(description='Linux - Configure crypttab for {PART4_LABEL}', command='echo "{PART4_UUID} UUID={PART4_UUID} /root/luks_{PART4_UUID}.keyfile luks,discard" | tee -a /mnt/etc/crypttab', provides=['crypttab']),
+        dict(description='Linux - Configure cryptsetup hook', command='echo KEYFILE_PATTERN="/root/luks_*.keyfile" | tee -a /mnt/etc/cryptsetup-initramfs/conf-hook'),
+
+        # Setup fstab
+        dict(description='Linux - Configure fstab for {PART2_LABEL}', command='echo "UUID={PART2_UUID} /boot/efi vfat rw,relatime,fmask=0077,dmask=0077,codepage=437,iocharset=ascii,shortname=mixed,utf8,errors=remount-ro 0 0" | tee -a /mnt/etc/fstab', provides=['fstab']),
+        dict(description='Linux - Configure fstab for {PART3_LABEL}', command='echo "/dev/mapper/{PART3_UUID} / {PART3_FSTYPE} {PART3_MOUNT_OPTS} 0 1" | tee /mnt/etc/fstab', provides=['fstab']),
+        dict(description='Linux - Configure fstab for {PART4_LABEL}', command='echo "/dev/mapper/{PART4_UUID} /storage btrfs defaults,subvol=@snapshots,{PART4_MOUNT_OPTS}    0  2" | tee -a /mnt/etc/fstab', provides=['fstab']),
+        dict(description='Linux - Configure fstab for swapfile', command='echo "/swapfile none swap sw 0 0" | tee -a /mnt/etc/fstab', provides=['fstab']),
+
+        # Setup bootloader
+        dict(description='Linux - Configure grub', command='echo GRUB_ENABLE_CRYPTODISK=y | tee -a /mnt/etc/default/grub', provides=['grub']),
+        dict(description='Linux - Configure grub', command='echo GRUB_CMDLINE_LINUX="cryptdevice=UUID={PART3_UUID}:{PART3_UUID}" | tee -a /mnt/etc/default/grub', provides=['grub']),
+        dict(description='Linux - Configure grub', command='echo GRUB_DISTRIBUTOR="{DEVICE_NAME}" | tee -a /mnt/etc/default/grub', provides=['grub']),
+        dict(description='Linux - Configure intitamfs', command='echo UMASK=0077 | tee -a /mnt/etc/initramfs-tools/initramfs.conf'),
+    ]
+
+    shell.execute_all(config_steps, workers=WORKERS)
+
+    chroot.execute('Linux - Update initramfs', 'update-initramfs -u -k all')
+    chroot.execute('Linux - Update grub', 'update-grub')
+    chroot.execute('Linux - Install grub', 'grub-install {DEVICE}')
 
     # Create user
-    shell.execute('Linux - Create user {USER_NAME}',  'chroot /mnt bash --login -c "useradd -m {USER_NAME} -s /bin/bash"')
-    shell.execute('Linux - Set password {USER_NAME}', 'chroot /mnt bash --login -c "chpasswd"', input='{USER_NAME}:{USER_PASS}\n')
-    shell.execute('Linux - Add sudo to {USER_NAME}',  'chroot /mnt bash --login -c "usermod -aG sudo {USER_NAME}"')
+    chroot.execute('Linux - Create user {USER_NAME}',  'useradd -m {USER_NAME} -s /bin/bash')
+    chroot.execute('Linux - Set password {USER_NAME}', 'chpasswd', input='{USER_NAME}:{USER_PASS}\n')
+    chroot.execute('Linux - Add sudo to {USER_NAME}',  'usermod -aG sudo {USER_NAME}')
 
     # Allow user access to storage
     shell.execute('Linux - Create storage directory', 'mkdir /mnt/storage')
-    shell.execute('Linux - Mount storage', 'mount /dev/mapper/{PART4_UUID} /mnt/storage')
+    shell.execute('Linux - Mount storage', 'mount /dev/mapper/{PART4_UUID} /mnt/storage', replay=True)
     shell.execute('Linux - Set permissions for storage', 'chown -R 1000:1000 /mnt/storage')
 
     # Auto login the user
@@ -284,12 +480,46 @@ if __name__ == "__main__":
     shell.execute('Linux - Reminder for {USER_NAME}', 'echo "echo Storage partition is mounted at /storage ;)" | tee -a /mnt/home/{USER_NAME}/.bashrc')
 
     # Start Services
-    shell.execute('Linux - Start Network Manager', 'chroot /mnt bash --login -c "systemctl enable NetworkManager"')
+    chroot.execute('Linux - Start Network Manager', 'systemctl enable NetworkManager')
+
+    # Unlock and mount the storage partition on this computer when the device is plugged in again (see lib/automount.py),
+    # at the mount point of secure_backup.py, with the tuned mount options
+    if HOST_AUTOMOUNT:
+        def automount():
+            if os.environ.get('PART4_FORMAT') == "BTRFS":
+                return AutoMount(os.environ['PART4_UUID'], options='subvol=@snapshots,' + os.environ.get('PART4_MOUNT_OPTS', ''), fstype='btrfs')
+            return AutoMount(os.environ['PART4_UUID'], fstype='ext4')
+        shell.execute('Host - Install auto-mount of {PART4_LABEL}', 'install udev rule and service for {PART4_UUID}',
+                      function=lambda progress: automount().install(os.environ['HOST_KEYFILE']) and automount().reload())
+        shell.execute('Host - Benchmark unlock of {PART4_LABEL}', 'cryptsetup open --test-passphrase --key-slot {HOST_KEY_SLOT} {PART4}', check_returncode=False,
+                      function=lambda progress: luks.benchmark(os.environ['PART4_LABEL'] + ' host keyfile', os.environ['PART4'], key_file=os.environ['HOST_KEYFILE'],
+                                                               key_slot=AutoMount.KEY_SLOT) is not None)
 
     # -- Cleanup ---
+    chroot.close()
     shell.execute('Partitions  - Umount', 'umount --recursive /mnt')
     shell.execute('Partition 4 - Close {PART4_LABEL}', 'cryptsetup luksClose {PART4_UUID}')
     shell.execute('Partition 3 - Close {PART3_LABEL}', 'cryptsetup luksClose {PART3_UUID}')
     # -- Cleanup ---
 
+    # The keyfiles only remain in /run while a failed installation can be resumed
+    if not args.plan and not shell.failed:
+        shell.execute('Keyfiles - Remove', 'rm -rf /run/secure-usb')
+
+    shell.close()
+    if dashboard: dashboard.stop()
+    # A failed installation can be continued with --resume
+    if not args.plan and not shell.failed:
+        journal.finish()
+
+    if args.plan:
+        plan.print(console)
+    else:
+        profiler.report(console)
+        luks.report(console, profiler)
+        if pkgcache.result:
+            console.print(f"Package cache: {pkgcache.result['reused']} packages reused, {pkgcache.result['downloaded']} downloaded "
+                          f"({pkgcache.result['downloaded_bytes'] / 1e6:.0f} MB), {pkgcache.result['bytes'] / 1e6:.0f} MB kept", style='info')
+        profiler.save('install.profile.json')
+
     console.print(Rule("Done"))
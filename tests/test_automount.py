@@ -0,0 +1,69 @@
+import os
+import subprocess
+
+import pytest
+
+from lib import automount
+from lib.automount import AutoMount
+
+UUID = '0f3c2a8e-5d1b-4c7e-9a61-2b8d4e6f1a03'
+
+@pytest.fixture
+def commands(monkeypatch):
+    """Records the commands run by AutoMount instead of running them; a command named in 'fail' fails."""
+    run = []
+    fail = set()
+    def fake_run(arguments, **kwargs):
+        run.append([os.path.basename(arguments[0])] + arguments[1:])
+        failed = os.path.basename(arguments[0]) in fail
+        return subprocess.CompletedProcess(arguments, 1 if failed else 0, '', 'failed' if failed else '')
+    monkeypatch.setattr(automount.subprocess, 'run', fake_run)
+    return run, fail
+
+def test_install(tmp_path):
+    keyfile = tmp_path / 'host.keyfile'
+    keyfile.write_bytes(os.urandom(2048))
+    mount = AutoMount(UUID, options='subvol=@snapshots,noatime', root=str(tmp_path / 'root'))
+    assert mount.install(str(keyfile))
+
+    installed = tmp_path / 'root' / 'etc' / 'secure-usb' / f'luks_{UUID}.keyfile'
+    assert installed.read_bytes() == keyfile.read_bytes()
+    assert os.stat(installed).st_mode & 0o777 == 0o400
+    rule = (tmp_path / 'root' / 'etc' / 'udev' / 'rules.d' / f'99-secure-usb-{UUID}.rules').read_text()
+    assert f'ENV{{ID_FS_UUID}}=="{UUID}"' in rule and f'SYSTEMD_WANTS}}+="secure-usb-{UUID}.service"' in rule
+    unit = (tmp_path / 'root' / 'etc' / 'systemd' / 'system' / f'secure-usb-{UUID}.service').read_text()
+    device = 'dev-disk-by\\x2duuid-' + UUID.replace('-', '\\x2d') + '.device'
+    assert f'BindsTo={device}' in unit
+    assert '--key-slot 2' in unit and 'ExecStop=-' in unit
+
+def test_handle_add_and_remove(tmp_path, commands):
+    run, _ = commands
+    mount = AutoMount(UUID, mount_point=str(tmp_path / 'storage'), options='noatime', root=str(tmp_path))
+    uevent = {'ACTION': 'add', 'SUBSYSTEM': 'block', 'ID_FS_UUID': UUID, 'DEVNAME': '/dev/loop7'}
+
+    assert mount.handle(uevent)
+    assert mount.result['action'] == 'add' and mount.result['device'] == '/dev/loop7' and mount.result['error'] is None
+    assert run == [
+        ['cryptsetup', 'open', '--key-file', str(tmp_path / 'etc' / 'secure-usb' / f'luks_{UUID}.keyfile'), '--key-slot', '2', '/dev/loop7', UUID],
+        ['mkdir', '-p', str(tmp_path / 'storage')],
+        ['mount', '-t', 'btrfs', '-o', 'noatime', f'/dev/mapper/{UUID}', str(tmp_path / 'storage')],
+    ]
+
+    run.clear()
+    assert mount.handle(dict(uevent, ACTION='remove'))
+    assert run == [['umount', str(tmp_path / 'storage')], ['cryptsetup', 'close', UUID]]
+
+def test_handle_ignores_other_devices(commands):
+    run, _ = commands
+    mount = AutoMount(UUID)
+    assert not mount.handle({'ACTION': 'add', 'SUBSYSTEM': 'block', 'ID_FS_UUID': 'another', 'DEVNAME': '/dev/sdz4'})
+    assert not mount.handle({'ACTION': 'change', 'SUBSYSTEM': 'block', 'ID_FS_UUID': UUID, 'DEVNAME': '/dev/sdz4'})
+    assert run == []
+
+def test_handle_stops_at_a_failed_unlock(commands):
+    run, fail = commands
+    fail.add('cryptsetup')
+    mount = AutoMount(UUID)
+    assert not mount.handle({'ACTION': 'add', 'SUBSYSTEM': 'block', 'ID_FS_UUID': UUID, 'DEVNAME': '/dev/sdz4'})
+    assert mount.result['error'] == 'failed'
+    assert len(run) == 1
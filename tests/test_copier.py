@@ -0,0 +1,35 @@
+import os
+import filecmp
+
+from lib.copier import Copier
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_copy_tree(tmp_path):
+    source, destination = str(tmp_path / 'source'), str(tmp_path / 'destination')
+    write(os.path.join(source, 'small'), b'small')
+    write(os.path.join(source, 'sub', 'large'), os.urandom(1024 * 1024))
+    os.chmod(os.path.join(source, 'small'), 0o640)
+
+    result = Copier(workers=2).copy_tree(source, destination)
+    assert result['files'] == 2 and result['copied'] == 2 and result['errors'] == []
+    for name in ('small', 'sub/large'):
+        assert filecmp.cmp(os.path.join(source, name), os.path.join(destination, name), shallow=False)
+    assert os.stat(os.path.join(destination, 'small')).st_mode & 0o777 == 0o640
+
+    # Unchanged files are skipped
+    result = Copier(workers=2).copy_tree(source, destination)
+    assert result['skipped'] == 2 and result['copied'] == 0
+
+def test_special_files_are_not_copied(tmp_path):
+    source, destination = str(tmp_path / 'source'), str(tmp_path / 'destination')
+    write(os.path.join(source, 'file'), b'file')
+    os.mkfifo(os.path.join(source, 'fifo'))
+
+    result = Copier(workers=2).copy_tree(source, destination)
+    assert result['copied'] == 1
+    assert result['errors'] == [(os.path.join(source, 'fifo'), 'not a regular file')]
+    assert not os.path.exists(os.path.join(destination, 'fifo'))
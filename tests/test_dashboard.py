@@ -0,0 +1,23 @@
+import io
+import pytest
+
+pytest.importorskip('rich')
+
+from rich.console import Console
+from lib.dashboard import Dashboard
+
+def test_overall_bar_completes_when_stopped():
+    dashboard = Dashboard(Console(file=io.StringIO()), phases=2, refresh_per_second=100)
+    dashboard.start()
+    dashboard.phase('Partitioning')
+    dashboard.phase('Installing')
+    assert dashboard.overall.tasks[0].completed == 1     # The last phase is running
+    dashboard.stop()
+    assert dashboard.overall.tasks[0].completed == dashboard.overall.tasks[0].total == 2
+
+def test_overall_bar_shows_the_phases_reached():
+    dashboard = Dashboard(Console(file=io.StringIO()), phases=3, refresh_per_second=100)
+    dashboard.start()
+    dashboard.phase('Partitioning')
+    dashboard.stop()
+    assert dashboard.overall.tasks[0].completed == 1
@@ -0,0 +1,84 @@
+import logging
+import pytest
+
+pytest.importorskip('rich')
+
+from rich.console import Console
+from lib.journal import Journal
+from lib.shell import Shell
+
+@pytest.fixture
+def config(monkeypatch):
+    """The configuration of an installation, and a fixed device size."""
+    for name in Journal.CONFIG_VARS:
+        monkeypatch.setenv(name, '')
+    monkeypatch.setenv('DEVICE', '/dev/sdz')
+    monkeypatch.setenv('USER_NAME', 'user')
+    monkeypatch.setenv('UUID', '')      # Set by the steps, restored after the test
+    monkeypatch.setattr(Journal, '_device_size', staticmethod(lambda device: '62521344'))
+
+def shell(tmp_path, journal):
+    return Shell(console=Console(), log=logging.getLogger('test_journal'), log_file=str(tmp_path / 'install.log'), journal=journal)
+
+def install(tmp_path, resume, fail=False, verify='true'):
+    """Runs a small installation, each step appending its name to 'ran'. Returns the names of the steps that ran."""
+    ran = tmp_path / 'ran'
+    ran.write_text('')
+    journal = Journal(str(tmp_path / 'install.journal.json'))
+    resumed = journal.start(resume=resume)
+    run = shell(tmp_path, journal)
+    run.execute('Partition', f'echo partition >> {ran}')
+    run.execute('Format', f'echo format >> {ran}; echo 1234', output_var='UUID', verify=verify)
+    run.execute('Mount {UUID}', f'echo mount >> {ran}', replay=True)
+    run.execute('Install', f'echo install >> {ran}; {"false" if fail else "true"}')
+    return resumed, ran.read_text().split()
+
+def test_completed_steps_are_skipped_on_resume(tmp_path, config, monkeypatch):
+    resumed, ran = install(tmp_path, resume=True, fail=True)
+    assert not resumed
+    assert ran == ['partition', 'format', 'mount', 'install']
+
+    monkeypatch.delenv('UUID')
+    resumed, ran = install(tmp_path, resume=True)
+    assert resumed
+    assert ran == ['mount', 'install']      # 'Mount' is replayed, 'Install' failed before
+    assert Journal(str(tmp_path / 'install.journal.json')).outputs() == {'UUID': '1234'}
+
+def test_failed_verify_runs_the_step_again(tmp_path, config):
+    install(tmp_path, resume=True, fail=True)
+    resumed, ran = install(tmp_path, resume=True, verify='false')
+    assert resumed
+    assert ran == ['format', 'mount', 'install']    # The verified step, and every step after it
+
+def test_other_configuration_starts_a_new_journal(tmp_path, config, monkeypatch):
+    install(tmp_path, resume=True, fail=True)
+    monkeypatch.setenv('USER_NAME', 'other')
+    resumed, ran = install(tmp_path, resume=True)
+    assert not resumed
+    assert ran == ['partition', 'format', 'mount', 'install']
+
+def test_other_device_size_starts_a_new_journal(tmp_path, config, monkeypatch):
+    install(tmp_path, resume=True, fail=True)
+    monkeypatch.setattr(Journal, '_device_size', staticmethod(lambda device: '123731968'))
+    resumed, ran = install(tmp_path, resume=True)
+    assert not resumed
+    assert ran == ['partition', 'format', 'mount', 'install']
+
+def test_finished_journal_is_not_resumed(tmp_path, config):
+    journal = Journal(str(tmp_path / 'install.journal.json'))
+    journal.start()
+    journal.complete(journal.key('Partition', 'sgdisk'))
+    journal.finish()
+    assert not Journal(str(tmp_path / 'install.journal.json')).start(resume=True)
+
+def test_repeated_steps_have_their_own_key(tmp_path, config):
+    journal = Journal(str(tmp_path / 'install.journal.json'))
+    journal.start()
+    first, second = journal.key('Sync', 'sync'), journal.key('Sync', 'sync')
+    journal.complete(first)
+
+    journal = Journal(str(tmp_path / 'install.journal.json'))
+    assert journal.start(resume=True)
+    assert journal.completed(journal.key('Sync', 'sync')) == {}
+    assert journal.completed(journal.key('Sync', 'sync')) is None
+    assert first != second
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip('rich')
+
+from lib.luks import Luks
+
+class Profile:
+    """The profiled steps of a run (see Profiler.record)."""
+
+    def __init__(self, *commands, returncode=0):
+        self.steps = [{'description': command.split()[1], 'command': command, 'returncode': returncode, 'wall': 5.0} for command in commands]
+
+def luks():
+    luks = Luks(grub_latency=3.0, floor=1000)
+    luks.host_rate = 1000000.0      # PBKDF2 iterations per second, instead of measuring
+    return luks
+
+def test_derivations_of_format_and_add_key():
+    keyfile = '--pbkdf pbkdf2 --hash sha256 --pbkdf-force-iterations 1000'
+    profile = Profile(
+        'dd bs=512 count=4 if=/dev/random of=/run/k3 iflag=fullblock && chmod 400 /run/k3',
+        f'cryptsetup luksFormat -q --type luks1 {keyfile} --label LINUX /dev/sdz3 /run/k3',
+        'cryptsetup luksAddKey --pbkdf pbkdf2 --hash sha256 --pbkdf-force-iterations 500000 --key-file /run/k3 /dev/sdz3',
+        f'cryptsetup luksFormat -q --type luks2 --cipher aes-xts-plain64 {keyfile} --label STORAGE /dev/sdz4 /run/k4',
+        'cryptsetup luksAddKey --key-file /run/k4 /dev/sdz4',
+        f'cryptsetup luksAddKey {keyfile} --key-slot 2 --key-file /run/k4 /dev/sdz4 /run/host',
+        'cryptsetup open --test-passphrase /dev/sdz3',
+    )
+    derivations = luks().derivations(profile)
+
+    assert [(derivation['device'], derivation['slot']) for derivation in derivations] == [
+        ('/dev/sdz3', 0),                       # Format: the keyfile slot
+        ('/dev/sdz3', 0), ('/dev/sdz3', 1),     # Add key: unlock with the keyfile, derive the passphrase slot
+        ('/dev/sdz4', 0),
+        ('/dev/sdz4', 0), ('/dev/sdz4', 1),
+        ('/dev/sdz4', 0), ('/dev/sdz4', 2),
+    ]
+    seconds = [derivation['seconds'] for derivation in derivations]
+    assert seconds == pytest.approx([0.001, 0.001, 0.5, 0.001, 0.001, Luks.ITER_TIME, 0.001, 0.001])
+
+def test_opens_and_failed_steps():
+    instance = luks()
+    profile = Profile('cryptsetup luksFormat -q --pbkdf pbkdf2 --pbkdf-force-iterations 2000 /dev/sdz3 /run/k3')
+    instance.opened = [('LINUX', '/dev/sdz3', Luks.KEYFILE_SLOT), ('STORAGE', '/dev/sdz4', Luks.PASSPHRASE_SLOT)]
+    derivations = instance.derivations(profile)
+    assert len(derivations) == 3
+    assert [derivation['seconds'] for derivation in derivations] == pytest.approx([0.002, 0.002, Luks.ITER_TIME])
+
+    # A failed step is not counted
+    instance.opened = []
+    assert instance.derivations(Profile('cryptsetup luksAddKey --key-file /run/k3 /dev/sdz3', returncode=1)) == []
@@ -0,0 +1,65 @@
+import os
+import hashlib
+
+from lib.pkgcache import PackageCache
+
+def write_debs(directory, debs):
+    """Writes fake packages {file name: content} into a directory."""
+    for name, content in debs.items():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+
+def write_index(lists, debs):
+    """Writes an apt Packages index of the packages {file name: content}."""
+    paragraphs = []
+    for name, content in debs.items():
+        paragraphs.append(f"Package: {name.split('_')[0]}\nVersion: {name.split('_')[1]}\nFilename: pool/main/{name}\n"
+                          f"Size: {len(content)}\nSHA256: {hashlib.sha256(content).hexdigest()}\n")
+    with open(os.path.join(lists, 'deb.debian.org_debian_dists_stable_main_binary-amd64_Packages'), 'w') as f:
+        f.write('\n'.join(paragraphs))
+
+def write_status(path, packages):
+    """Writes a dpkg status file with the installed packages [(name, version, architecture)]."""
+    with open(path, 'w') as f:
+        f.write('\n'.join(f'Package: {name}\nStatus: install ok installed\nVersion: {version}\nArchitecture: {architecture}\n'
+                          for name, version, architecture in packages))
+
+def test_verify_removes_mismatches(tmp_path):
+    cache, lists = tmp_path / 'debs', tmp_path / 'lists'
+    cache.mkdir()
+    lists.mkdir()
+    write_debs(cache, {'a_1.0_amd64.deb': b'a' * 100, 'b_2.0_amd64.deb': b'b' * 200, 'c_3.0_all.deb': b'c' * 300, 'x_1_all.deb': b'x'})
+    # The mirror has another build of b (same size, other SHA256) and a larger c (a partial download); x is unknown
+    write_index(lists, {'a_1.0_amd64.deb': b'a' * 100, 'b_2.0_amd64.deb': b'B' * 200, 'c_3.0_all.deb': b'c' * 400})
+
+    counts = PackageCache(str(cache)).verify(str(lists))
+
+    assert counts == {'verified': 1, 'removed': 2, 'unknown': 1}
+    assert sorted(PackageCache(str(cache)).debs()) == ['a_1.0_amd64.deb', 'x_1_all.deb']
+
+    # A package changed after it was verified is hashed again
+    write_debs(cache, {'a_1.0_amd64.deb': b'A' * 100})
+    assert PackageCache(str(cache)).verify(str(lists))['removed'] == 1
+
+def test_update_evicts_least_recently_used(tmp_path):
+    cache, lists = tmp_path / 'debs', tmp_path / 'lists'
+    cache.mkdir()
+    lists.mkdir()
+    debs = {'old_1.0_all.deb': b'o' * 1000, 'a_1.0_amd64.deb': b'a' * 1000, 'c_3.0_all.deb': b'c' * 1000}
+    write_debs(cache, debs)
+    write_index(lists, debs)
+    os.utime(cache / 'old_1.0_all.deb', (1, 1))     # Used long ago
+
+    pkgcache = PackageCache(str(cache), max_size=2500)
+    pkgcache.verify(str(lists))
+    write_debs(cache, {'new_9_all.deb': b'n' * 100})   # Downloaded by apt
+    status = tmp_path / 'status'
+    write_status(status, [('a', '1.0', 'amd64'), ('c', '1:3.0', 'all'), ('new', '9', 'all')])
+
+    result = pkgcache.update(str(status))
+
+    assert result['evicted'] == 1
+    assert result['reused'] == 2
+    assert result['downloaded'] == 1 and result['downloaded_bytes'] == 100
+    assert result['bytes'] == 2100 and result['files'] == 3
+    assert 'old_1.0_all.deb' not in pkgcache.debs() and 'new_9_all.deb' in pkgcache.debs()
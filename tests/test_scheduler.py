@@ -0,0 +1,79 @@
+import time
+import threading
+import contextlib
+
+from lib.scheduler import Scheduler
+
+class FakeShell:
+    """Runs steps by recording them: a step sleeps 'seconds' (its command) and fails when its description starts with 'fail'."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []    # ('start' | 'end', description) in order
+
+    @contextlib.contextmanager
+    def section(self):
+        yield
+
+    def execute(self, description, command, **kwargs):
+        with self.lock:
+            self.events.append(('start', description))
+        time.sleep(float(command))
+        with self.lock:
+            self.events.append(('end', description))
+        return not description.startswith('fail')
+
+    def before(self, first, second):
+        """True if step 'first' ended before step 'second' started."""
+        return self.events.index(('end', first)) < self.events.index(('start', second))
+
+def step(description, seconds=0.05, **kwargs):
+    return dict(description=description, command=str(seconds), **kwargs)
+
+def test_graph_orders_providers_of_a_shared_resource():
+    steps = [
+        step('fstab root', provides=['fstab']),
+        step('crypttab 3', provides=['crypttab']),
+        step('fstab storage', provides=['fstab']),
+        step('crypttab 4', provides=['crypttab']),
+        step('initramfs', requires=['fstab', 'crypttab']),
+        step('fstab swap', provides=['fstab']),
+    ]
+    assert Scheduler(None).graph(steps) == [set(), set(), {0}, {1}, {2, 3}, {2, 4}]
+
+def test_graph_variables_are_implicit_resources():
+    steps = [
+        step('Get UUID', output_var='PART3_UUID'),
+        dict(description='Open {PART3_LABEL}', command='cryptsetup open {PART3} {PART3_UUID}'),
+        step('Label', provides=['PART3_LABEL']),
+        dict(description='Unrelated', command='true'),
+    ]
+    # The open reads the UUID (written before it); the label is written after the open read it
+    assert Scheduler(None).graph(steps) == [set(), {0}, {1}, set()]
+
+def test_run_respects_dependencies():
+    shell = FakeShell()
+    steps = [
+        step('fstab root', 0.1, provides=['fstab']),
+        step('fstab storage', 0.05, provides=['fstab']),
+        step('crypttab', 0.05, provides=['crypttab']),
+        step('initramfs', 0.01, requires=['fstab', 'crypttab']),
+    ]
+    assert Scheduler(shell, workers=4).run(steps)
+    assert shell.before('fstab root', 'fstab storage')
+    assert shell.before('fstab storage', 'initramfs') and shell.before('crypttab', 'initramfs')
+    # Independent steps overlap
+    assert shell.events.index(('start', 'crypttab')) < shell.events.index(('end', 'fstab root'))
+
+def test_run_stops_after_a_failed_step():
+    shell = FakeShell()
+    steps = [
+        step('fail format', 0.05, provides=['PART3_LUKS']),
+        step('slow', 0.2, provides=['mnt']),
+        step('open', 0.01, requires=['PART3_LUKS']),
+        step('after slow', 0.01, requires=['mnt']),
+    ]
+    assert not Scheduler(shell, workers=4).run(steps)
+    # The running step completes, no other step starts
+    assert {description for kind, description in shell.events if kind == 'start'} == {'fail format', 'slow'}
+    assert ('end', 'slow') in shell.events
@@ -0,0 +1,56 @@
+import os
+import uuid
+
+from lib import session as session_module
+from lib.session import BashSession
+
+def run(command, **kwargs):
+    bash = BashSession()
+    try:
+        return bash.run(command, **kwargs)
+    finally:
+        bash.close()
+
+def test_output_and_exit_status():
+    returncode, stdout, stderr, cpu, value = run('echo out; echo err >&2')
+    assert (returncode, stdout, stderr, value) == (0, 'out', 'err', None)
+    assert cpu is not None
+    assert run('echo failing; exit 3')[:2] == (3, 'failing')
+    assert run('false')[0] == 1
+
+def test_output_without_trailing_newline():
+    assert run("printf 'no newline'; printf 'err' >&2", keep=True)[:3] == (0, 'no newline', 'err')
+    assert run("printf 'a\\n\\nb'", keep=True)[4] == 'a\n\nb'
+
+def test_input():
+    assert run('cat', input='line 1\nline 2')[:2] == (0, 'line 1\nline 2')
+    assert run('read -r first; echo "got $first"', input='secret pass\n')[1] == 'got secret pass'
+
+def test_output_resembling_the_sentinel(monkeypatch):
+    sentinel = uuid.UUID(int=0xabc)
+    monkeypatch.setattr(session_module.uuid, 'uuid4', lambda: sentinel)
+    command = f"echo {sentinel.hex}; echo {sentinel.hex}x 5; echo 'say {sentinel.hex} 0'; echo ' {sentinel.hex}' >&2; exit 4"
+    returncode, stdout, stderr, _, _ = run(command)
+    assert returncode == 4
+    assert stdout == f'{sentinel.hex}\n{sentinel.hex}x 5\nsay {sentinel.hex} 0'
+    assert stderr == sentinel.hex
+
+def test_commands_do_not_leak_into_the_session(monkeypatch):
+    bash = BashSession()
+    try:
+        assert bash.run('cd /; set -e; X=1; exit 2')[0] == 2
+        assert bash.run('echo "$PWD ${X:-unset}"')[1] == f'{os.getcwd()} unset'
+        monkeypatch.setenv('SESSION_TEST', 'exported value')
+        assert bash.run('echo "$SESSION_TEST"')[1] == 'exported value'
+        monkeypatch.delenv('SESSION_TEST')
+        assert bash.run('echo "${SESSION_TEST:-unset}"')[1] == 'unset'
+    finally:
+        bash.close()
+
+def test_restart_after_a_crash():
+    bash = BashSession()
+    try:
+        assert bash.run('kill -9 $$')[0] == -1
+        assert bash.run('echo again')[:2] == (0, 'again')
+    finally:
+        bash.close()
@@ -0,0 +1,78 @@
+import os
+import filecmp
+
+import pytest
+
+pytest.importorskip('rich')
+
+from lib.store import Store, MiB
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_backup_restore_round_trip(tmp_path):
+    source = str(tmp_path / 'source')
+    write(os.path.join(source, 'big'), os.urandom(6 * MiB))
+    write(os.path.join(source, 'sub', 'text'), b'some text\n' * 1000)
+    write(os.path.join(source, 'sub', 'empty'), b'')
+    os.chmod(os.path.join(source, 'sub', 'text'), 0o600)
+
+    store = Store(str(tmp_path / 'store'), workers=2)
+    assert store.backup(source)
+    assert store.result['files'] == 3 and store.result['errors'] == []
+    assert store.result['read'] == 6 * MiB + 10000
+
+    restored = str(tmp_path / 'restored')
+    assert store.restore(store.snapshots(source)[-1], restored) == []
+    for name in ('big', 'sub/text', 'sub/empty'):
+        assert filecmp.cmp(os.path.join(source, name), os.path.join(restored, name), shallow=False)
+    assert os.stat(os.path.join(restored, 'sub', 'text')).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.join(restored, 'big')).st_mtime_ns == os.stat(os.path.join(source, 'big')).st_mtime_ns
+
+def test_backup_deduplicates(tmp_path):
+    source = str(tmp_path / 'source')
+    data = os.urandom(8 * MiB)
+    write(os.path.join(source, 'a'), data)
+    write(os.path.join(source, 'copy'), data)
+
+    store = Store(str(tmp_path / 'store'), workers=2)
+    assert store.backup(source)
+    first = store.result
+    # The copy is made of the same chunks, which are stored once
+    assert first['new_chunks'] == first['chunks'] // 2
+
+    # Unchanged files are not read
+    assert store.backup(source)
+    assert store.result['unchanged'] == 2 and store.result['read'] == 0 and store.result['new_chunks'] == 0
+
+    # An insertion only changes the chunks around it
+    write(os.path.join(source, 'a'), data[:3 * MiB] + b'inserted' + data[3 * MiB:])
+    assert store.backup(source)
+    assert store.result['unchanged'] == 1
+    assert 1 <= store.result['new_chunks'] <= 2
+    assert store.result['written'] < 2 * Store.MAX_CHUNK
+
+    restored = str(tmp_path / 'restored')
+    assert store.restore(store.snapshots(source)[-1], restored) == []
+    assert filecmp.cmp(os.path.join(source, 'a'), os.path.join(restored, 'a'), shallow=False)
+
+def test_sources_with_similar_names_are_kept_apart(tmp_path):
+    sources = [str(tmp_path / 'user-a'), str(tmp_path / 'user' / 'a'), str(tmp_path / 'user'), str(tmp_path / 'user.old')]
+    for number, source in enumerate(sources):
+        # Same relative path, size and modification time, other content
+        write(os.path.join(source, 'file'), b'%d' % number)
+        os.utime(os.path.join(source, 'file'), ns=(10 ** 18, 10 ** 18))
+    store = Store(str(tmp_path / 'store'), workers=1)
+    for source in sources[:2] + sources[3:]:
+        assert store.backup(source)
+    # Each source has its own backups; a new source does not reuse the chunks of another one
+    for source in sources:
+        assert all(store.manifest(name)['source'] == source for name in store.snapshots(source))
+    assert store.backup(sources[2])
+    assert store.result['unchanged'] == 0
+    restored = str(tmp_path / 'restored')
+    assert store.restore(store.snapshots(sources[2])[-1], restored) == []
+    with open(os.path.join(restored, 'file'), 'rb') as f:
+        assert f.read() == b'2'
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+from lib.watch import Watch
+
+def watcher(tmp_path):
+    """Returns a Watch of tmp_path/source with its journal in tmp_path/state, announced as a running watcher."""
+    os.makedirs(tmp_path / 'source', exist_ok=True)
+    watch = Watch(str(tmp_path / 'source'), str(tmp_path / 'state'), interval=0.1)
+    os.makedirs(watch.directory, exist_ok=True)
+    watch._announce()   # This process is the watcher
+    return watch
+
+def test_compact():
+    records = {('F', 'a/f'), ('T', 'a'), ('T', 'a/b'), ('F', 'ab'), ('T', 'c/d'), ('F', 'c/d/e'), ('F', 'c/e')}
+    assert Watch.compact(records) == {('T', 'a'), ('F', 'ab'), ('T', 'c/d'), ('F', 'c/e')}
+    assert Watch.compact(records | {('A', '')}) == {('A', '')}
+
+def test_take_and_commit(tmp_path):
+    watch = watcher(tmp_path)
+    assert watch.take() == {'files': set(), 'trees': set()}
+
+    watch.pending |= {('F', 'a'), ('T', 'd'), ('F', 'd/x')}
+    watch._flush()
+    assert watch.take() == {'files': {'a'}, 'trees': {'d'}}
+
+    # A failed backup does not commit: its records are taken again, with the new ones
+    watch.pending.add(('F', 'b'))
+    watch._flush()
+    assert watch.take() == {'files': {'a', 'b'}, 'trees': {'d'}}
+    watch.commit()
+    assert watch.take() == {'files': set(), 'trees': set()}
+
+    # Changes may have been missed: a full scan
+    watch.pending.add(('A', ''))
+    watch._flush()
+    assert watch.take() is None
+    watch.commit()
+
+    # No watcher running: a full scan
+    os.remove(watch.pid_file)
+    assert watch.take() is None
+
+def test_journal_is_compacted(tmp_path):
+    watch = watcher(tmp_path)
+    watch.compact_size = 1000
+    for number in range(200):
+        watch.pending |= {('F', f'tree/file{number}'), ('F', 'log')}
+        watch._flush()
+    watch.pending.add(('T', 'tree'))
+    watch._flush()
+    assert os.path.getsize(watch.journal) < 1000
+    assert Watch._read(watch.journal) == {('T', 'tree'), ('F', 'log')}
+
+def test_open_files_are_recorded_again(tmp_path):
+    watch = watcher(tmp_path)
+    watch.pending.add(('F', 'log'))
+    watch.writing.add('log')
+    watch._flush()
+    assert watch.take() == {'files': {'log'}, 'trees': set()}
+    watch.commit()
+    watch._flush()
+    assert watch.take() == {'files': {'log'}, 'trees': set()}
+    watch.commit()
+    watch.writing.discard('log')
+    watch._flush()
+    assert watch.take() == {'files': set(), 'trees': set()}
+
+def test_watcher_records_changes(tmp_path):
+    source, state = tmp_path / 'source', tmp_path / 'state'
+    os.makedirs(source / 'a')
+    (source / 'a' / 'f').write_text('f')
+    watch = Watch(str(source), str(state))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-c', f'from lib.watch import Watch; Watch({str(source)!r}, {str(state)!r}, interval=0.1).run()'], cwd=root)
+    try:
+        for _ in range(100):
+            if watch.running():
+                break
+            time.sleep(0.05)
+        assert watch.take() is None     # Started after the previous backup
+        watch.commit()
+
+        (source / 'a' / 'f').write_text('changed')
+        os.makedirs(source / 'new' / 'deep')
+        (source / 'new' / 'deep' / 'g').write_text('g')
+        time.sleep(0.5)
+        assert watch.take() == {'files': {'a/f'}, 'trees': {'new'}}
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    assert not watch.running()
+
+def test_sources_have_their_own_journal(tmp_path):
+    sources = ['/home/user-a', '/home/user/a', '/home/user', '/home/user.old', '/root', '/']
+    journals = {Watch(source, str(tmp_path)).journal for source in sources}
+    assert len(journals) == len(sources)
+    assert Watch('/home', str(tmp_path)).journal == str(tmp_path / 'home.journal')
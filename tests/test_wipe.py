@@ -0,0 +1,46 @@
+import os
+
+from lib.wipe import Wipe
+
+KiB = 1024
+MiB = 1024 * KiB
+
+def zeroed(tmp_path, size=4 * MiB):
+    """Returns a file of zeroes."""
+    path = str(tmp_path / 'device')
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return path
+
+def test_run_overwrites_the_ranges(tmp_path):
+    path = zeroed(tmp_path)
+    ranges = [(0, 1 * MiB), (2 * MiB, 1 * MiB + 512)]
+    wipe = Wipe(path, ranges=ranges, workers=2, chunk_size=64 * KiB)
+    assert wipe.run()
+    assert wipe.offset == 3 * MiB + 512
+    assert wipe.verify(samples=64)
+    # Outside the ranges nothing was written
+    assert wipe.verify(samples=64, expect='uniform', ranges=[(1 * MiB, 1 * MiB), (3 * MiB + 4 * KiB, 1 * MiB - 4 * KiB)])
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(data) == 4 * MiB and data[3 * MiB + 512:] == bytes(1 * MiB - 512)
+
+def test_cancel_and_resume(tmp_path):
+    path = zeroed(tmp_path)
+    wipe = Wipe(path, workers=2, chunk_size=64 * KiB)
+    wipe.cancel.set()
+    assert not wipe.run()
+    assert wipe.offset == 0
+    assert not wipe.verify(samples=16)
+
+    wipe.cancel.clear()
+    assert wipe.run(offset=wipe.offset)
+    assert wipe.offset == 4 * MiB
+    assert wipe.verify(samples=64)
+
+def test_verify_finds_unwiped_blocks(tmp_path):
+    path = zeroed(tmp_path)
+    wipe = Wipe(path, ranges=[(0, 2 * MiB)], workers=2, chunk_size=64 * KiB)
+    assert wipe.run()
+    assert not wipe.verify(samples=64, ranges=[(0, 4 * MiB)])
+    assert wipe.failures and all(offset >= 2 * MiB for offset in wipe.failures)